@@ -7,12 +7,29 @@ from flask_login import LoginManager
 from flask_pagedown import PageDown
 
 from config import config
+from .autocomplete import UsernameIndex
+from .availability import Availability
+from .cache import PageCache, FragmentCache
+from .eventstream import EventStream
+from .followgraph import FollowGraph
+from .jsonprovider import JSONProvider
+from .sqltrace import SQLTrace
+from .writequeue import WriteQueue
 
 
 bootstrap = Bootstrap()
 moment = Moment()
 db = Peewee()
 pagedown = PageDown()
+writer = WriteQueue()
+sqltrace = SQLTrace()
+page_cache = PageCache()
+fragment_cache = FragmentCache()
+json_provider = JSONProvider()
+events = EventStream()
+usernames = UsernameIndex()
+availability = Availability()
+follow_graph = FollowGraph()
 
 login_manager = LoginManager()
 login_manager.session_protection = 'strong'
@@ -30,6 +47,15 @@ def create_app(config_name):
     app.cli.add_command(db.cli, 'db')
     login_manager.init_app(app)
     pagedown.init_app(app)
+    writer.init_app(app)
+    sqltrace.init_app(app)
+    page_cache.init_app(app)
+    fragment_cache.init_app(app)
+    json_provider.init_app(app)
+    events.init_app(app)
+    usernames.init_app(app)
+    availability.init_app(app)
+    follow_graph.init_app(app)
 
     from .main import main as main_blueprint
     app.register_blueprint(main_blueprint)
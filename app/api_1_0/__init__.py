@@ -2,4 +2,5 @@ from flask import Blueprint
 
 api = Blueprint('api', __name__)
 
-from . import authentication, posts, users, comments, errors
+from . import (authentication, posts, users, comments, export, stream,
+               changes, search, errors)
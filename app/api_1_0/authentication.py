@@ -1,6 +1,7 @@
-from flask import g, jsonify
+from flask import g
 from flask_httpauth import HTTPBasicAuth
 
+from ..jsonprovider import jsonify
 from ..models import User, AnonymousUser
 
 from . import api
@@ -0,0 +1,102 @@
+"""Creation of many posts or comments in one request.
+
+The batch endpoints take a list of up to ``FLASKR_API_BATCH_SIZE`` items,
+either as the request body or under the resource name (``{"posts":
+[...]}``).  Every item is validated with the ``from_json`` of its model
+and the markdown of the valid ones is rendered before the transaction.
+The valid items are then inserted together with ``insert_many`` in a
+single transaction, through the write queue.
+
+The response lists one result per item, in order: ``201`` with the URL
+of the new resource, or ``400`` with the validation error.  The status
+of the response itself is 201 when every item was created, 207 when
+only some were and 400 when none was.
+"""
+from datetime import datetime
+
+from flask import current_app, request
+import peewee as pw
+
+from .. import db, writer
+from ..exceptions import ValidationError
+from ..fake import MAX_VARIABLES
+from ..models import Change, Post, render_markdown
+from ..jsonprovider import jsonify
+
+
+def read_batch(key):
+    data = request.get_json()
+    items = data.get(key) if isinstance(data, dict) else data
+    if not isinstance(items, list) or not items:
+        raise ValidationError('expected a list of %s' % key)
+    limit = current_app.config['FLASKR_API_BATCH_SIZE']
+    if len(items) > limit:
+        raise ValidationError('at most %d %s can be created at once' %
+                              (limit, key))
+    return items
+
+
+def validate(items, convert):
+    """Return ``(valid, results)`` for the batch `items`.
+
+    `convert` turns an item into the row to insert, raising
+    :class:`ValidationError` (or ValueError) when it is invalid.  `valid`
+    lists the ``(index, row)`` of the valid items; the invalid ones
+    already have their result.
+    """
+    valid = []
+    results = [None] * len(items)
+    for i, item in enumerate(items):
+        try:
+            if not isinstance(item, dict):
+                raise ValidationError('item is not an object')
+            valid.append((i, convert(item)))
+        except (ValidationError, ValueError) as e:
+            results[i] = {'status': 400, 'error': 'bad request',
+                          'message': e.args[0]}
+    return valid, results
+
+
+def insert(model, entity, rows):
+    """Insert `rows` in one transaction and return their ids.
+
+    Rows get consecutive ids following the largest one in the table.
+    The transaction takes the write lock (``BEGIN IMMEDIATE``) before
+    reading it, so a concurrent writer -- another request thread when
+    the write queue is off, or another process -- waits instead of
+    reading the same largest id.  The creations are logged as changes
+    of `entity`.
+    """
+    now = datetime.utcnow()
+    for row in rows:
+        row['body_html'] = render_markdown(row['body'], model.allowed_tags)
+        row['timestamp'] = row['updated'] = now
+
+    def unit():
+        # nested in the writer's group transaction, which is immediate too
+        with db.database.atomic('IMMEDIATE'):
+            first = (model.select(pw.fn.MAX(model.id)).scalar() or 0) + 1
+            for i, row in enumerate(rows):
+                row['id'] = first + i
+            per_statement = max(1, MAX_VARIABLES // len(rows[0]))
+            for i in range(0, len(rows), per_statement):
+                model.insert_many(rows[i:i + per_statement]).execute()
+            ids = [row['id'] for row in rows]
+            Change.log_many(entity, ids, 'create')
+            if model is Post:
+                Post.index_references([(row['id'], row['body'],
+                                        row['timestamp']) for row in rows])
+        return ids
+    return writer.run(unit)
+
+
+def respond(valid, results, ids, url):
+    for (i, row), id in zip(valid, ids):
+        results[i] = {'status': 201, 'url': url(id)}
+    if len(valid) == len(results):
+        status = 201
+    elif valid:
+        status = 207
+    else:
+        status = 400
+    return jsonify({'results': results}), status
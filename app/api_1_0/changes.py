@@ -0,0 +1,82 @@
+"""Delta sync: what changed since a point of the change log.
+
+``GET /changes?since=<seq>`` returns the changes logged after `seq` in
+sequence order, at most ``FLASKR_CHANGES_PER_PAGE`` at a time, compacted
+to one delta per entity: an entity created and edited in the window is
+reported once as ``create``, one created and deleted is left out.  The
+response has the seq to ask for next and whether there is more.
+
+A client whose `seq` is older than what the log still holds gets a 410
+with the ``latest`` seq; it should download everything again and then
+sync from there.
+"""
+from collections import OrderedDict
+
+from flask import current_app, request
+import peewee as pw
+
+from ..exceptions import ValidationError
+from ..jsonprovider import jsonify
+from ..models import Change
+from . import api
+from .serializers import url_template
+
+ENDPOINTS = {'user': 'api.get_user', 'post': 'api.get_post',
+             'comment': 'api.get_comment'}
+
+
+def compact(rows):
+    """Collapse the ``(seq, entity, id, op)`` rows to one per entity."""
+    deltas = OrderedDict()
+    for seq, entity, id, op in rows:
+        key = (entity, id)
+        first = deltas.pop(key)[1] if key in deltas else op
+        # keep the order of the latest change
+        deltas[key] = (seq, first, op)
+    for (entity, id), (seq, first, op) in deltas.items():
+        if first == 'create':
+            if op == 'delete':
+                continue
+            op = 'create'
+        yield seq, entity, id, op
+
+
+@api.route('/changes')
+def get_changes():
+    since = request.args.get('since', 0, type=int)
+    if since < 0:
+        raise ValidationError('since must be a positive seq')
+    per_page = current_app.config['FLASKR_CHANGES_PER_PAGE']
+    limit = max(1, min(request.args.get('limit', per_page, type=int),
+                       per_page))
+    if since < Change.purged_through():
+        response = jsonify({
+            'error': 'gone',
+            'message': 'changes since %d are no longer available' % since,
+            'latest': Change.select(pw.fn.MAX(Change.seq)).scalar() or 0
+        })
+        response.status_code = 410
+        return response
+    rows = list(Change.select(Change.seq, Change.entity, Change.entity_id,
+                              Change.op)
+                .where((Change.seq > since) &
+                       (Change.entity != Change.PURGED))
+                .order_by(Change.seq)
+                .limit(limit + 1)
+                .tuples())
+    more = len(rows) > limit
+    rows = rows[:limit]
+    urls = dict((entity, url_template(endpoint))
+                for entity, endpoint in ENDPOINTS.items())
+    changes = []
+    for seq, entity, id, op in compact(rows):
+        change = {'seq': seq, 'entity': entity, 'id': id, 'op': op}
+        if op != 'delete' and entity in urls:
+            change['url'] = urls[entity](id)
+        changes.append(change)
+    return jsonify({
+        'changes': changes,
+        'since': since,
+        'next': rows[-1][0] if rows else since,
+        'more': more
+    })
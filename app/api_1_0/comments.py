@@ -1,16 +1,26 @@
-from flask import jsonify, request, g, url_for, current_app
+from flask import request, g, url_for, current_app, abort
 
 import playhouse.flask_utils as futils
 
+from .. import page_cache, events
+from ..bulkimport import reference_id
+from ..exceptions import ValidationError
 from ..models import Post, Permission, Comment
 from . import api
-from .decorators import permission_required
+from .decorators import permission_required, conditional
+from . import validators
+from .serializers import (dump_comments, dump_batch, url_template,
+                          CommentSerializer)
+from . import batch
+from ..jsonprovider import jsonify
 
 from utils.paginate_peewee import Pagination
 
 
 @api.route('/comments/')
 def get_comments():
+    if 'ids' in request.args:
+        return jsonify(dump_batch(CommentSerializer, 'comments'))
     pagination = Pagination(
         Comment.timeline(),
         current_app.config['FLASKR_COMMENTS_PER_PAGE'],
@@ -23,7 +33,7 @@ def get_comments():
     if pagination.has_next:
         next = url_for('api.get_comments', page=pagination.page+1, _external=True)
     return jsonify({
-        'comments': [comment.to_json() for comment in comments],
+        'comments': dump_comments(comments),
         'prev': prev,
         'next': next,
         'count': pagination.total
@@ -32,12 +42,14 @@ def get_comments():
 
 @api.route('/comments/<int:id>')
 def get_comment(id):
-    comment = futils.get_object_or_404(Comment.select(),
-                                       (Comment.id == id))
-    return jsonify(comment.to_json())
+    comments = dump_comments(Comment.select().where(Comment.id == id))
+    if not comments:
+        abort(404)
+    return jsonify(comments[0])
 
 
 @api.route('/posts/<int:id>/comments/')
+@conditional(validators.post)
 def get_post_comments(id):
     post = futils.get_object_or_404(Post.select(),
                                     (Post.id == id))
@@ -47,18 +59,55 @@ def get_post_comments(id):
     comments = pagination.items
     prev = None
     if pagination.has_prev:
-        prev = url_for('api.get_post_comments', page=pagination.page-1, _external=True)
+        prev = url_for('api.get_post_comments', id=id,
+                       page=pagination.page-1, _external=True)
     next = None
     if pagination.has_next:
-        next = url_for('api.get_post_comments', page=pagination.page+1, _external=True)
+        next = url_for('api.get_post_comments', id=id,
+                       page=pagination.page+1, _external=True)
     return jsonify({
-        'comments': [comment.to_json() for comment in comments],
+        'comments': dump_comments(comments),
         'prev': prev,
         'next': next,
         'count': pagination.total
     })
 
 
+@api.route('/comments/batch', methods=['POST'])
+@permission_required(Permission.COMMENT)
+def new_comments():
+    items = batch.read_batch('comments')
+    author_id = g.current_user.id
+    refs = set()
+    for item in items:
+        try:
+            refs.add(reference_id(item.get('post'), 'post'))
+        except (AttributeError, ValueError):
+            pass
+    posts = dict(Post.select(Post.id, Post.author)
+                 .where(Post.id << list(refs)).tuples()) if refs else {}
+
+    def convert(item):
+        comment = Comment.from_json(item)
+        post_id = reference_id(item.get('post'), 'post')
+        if post_id not in posts:
+            raise ValidationError('post %d does not exist' % post_id)
+        return dict(body=comment.body, author=author_id, post=post_id)
+    valid, results = batch.validate(items, convert)
+    ids = batch.insert(Comment, 'comment', [row for i, row in valid]) if valid else []
+    if ids:
+        tags = set(['posts', 'user:%d' % author_id])
+        for i, row in valid:
+            tags.update(['post:%d' % row['post'],
+                         'user:%s' % posts[row['post']]])
+        page_cache.invalidate(*tags)
+        for (i, row), id in zip(valid, ids):
+            events.publish('comment', id=id, post=row['post'],
+                           author=author_id)
+    return batch.respond(valid, results, ids,
+                         url_template('api.get_comment'))
+
+
 @api.route('/posts/<int:id>/comments', methods=['POST'])
 @permission_required(Permission.COMMENT)
 def new_post_comment(id):
@@ -1,5 +1,7 @@
 from functools import wraps
-from flask import g
+import hashlib
+
+from flask import g, request, current_app, make_response
 from .errors import forbidden
 
 
@@ -12,3 +14,44 @@ def permission_required(permission):
             return f(*args, **kwargs)
         return decorated_function
     return decorator
+
+
+def conditional(validator):
+    """Answer conditional GETs before running the view.
+
+    `validator` is called with the view arguments and returns
+    ``(state, last_modified)``, where `state` is anything whose repr
+    changes whenever the response would, typically counts and maximum
+    ids or timestamps.  The ETag is derived from the state and the request
+    URL.  When the client already holds the current representation the
+    view is skipped and a 304 is returned.  A validator returning None
+    leaves the request to the view (e.g. to answer 404).
+    """
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            validators = validator(*args, **kwargs)
+            if validators is None:
+                return f(*args, **kwargs)
+            state, last_modified = validators
+            etag = hashlib.md5(repr((request.full_path, state))
+                               .encode('utf-8')).hexdigest()
+            if last_modified is not None:
+                last_modified = last_modified.replace(microsecond=0)
+            if request.if_none_match:
+                not_modified = request.if_none_match.contains(etag)
+            else:
+                since = request.if_modified_since
+                not_modified = (since is not None and
+                                last_modified is not None and
+                                last_modified <= since.replace(tzinfo=None))
+            if not_modified:
+                response = current_app.response_class(status=304)
+            else:
+                response = make_response(f(*args, **kwargs))
+            response.set_etag(etag)
+            if last_modified is not None:
+                response.last_modified = last_modified
+            return response
+        return decorated_function
+    return decorator
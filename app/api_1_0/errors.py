@@ -1,6 +1,5 @@
-from flask import jsonify
-
 from app.exceptions import ValidationError
+from app.jsonprovider import jsonify
 
 from . import api
 
@@ -23,6 +22,12 @@ def forbidden(message):
     return response
 
 
+def service_unavailable(message):
+    response = jsonify({'error': 'service unavailable', 'message': message})
+    response.status_code = 503
+    return response
+
+
 @api.errorhandler(ValidationError)
 def validation_error(e):
     return bad_request(e.args[0])
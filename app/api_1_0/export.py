@@ -0,0 +1,88 @@
+"""Streaming NDJSON exports of the whole history, for administrators.
+
+Each endpoint writes one JSON object per line.  Rows are read in keyset
+chunks of ``FLASKR_EXPORT_CHUNK`` rows (``WHERE id > last ORDER BY id``)
+with ``.iterator()``, so neither the database nor the app ever holds
+more than a chunk, however large the table is.
+
+``?since=<ISO-8601 timestamp>`` restricts the export to the rows created
+or edited since then, for incremental syncs.  Deletions do not show up
+in the exports.
+"""
+from flask import Response, current_app, request, stream_with_context
+
+from ..exceptions import ValidationError
+from ..jsonprovider import parse_isoformat
+from ..models import Permission, Follow, Post, Comment
+from . import api
+from .decorators import permission_required
+
+
+def parse_since(value):
+    try:
+        return parse_isoformat(value)
+    except ValueError as e:
+        raise ValidationError(e.args[0])
+
+
+def keyset(query, model, columns, chunk):
+    """Yield the `columns` of the rows of `query` as tuples, by id."""
+    last = 0
+    while True:
+        count = 0
+        for row in (query.select(*columns)
+                    .where(model.id > last)
+                    .order_by(model.id)
+                    .limit(chunk)
+                    .tuples()
+                    .iterator()):
+            count += 1
+            last = row[0]
+            yield row
+        if count < chunk:
+            break
+
+
+def export(model, columns, since_filter):
+    query = model.select()
+    since = request.args.get('since')
+    if since:
+        query = query.where(since_filter(parse_since(since)))
+    names = [column.name for column in columns]
+    dumps = current_app.extensions['json_provider'].dumps
+    rows = keyset(query, model, columns,
+                  current_app.config['FLASKR_EXPORT_CHUNK'])
+
+    def generate():
+        for row in rows:
+            yield dumps(dict(zip(names, row))) + '\n'
+    return Response(stream_with_context(generate()),
+                    mimetype='application/x-ndjson')
+
+
+@api.route('/export/posts.ndjson')
+@permission_required(Permission.ADMINISTER)
+def export_posts():
+    return export(Post, (Post.id, Post.author, Post.body, Post.body_html,
+                         Post.timestamp, Post.updated),
+                  lambda since: ((Post.timestamp >= since) |
+                                 (Post.updated >= since)))
+
+
+@api.route('/export/comments.ndjson')
+@permission_required(Permission.ADMINISTER)
+def export_comments():
+    return export(Comment, (Comment.id, Comment.post, Comment.author,
+                            Comment.body, Comment.body_html,
+                            Comment.disabled, Comment.timestamp,
+                            Comment.updated),
+                  lambda since: ((Comment.timestamp >= since) |
+                                 (Comment.updated >= since)))
+
+
+@api.route('/export/follows.ndjson')
+@permission_required(Permission.ADMINISTER)
+def export_follows():
+    return export(Follow, (Follow.id, Follow.follower, Follow.followed,
+                           Follow.timestamp),
+                  lambda since: Follow.timestamp >= since)
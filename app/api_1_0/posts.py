@@ -1,17 +1,27 @@
-from flask import jsonify, request, g, url_for, current_app
+from flask import request, g, url_for, current_app, abort
 
 import playhouse.flask_utils as futils
 
-from ..models import Post, Permission
+from .. import page_cache, events
+from ..exceptions import ValidationError
+from ..models import Post, Permission, Tag
 from . import api
-from .decorators import permission_required
+from .decorators import permission_required, conditional
+from . import validators
+from .serializers import (dump_posts, dump_batch, url_template,
+                          PostSerializer)
+from . import batch
 from .errors import forbidden
+from ..jsonprovider import jsonify
 
 from utils.paginate_peewee import Pagination
 
 
 @api.route('/posts/')
+@conditional(validators.posts)
 def get_posts():
+    if 'ids' in request.args:
+        return jsonify(dump_batch(PostSerializer, 'posts'))
     pagination = Pagination(Post.timeline(),
                             current_app.config['FLASKR_POSTS_PER_PAGE'],
                             check_bounds=False)
@@ -23,17 +33,44 @@ def get_posts():
     if pagination.has_next:
         next = url_for('api.get_posts', page=pagination.page+1, _external=True)
     return jsonify({
-        'posts': [post.to_json() for post in posts],
+        'posts': dump_posts(posts),
         'prev': prev,
         'next': next,
         'count': pagination.total
     })
 
 
+@api.route('/tags/<tag>/posts')
+def get_tagged_posts(tag):
+    before = request.args.get('before')
+    try:
+        before = Tag.parse_cursor(before) if before else None
+    except ValueError:
+        raise ValidationError('invalid cursor')
+    per_page = current_app.config['FLASKR_POSTS_PER_PAGE']
+    rows = list(Post.tagged(tag, before).select(Post.id, Post.timestamp)
+                .limit(per_page + 1).tuples())
+    next = None
+    if len(rows) > per_page:
+        rows = rows[:per_page]
+        last_id, last_timestamp = rows[-1]
+        next = url_for('api.get_tagged_posts', tag=tag,
+                       before=Tag.cursor(last_timestamp, last_id),
+                       _external=True)
+    found = PostSerializer.from_request().dump_ids([id for id, ts in rows])
+    return jsonify({
+        'posts': [found[id] for id, ts in rows if id in found],
+        'next': next
+    })
+
+
 @api.route('/posts/<int:id>')
+@conditional(validators.post)
 def get_post(id):
-    post = futils.get_object_or_404(Post.select(), (Post.id == id))
-    return jsonify(post.to_json())
+    posts = dump_posts(Post.select().where(Post.id == id))
+    if not posts:
+        abort(404)
+    return jsonify(posts[0])
 
 
 @api.route('/posts/', methods=['POST'])
@@ -48,6 +85,22 @@ def new_post():
         {'Location': url_for('api.get_post', id=post.id, _external=True)}
 
 
+@api.route('/posts/batch', methods=['POST'])
+@permission_required(Permission.WRITE_ARTICLES)
+def new_posts():
+    author_id = g.current_user.id
+
+    def convert(item):
+        return dict(body=Post.from_json(item).body, author=author_id)
+    valid, results = batch.validate(batch.read_batch('posts'), convert)
+    ids = batch.insert(Post, 'post', [row for i, row in valid]) if valid else []
+    if ids:
+        page_cache.invalidate('posts', 'user:%d' % author_id)
+        for id in ids:
+            events.publish('post', id=id, author=author_id)
+    return batch.respond(valid, results, ids, url_template('api.get_post'))
+
+
 @api.route('/posts/<int:id>', methods=['PUT'])
 @permission_required(Permission.WRITE_ARTICLES)
 def edit_post(id):
@@ -0,0 +1,53 @@
+from flask import current_app, request, url_for
+
+from .. import search as fulltext
+from ..exceptions import ValidationError
+from ..jsonprovider import jsonify
+from ..models import Post, Comment
+from . import api
+from .errors import service_unavailable
+from .serializers import PostSerializer, CommentSerializer
+
+SEARCHED = {
+    'posts': (Post, PostSerializer),
+    'comments': (Comment, CommentSerializer),
+}
+
+
+@api.route('/search')
+def search():
+    q = request.args.get('q', '').strip()
+    kind = request.args.get('type', 'posts')
+    if kind not in SEARCHED:
+        raise ValidationError('type must be posts or comments')
+    if not q:
+        raise ValidationError('no query')
+    if not fulltext.installed():
+        return service_unavailable('search is not available')
+    model, serializer = SEARCHED[kind]
+    serializer = serializer.from_request()
+    per_page = current_app.config['FLASKR_SEARCH_PER_PAGE']
+    limit = max(1, min(request.args.get('limit', per_page, type=int),
+                       per_page))
+    try:
+        after = fulltext.parse_cursor(request.args.get('after'))
+    except ValueError as e:
+        raise ValidationError(e.args[0])
+    hits, cursor = fulltext.search(model, q, after, limit)
+    found = serializer.dump_ids([hit.id for hit in hits])
+    results = []
+    for hit in hits:
+        if hit.id in found:
+            result = dict(found[hit.id], rank=hit.rank,
+                          snippet=str(hit.snippet))
+            results.append(result)
+    next = None
+    if cursor:
+        # keep ?fields= and ?embed=
+        args = request.args.to_dict()
+        args['after'] = cursor
+        next = url_for('api.search', _external=True, **args)
+    return jsonify({
+        'results': results,
+        'next': next
+    })
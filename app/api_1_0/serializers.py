@@ -0,0 +1,311 @@
+"""Serialize whole pages of API resources at once.
+
+``to_json`` is fine for a single resource, but for a page of them it
+builds a model instance and runs three ``url_for`` calls per item, plus a
+COUNT query per post.  The serializers here read plain tuples, build the
+URLs from templates computed once per serializer and fetch the counts of
+a page in one grouped query.  By default they return the same dicts as
+the ``to_json`` methods.
+
+Clients can ask for a subset of the fields with ``?fields=``, e.g.
+``?fields=id,body_html,timestamp``; only the columns and counts those
+fields need are queried.  ``?embed=author`` replaces the author URL of
+posts and comments with the author itself, whose fields can be chosen
+with ``author.`` prefixes: ``?embed=author&fields=body,author.username``.
+
+The collection endpoints also answer ``?ids=1,2,3`` with the resources
+of the given ids, fetched with one ``IN`` query (see :func:`dump_batch`).
+"""
+from flask import current_app, request, url_for
+import peewee as pw
+
+from ..exceptions import ValidationError
+from ..models import User, Post, Comment
+
+# an id that cannot occur anywhere else in a URL
+_ID = 2 ** 62
+
+
+def url_template(endpoint):
+    """Return a function mapping an id to the external URL of `endpoint`."""
+    prefix, _, suffix = url_for(endpoint, id=_ID,
+                                _external=True).partition(str(_ID))
+    return lambda id: '%s%d%s' % (prefix, id, suffix)
+
+
+def _split(value):
+    return [item.strip() for item in (value or '').split(',')
+            if item.strip()]
+
+
+class Serializer(object):
+    """Base class of the serializers.
+
+    Subclasses map every field they can output to the columns it reads
+    in `fields` and implement a ``get_<field>(row)`` method for it;
+    `default` lists the fields of the ``to_json`` representation.
+    `embeddable` maps fields that can be embedded to the serializer of
+    the related resource.
+    """
+    model = None
+    fields = {}
+    default = ()
+    embeddable = {}
+
+    def __init__(self, fields=None, embed=()):
+        fields = list(fields or self.default)
+        own = [f for f in fields if '.' not in f]
+        nested = {}
+        for field in fields:
+            if '.' in field:
+                name, _, sub = field.partition('.')
+                nested.setdefault(name, []).append(sub)
+        for name in embed:
+            if name not in self.embeddable:
+                raise ValidationError('cannot embed %r' % name)
+        for name in nested:
+            if name not in embed:
+                raise ValidationError('%r is not embedded' % name)
+            if name not in own:
+                own.append(name)
+        unknown = [f for f in own if f not in self.fields]
+        if unknown:
+            raise ValidationError('unknown fields: %s' % ', '.join(unknown))
+
+        self.output = own
+        self.embedded = dict(
+            (name, self.embeddable[name](fields=nested.get(name)))
+            for name in embed if name in own)
+        self.columns = [self.model.id]
+        for field in own:
+            for column in self.fields[field]:
+                # not `in`: fields overload == to build expressions
+                if all(column is not c for c in self.columns):
+                    self.columns.append(column)
+        self.getters = [(field, getattr(self, 'get_' + field))
+                        for field in own]
+
+    @classmethod
+    def from_request(cls):
+        return cls(fields=_split(request.args.get('fields')),
+                   embed=_split(request.args.get('embed')))
+
+    def prefetch(self, rows):
+        """Load what the page needs besides its own columns."""
+
+    def rows(self, query):
+        names = [column.name for column in self.columns]
+        return [dict(zip(names, values))
+                for values in query.select(*self.columns).tuples()]
+
+    def dump(self, query):
+        """Serialize the resources selected by `query`."""
+        rows = self.rows(query)
+        self.prefetch(rows)
+        return [dict((field, get(row)) for field, get in self.getters)
+                for row in rows]
+
+    def dump_ids(self, ids):
+        """Serialize the resources with the given ids, keyed by id."""
+        if not ids:
+            return {}
+        model = self.model
+        query = model.select().where(model.id << list(ids))
+        rows = self.rows(query)
+        self.prefetch(rows)
+        return dict((row['id'], dict((field, get(row))
+                                     for field, get in self.getters))
+                    for row in rows)
+
+    def embed_author(self, rows):
+        embedded = self.embedded.get('author')
+        if embedded is not None:
+            self.authors = embedded.dump_ids(
+                set(row['author'] for row in rows))
+
+    def get_id(self, row):
+        return row['id']
+
+    def get_body(self, row):
+        return row['body']
+
+    def get_body_html(self, row):
+        return row['body_html']
+
+    def get_timestamp(self, row):
+        return row['timestamp']
+
+    def get_author(self, row):
+        if 'author' in self.embedded:
+            return self.authors.get(row['author'])
+        return self.user_url(row['author'])
+
+
+class UserSerializer(Serializer):
+    model = User
+    fields = {
+        'id': (),
+        'url': (),
+        'username': (User.username,),
+        'member_since': (User.member_since,),
+        'last_seen': (User.last_seen,),
+        'posts': (),
+        'followed_posts': (),
+        'post_count': (),
+    }
+    default = ('url', 'username', 'member_since', 'last_seen', 'posts',
+               'followed_posts', 'post_count')
+
+    def __init__(self, fields=None, embed=()):
+        super(UserSerializer, self).__init__(fields, embed)
+        self.url = url_template('api.get_user')
+        self.posts = url_template('api.get_user_posts')
+        self.followed_posts = url_template('api.get_user_followed_posts')
+
+    def prefetch(self, rows):
+        self.counts = {}
+        if 'post_count' in self.output and rows:
+            self.counts = dict(
+                Post.select(Post.author, pw.fn.COUNT(Post.id))
+                .where(Post.author << [row['id'] for row in rows])
+                .group_by(Post.author)
+                .tuples())
+
+    def get_url(self, row):
+        return self.url(row['id'])
+
+    def get_username(self, row):
+        return row['username']
+
+    def get_member_since(self, row):
+        return row['member_since']
+
+    def get_last_seen(self, row):
+        return row['last_seen']
+
+    def get_posts(self, row):
+        return self.posts(row['id'])
+
+    def get_followed_posts(self, row):
+        return self.followed_posts(row['id'])
+
+    def get_post_count(self, row):
+        return self.counts.get(row['id'], 0)
+
+
+class PostSerializer(Serializer):
+    model = Post
+    fields = {
+        'id': (),
+        'url': (),
+        'body': (Post.body,),
+        'body_html': (Post.body_html,),
+        'timestamp': (Post.timestamp,),
+        'author': (Post.author,),
+        'comments': (),
+        'comment_count': (),
+    }
+    default = ('url', 'body', 'body_html', 'timestamp', 'author',
+               'comments', 'comment_count')
+    embeddable = {'author': UserSerializer}
+
+    def __init__(self, fields=None, embed=()):
+        super(PostSerializer, self).__init__(fields, embed)
+        self.url = url_template('api.get_post')
+        self.user_url = url_template('api.get_user')
+        self.comments = url_template('api.get_post_comments')
+
+    def prefetch(self, rows):
+        self.counts = {}
+        if 'comment_count' in self.output and rows:
+            self.counts = dict(
+                Comment.select(Comment.post, pw.fn.COUNT(Comment.id))
+                .where(Comment.post << [row['id'] for row in rows])
+                .group_by(Comment.post)
+                .tuples())
+        self.embed_author(rows)
+
+    def get_url(self, row):
+        return self.url(row['id'])
+
+    def get_comments(self, row):
+        return self.comments(row['id'])
+
+    def get_comment_count(self, row):
+        return self.counts.get(row['id'], 0)
+
+
+class CommentSerializer(Serializer):
+    model = Comment
+    fields = {
+        'id': (),
+        'url': (),
+        'post': (Comment.post,),
+        'body': (Comment.body,),
+        'body_html': (Comment.body_html,),
+        'timestamp': (Comment.timestamp,),
+        'author': (Comment.author,),
+    }
+    default = ('url', 'post', 'body', 'body_html', 'timestamp', 'author')
+    embeddable = {'author': UserSerializer}
+
+    def __init__(self, fields=None, embed=()):
+        super(CommentSerializer, self).__init__(fields, embed)
+        self.url = url_template('api.get_comment')
+        self.post_url = url_template('api.get_post')
+        self.user_url = url_template('api.get_user')
+
+    def prefetch(self, rows):
+        self.embed_author(rows)
+
+    def get_url(self, row):
+        return self.url(row['id'])
+
+    def get_post(self, row):
+        return self.post_url(row['post'])
+
+
+def requested_ids():
+    """The ids of ``?ids=``, without duplicates, in the requested order."""
+    items = _split(request.args.get('ids'))
+    limit = current_app.config['FLASKR_API_BATCH_SIZE']
+    # bounded before parsing: the list comes straight from the URL
+    if len(items) > limit:
+        raise ValidationError('at most %d ids can be requested' % limit)
+    ids = []
+    seen = set()
+    for item in items:
+        try:
+            id = int(item)
+        except ValueError:
+            raise ValidationError('invalid id %r' % item)
+        if id not in seen:
+            seen.add(id)
+            ids.append(id)
+    return ids
+
+
+def dump_batch(serializer, key):
+    """Serialize the resources requested with ``?ids=``.
+
+    They are listed under `key` in the requested order; ids that do not
+    exist are listed under ``missing``.
+    """
+    ids = requested_ids()
+    found = serializer.from_request().dump_ids(ids)
+    return {
+        key: [found[id] for id in ids if id in found],
+        'missing': [id for id in ids if id not in found]
+    }
+
+
+def dump_users(query):
+    return UserSerializer.from_request().dump(query)
+
+
+def dump_posts(query):
+    return PostSerializer.from_request().dump(query)
+
+
+def dump_comments(query):
+    return CommentSerializer.from_request().dump(query)
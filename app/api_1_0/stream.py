@@ -0,0 +1,9 @@
+from flask import g
+
+from .. import events
+from . import api
+
+
+@api.route('/events')
+def get_events():
+    return events.response(g.current_user)
@@ -1,17 +1,59 @@
-from flask import jsonify, current_app, url_for
+from flask import current_app, request, url_for, abort
 
 import playhouse.flask_utils as futils
 
 from . import api
+from . import validators
+from .serializers import (dump_users, dump_posts, dump_batch,
+                          url_template, UserSerializer, PostSerializer)
+from .decorators import conditional
+from .. import usernames
+from ..exceptions import ValidationError
+from ..jsonprovider import jsonify
 from ..models import User, Post
 
 from utils.paginate_peewee import Pagination
 
 
+@api.route('/users/')
+def get_users():
+    # users are only listed by id
+    if 'ids' not in request.args:
+        raise ValidationError('ids is required')
+    return jsonify(dump_batch(UserSerializer, 'users'))
+
+
+@api.route('/users/autocomplete')
+def autocomplete_users():
+    url = url_template('api.get_user')
+    found = usernames.suggest(request.args.get('q', ''),
+                              request.args.get('limit', type=int))
+    return jsonify({'users': [
+        {'url': url(id), 'username': username, 'followers': followers}
+        for id, username, followers in found]})
+
+
 @api.route('/users/<int:id>')
 def get_user(id):
+    users = dump_users(User.select().where(User.id == id))
+    if not users:
+        abort(404)
+    return jsonify(users[0])
+
+
+@api.route('/users/<int:id>/suggestions')
+def get_user_suggestions(id):
     user = futils.get_object_or_404(User.select(), (User.id == id))
-    return jsonify(user.to_json())
+    config = current_app.config
+    limit = request.args.get('limit', config['FLASKR_SUGGESTIONS_SHOWN'],
+                             type=int)
+    limit = max(1, min(limit, config['FLASKR_SUGGESTIONS_PER_USER']))
+    url = url_template('api.get_user')
+    found = user.suggested_users(limit)
+    return jsonify({'users': [
+        {'url': url(other.id), 'username': other.username,
+         'score': other.score}
+        for other in found]})
 
 
 @api.route('/users/<int:id>/posts')
@@ -23,19 +65,41 @@ def get_user_posts(id):
     posts = pagination.items
     prev = None
     if pagination.has_prev:
-        prev = url_for('api.get_user_posts', page=pagination.page-1, _external=True)
+        prev = url_for('api.get_user_posts', id=id, page=pagination.page-1,
+                       _external=True)
     next = None
     if pagination.has_next:
-        next = url_for('api.get_user_posts', page=pagination.page+1, _external=True)
+        next = url_for('api.get_user_posts', id=id, page=pagination.page+1,
+                       _external=True)
     return jsonify({
-        'posts': [post.to_json() for post in posts],
+        'posts': dump_posts(posts),
         'prev': prev,
         'next': next,
         'count': pagination.total
     })
 
 
+@api.route('/users/<int:id>/mentions')
+def get_user_mentions(id):
+    user = futils.get_object_or_404(User.select(), (User.id == id))
+    per_page = current_app.config['FLASKR_POSTS_PER_PAGE']
+    ids = [post_id for post_id, in
+           Post.mentioning(user, request.args.get('before', type=int))
+           .select(Post.id).limit(per_page + 1).tuples()]
+    next = None
+    if len(ids) > per_page:
+        ids = ids[:per_page]
+        next = url_for('api.get_user_mentions', id=id, before=ids[-1],
+                       _external=True)
+    found = PostSerializer.from_request().dump_ids(ids)
+    return jsonify({
+        'posts': [found[post_id] for post_id in ids if post_id in found],
+        'next': next
+    })
+
+
 @api.route('/users/<int:id>/timeline/')
+@conditional(validators.user_timeline)
 def get_user_followed_posts(id):
     user = futils.get_object_or_404(User.select(), (User.id == id))
     pagination = Pagination(user.followed_posts.order_by(Post.timestamp.desc()),
@@ -44,14 +108,14 @@ def get_user_followed_posts(id):
     posts = pagination.items
     prev = None
     if pagination.has_prev:
-        prev = url_for('api.get_user_followed_posts', page=pagination.page-1,
-                       _external=True)
+        prev = url_for('api.get_user_followed_posts', id=id,
+                       page=pagination.page-1, _external=True)
     next = None
     if pagination.has_next:
-        next = url_for('api.get_user_followed_posts', page=pagination.page+1,
-                       _external=True)
+        next = url_for('api.get_user_followed_posts', id=id,
+                       page=pagination.page+1, _external=True)
     return jsonify({
-        'posts': [post.to_json() for post in posts],
+        'posts': dump_posts(posts),
         'prev': prev,
         'next': next,
         'count': pagination.total
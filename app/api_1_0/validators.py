@@ -0,0 +1,74 @@
+"""Cheap validators for conditional GETs (see :func:`conditional`).
+
+Each validator summarizes what a response depends on with a few
+aggregate queries -- row counts plus maximum ids and ``updated``
+timestamps -- instead of building the response itself.
+
+With ``?embed=author`` the responses also hold the names, last visits
+and post counts of the authors, so the state of the users is added.
+"""
+from flask import request
+import peewee as pw
+
+from ..models import User, Follow, Post, Comment, Change
+from .serializers import _split
+
+
+def _state(query, model):
+    """``(count, max id, max updated)`` of the rows matched by `query`."""
+    count, max_id, updated = (query
+                              .select(pw.fn.COUNT(model.id),
+                                      pw.fn.MAX(model.id),
+                                      pw.fn.MAX(model.updated))
+                              .order_by()
+                              .scalar(as_tuple=True))
+    return count, max_id, model.updated.python_value(updated)
+
+
+def _latest(*timestamps):
+    timestamps = [ts for ts in timestamps if ts is not None]
+    return max(timestamps) if timestamps else None
+
+
+def _embedded(state, last_modified):
+    """Add the state of the users embedded in the response, if any."""
+    if 'author' not in _split(request.args.get('embed')):
+        return state, last_modified
+    # renames are logged, visits only move last_seen forward
+    users = (Change.select(pw.fn.MAX(Change.seq))
+             .where(Change.entity == 'user').scalar(),
+             User.select(pw.fn.MAX(User.last_seen)).scalar())
+    posts = (Post.select(pw.fn.COUNT(Post.id), pw.fn.MAX(Post.id))
+             .scalar(as_tuple=True))
+    # a rename leaves no timestamp behind: only the ETag can tell
+    return (state, users, posts), None
+
+
+def posts():
+    # every post embeds its comment count
+    posts = _state(Post.select(), Post)
+    comments = _state(Comment.select(), Comment)
+    return _embedded((posts, comments), _latest(posts[2], comments[2]))
+
+
+def post(id):
+    post = (Post.select(Post.id, Post.updated)
+            .where(Post.id == id).tuples().first())
+    if post is None:
+        return None
+    comments = _state(Comment.select().where(Comment.post == id), Comment)
+    return _embedded((post, comments), _latest(post[1], comments[2]))
+
+
+def user_timeline(id):
+    if not User.select().where(User.id == id).exists():
+        return None
+    authors = Follow.feed_authors(id)
+    posts = _state(Post.select()
+                   .join(authors, on=(Post.author == authors.c.id)), Post)
+    follows = (Follow.select(pw.fn.COUNT(Follow.id), pw.fn.MAX(Follow.id))
+               .where(Follow.follower == id).scalar(as_tuple=True))
+    comments = _state(Comment.select(), Comment)
+    # no Last-Modified: an unfollow changes the timeline but leaves no
+    # timestamp behind, so only the ETag can tell
+    return _embedded((posts, follows, comments), None)
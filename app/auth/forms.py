@@ -4,6 +4,7 @@ from wtforms import StringField, PasswordField, BooleanField, SubmitField
 from wtforms.validators import Required, Length, Email, Regexp, EqualTo
 from wtforms import ValidationError
 
+from .. import availability
 from ..models import User
 
 
@@ -33,11 +34,11 @@ class RegistrationForm(FlaskForm):
     submit = SubmitField('Register')
 
     def validate_email(self, field):
-        if User.select().where(User.email == field.data).first():
+        if availability.taken('email', field.data):
             raise ValidationError('Email already registered.')
 
     def validate_username(self, field):
-        if User.select().where(User.username == field.data).first():
+        if availability.taken('username', field.data):
             raise ValidationError('Username already in use.')
 
 
@@ -78,5 +79,5 @@ class ChangeEmailForm(FlaskForm):
     submit = SubmitField('Update Email Address')
 
     def validate_email(self, field):
-        if User.select().where(User.email == field.data).first():
+        if availability.taken('email', field.data):
             raise ValidationError('Email already registered.')
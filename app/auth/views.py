@@ -1,8 +1,13 @@
-from flask import render_template, redirect, request, url_for, flash
+from flask import (
+    render_template, redirect, request, url_for, flash, abort
+)
 
 from flask_login import login_user, logout_user, login_required, current_user
+import peewee as pw
 
 from . import auth
+from .. import availability
+from ..jsonprovider import jsonify
 from ..models import User
 # from ..email import send_email
 from .forms import (
@@ -48,7 +53,12 @@ def register():
         user = User(email=form.email.data,
                     username=form.username.data,
                     password=form.password.data)
-        user.save()
+        try:
+            user.save()
+        except pw.IntegrityError:
+            # taken since the form was validated
+            flash('Email or username already in use.')
+            return render_template('auth/register.html', form=form)
         # token = user.generate_confirmation_token()
         # send_email(user.email, 'Confirm Your Account',
         #            'auth/email/confirm', user=user, token=token)
@@ -58,6 +68,16 @@ def register():
     return render_template('auth/register.html', form=form)
 
 
+@auth.route('/available')
+def available():
+    for kind in ('username', 'email'):
+        value = request.args.get(kind)
+        if value:
+            return jsonify({kind: value,
+                            'available': not availability.taken(kind, value)})
+    abort(400)
+
+
 @auth.route('/change-password', methods=['GET', 'POST'])
 @login_required
 def change_password():
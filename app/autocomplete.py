@@ -0,0 +1,66 @@
+"""In-memory username prefix index for ``/api/v1.0/users/autocomplete``.
+
+Usernames are suggested by prefix, most followed first.  The index
+(:class:`utils.prefix.PrefixIndex`) is loaded from the database by the
+first lookup after startup and kept up to date by :meth:`User.save` and
+by follows and unfollows.  Every process has its own copy, which misses
+the writes of the other processes (and of ``flask import``), so it is
+also reloaded every ``FLASKR_AUTOCOMPLETE_REFRESH`` seconds.
+"""
+import threading
+import time
+
+import peewee as pw
+
+from utils.prefix import PrefixIndex
+
+
+class UsernameIndex(object):
+    def __init__(self, app=None):
+        self.index = None
+        self.loaded = None
+        self.refresh = None
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('FLASKR_AUTOCOMPLETE_LIMIT', 10)
+        app.config.setdefault('FLASKR_AUTOCOMPLETE_REFRESH', 300)
+        self.index = PrefixIndex(app.config['FLASKR_AUTOCOMPLETE_LIMIT'])
+        self.refresh = app.config['FLASKR_AUTOCOMPLETE_REFRESH']
+        self.loaded = None
+
+    def load(self):
+        from .models import User, Follow
+        self.index.build(
+            User.select(User.id, User.username, pw.fn.COUNT(Follow.id))
+            .join(Follow, pw.JOIN.LEFT_OUTER,
+                  on=(Follow.followed == User.id))
+            .group_by(User.id)
+            .tuples()
+            .iterator())
+        self.loaded = time.monotonic()
+
+    def _ensure_loaded(self):
+        loaded = self.loaded
+        if loaded is not None and time.monotonic() - loaded < self.refresh:
+            return
+        with self._lock:
+            if self.loaded is loaded:
+                self.load()
+
+    def suggest(self, prefix, limit=None):
+        """``(id, username, followers)`` of the best matches of `prefix`."""
+        self._ensure_loaded()
+        return self.index.top(prefix, limit)
+
+    # kept up to date by the models; nothing to do before the first load
+
+    def user_saved(self, user):
+        if self.loaded is not None:
+            self.index.set(user.id, user.username)
+
+    def follow_changed(self, follow, delta):
+        if self.loaded is not None:
+            self.index.adjust(follow.followed_id, delta)
@@ -0,0 +1,95 @@
+"""Username and email availability, without a query for free names.
+
+Two Bloom filters (:class:`utils.bloom.BloomFilter`) hold the lowercased
+usernames and emails of every user.  A name missing from its filter is
+free; a name in it is confirmed against the unique index, since it may
+be a false positive (about 1%) or a name that was changed since.  Most
+names typed in the registration form are free, so the live checks of
+``/auth/available`` rarely reach the database.
+
+The filters are loaded by the first check after startup and updated by
+:meth:`User.save`.  Like the autocomplete index, every process has its
+own, which misses the users created by the other processes until it is
+reloaded every ``FLASKR_AVAILABILITY_REFRESH`` seconds, or sooner once
+it holds more names than it was sized for.  The unique indexes remain
+the final check when a user is saved.
+"""
+import threading
+import time
+
+from utils.bloom import BloomFilter
+
+KINDS = ('username', 'email')
+
+
+class Availability(object):
+    def __init__(self, app=None):
+        self.filters = None
+        self.loaded = None
+        self.refresh = None
+        self.error_rate = None
+        self.free = self.confirmed = 0
+        self._lock = threading.Lock()
+        # guards the filters against saves made while they are rebuilt
+        self._saves = threading.Lock()
+        self._pending = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('FLASKR_AVAILABILITY_ERROR_RATE', 0.01)
+        app.config.setdefault('FLASKR_AVAILABILITY_REFRESH', 300)
+        self.error_rate = app.config['FLASKR_AVAILABILITY_ERROR_RATE']
+        self.refresh = app.config['FLASKR_AVAILABILITY_REFRESH']
+        self.filters = None
+        self.loaded = None
+
+    def load(self):
+        from .models import User
+        with self._saves:
+            # users saved from now on may be missing from the rows
+            self._pending = []
+        rows = list(User.select(User.username, User.email).tuples()
+                    .iterator())
+        filters = dict(
+            (kind, BloomFilter.from_items(
+                [(row[i] or '').lower() for row in rows],
+                error_rate=self.error_rate))
+            for i, kind in enumerate(KINDS))
+        with self._saves:
+            for username, email in self._pending:
+                filters['username'].add(username)
+                filters['email'].add(email)
+            self._pending = None
+            self.filters = filters
+            self.loaded = time.monotonic()
+
+    def _ensure_loaded(self):
+        loaded = self.loaded
+        if loaded is not None and \
+                time.monotonic() - loaded < self.refresh and \
+                not any(f.saturated for f in self.filters.values()):
+            return
+        with self._lock:
+            if self.loaded is loaded:
+                self.load()
+
+    def taken(self, kind, value):
+        """Whether a user has the username or email `value`."""
+        from .models import User
+        self._ensure_loaded()
+        if value.lower() not in self.filters[kind]:
+            self.free += 1
+            return False
+        self.confirmed += 1
+        field = getattr(User, kind)
+        return User.select(User.id).where(field == value).first() is not None
+
+    def user_saved(self, user):
+        username, email = user.username.lower(), user.email.lower()
+        with self._saves:
+            if self._pending is not None:
+                self._pending.append((username, email))
+            if self.loaded is not None:
+                self.filters['username'].add(username)
+                self.filters['email'].add(email)
@@ -0,0 +1,314 @@
+"""Streaming bulk import of users, posts, comments and follows.
+
+Records are read one at a time from NDJSON or CSV files, in the shape
+the API emits: the NDJSON exports of ``/api/v1.0/export/``, or the
+resources of the other endpoints, whose references are URLs such as
+``http://host/api/v1.0/users/7`` (the trailing id is used).
+
+The importer
+
+- validates every record and skips the invalid ones, reporting them
+  with their line number,
+- gives the imported rows new ids, numbering on from the largest id in
+  the table, and remaps the references between them; the map can be
+  saved and loaded so users, posts, comments and follows can be
+  imported by separate runs,
+- inserts with multi-row ``INSERT`` statements, committing every
+  `batch` records,
+- renders ``body_html`` from markdown in a pool of worker processes
+  instead of trusting the HTML of the input,
+- optionally drops the non-unique indexes of the table while loading
+  and rebuilds them at the end, which is much faster for large loads
+  (SQLite only).
+
+Users have no email in the API, so users without one get
+``<username>@users.invalid``.  Imported users have no usable password.
+"""
+import csv
+from functools import partial
+import hashlib
+import io
+import itertools
+import json
+from multiprocessing import Pool
+import re
+import time
+
+import peewee as pw
+
+from . import db, follow_graph
+from .fake import MAX_VARIABLES
+from .jsonprovider import parse_isoformat
+from .models import (Role, User, Follow, Post, Comment, Change,
+                     render_markdown)
+
+USERNAME = re.compile(r'^[A-Za-z][A-Za-z0-9_.]*$')
+KINDS = ('users', 'posts', 'comments', 'follows')
+ENTITIES = {User: 'user', Post: 'post', Comment: 'comment', Follow: 'follow'}
+
+
+class InvalidRecord(ValueError):
+    pass
+
+
+def read_records(path, format=None):
+    """Yield ``(line, record)`` from an NDJSON or CSV file."""
+    format = format or ('csv' if path.endswith('.csv') else 'ndjson')
+    with io.open(path, encoding='utf-8', newline='') as f:
+        if format == 'csv':
+            for line, record in enumerate(csv.DictReader(f), 2):
+                yield line, dict((key, value if value != '' else None)
+                                 for key, value in record.items())
+            return
+        for line, text in enumerate(f, 1):
+            if not text.strip():
+                continue
+            try:
+                record = json.loads(text)
+            except ValueError as e:
+                yield line, InvalidRecord('invalid JSON: %s' % e)
+                continue
+            yield line, record
+
+
+def _render(allowed_tags, body):
+    return render_markdown(body, allowed_tags)
+
+
+def reference_id(value, what):
+    """The id of a reference, given as an id or as an API URL."""
+    if isinstance(value, int) and not isinstance(value, bool):
+        return value
+    if isinstance(value, str):
+        tail = value.rstrip('/').rsplit('/', 1)[-1]
+        if tail.isdigit():
+            return int(tail)
+    raise InvalidRecord('invalid %s %r' % (what, value))
+
+
+def _timestamp(record, key, default=None):
+    value = record.get(key)
+    if value is None:
+        return default
+    try:
+        return parse_isoformat(value)
+    except ValueError as e:
+        raise InvalidRecord(e.args[0])
+
+
+def _flag(value):
+    if isinstance(value, str):
+        return value.strip().lower() in ('1', 'true', 'yes')
+    return bool(value)
+
+
+def _body(record):
+    body = record.get('body')
+    if not body:
+        raise InvalidRecord('no body')
+    return body
+
+
+class Importer(object):
+    def __init__(self, batch=10000, workers=None, echo=None, id_map=None):
+        self.batch = batch
+        self.workers = workers
+        self.echo = echo or (lambda message: None)
+        self.id_map = id_map if id_map is not None else {}
+        self._pool = None
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+
+    def render(self, model, bodies):
+        """Render the markdown `bodies` of `model` to HTML."""
+        render = partial(_render, model.allowed_tags)
+        if self.workers == 0 or len(bodies) < 100:
+            return [render(body) for body in bodies]
+        if self._pool is None:
+            self._pool = Pool(self.workers)
+        return self._pool.map(render, bodies, chunksize=256)
+
+    # ids
+
+    def ids(self, kind):
+        return self.id_map.setdefault(kind, {})
+
+    def lookup(self, kind, value):
+        source = reference_id(value, kind[:-1])
+        try:
+            return self.ids(kind)[str(source)]
+        except KeyError:
+            raise InvalidRecord('unknown %s %s' % (kind[:-1], source))
+
+    def source_id(self, record):
+        if record.get('id') is not None:
+            return reference_id(record['id'], 'id')
+        if record.get('url') is not None:
+            return reference_id(record['url'], 'url')
+        return None
+
+    # records -> rows
+
+    def prepare_users(self):
+        self.role = Role.select().where(Role.default == True).first()
+        self.usernames = set(u for u, in User.select(User.username).tuples())
+        self.emails = set(e for e, in User.select(User.email).tuples())
+
+    def user(self, record):
+        username = record.get('username')
+        if not username or len(username) > 64 or \
+                not USERNAME.match(username):
+            raise InvalidRecord('invalid username %r' % username)
+        email = record.get('email') or '%s@users.invalid' % username
+        if len(email) > 64 or '@' not in email:
+            raise InvalidRecord('invalid email %r' % email)
+        if username in self.usernames:
+            raise InvalidRecord('username %r already exists' % username)
+        if email in self.emails:
+            raise InvalidRecord('email %r already exists' % email)
+        self.usernames.add(username)
+        self.emails.add(email)
+        return dict(username=username, email=email, password_hash='!',
+                    role=self.role.id,
+                    confirmed=_flag(record.get('confirmed')),
+                    name=record.get('name'),
+                    location=record.get('location'),
+                    about_me=record.get('about_me'),
+                    member_since=_timestamp(record, 'member_since'),
+                    last_seen=_timestamp(record, 'last_seen'),
+                    avatar_hash=hashlib.md5(
+                        email.lower().encode('utf-8')).hexdigest())
+
+    def post(self, record):
+        return dict(body=_body(record),
+                    author=self.lookup('users', record.get('author')),
+                    timestamp=_timestamp(record, 'timestamp'),
+                    updated=_timestamp(record, 'updated'))
+
+    def comment(self, record):
+        return dict(body=_body(record),
+                    author=self.lookup('users', record.get('author')),
+                    post=self.lookup('posts', record.get('post')),
+                    disabled=_flag(record.get('disabled')),
+                    timestamp=_timestamp(record, 'timestamp'),
+                    updated=_timestamp(record, 'updated'))
+
+    def prepare_follows(self):
+        self.pairs = set(Follow.select(Follow.follower, Follow.followed)
+                         .tuples())
+
+    def follow(self, record):
+        pair = (self.lookup('users', record.get('follower')),
+                self.lookup('users', record.get('followed')))
+        if pair[0] == pair[1]:
+            # the own posts of a user are in their feed without following
+            return None
+        if pair in self.pairs:
+            raise InvalidRecord('duplicate follow')
+        self.pairs.add(pair)
+        return dict(follower=pair[0], followed=pair[1],
+                    timestamp=_timestamp(record, 'timestamp'))
+
+    # loading
+
+    def fill_defaults(self, model, rows):
+        """Replace missing values by the defaults of their fields."""
+        for key in rows[0]:
+            default = model._meta.fields[key].default
+            if default is None:
+                continue
+            for row in rows:
+                if row[key] is None:
+                    row[key] = default() if callable(default) else default
+
+    def insert(self, model, rows, log=True):
+        per_statement = max(1, MAX_VARIABLES // len(rows[0]))
+        with db.database.atomic():
+            for i in range(0, len(rows), per_statement):
+                model.insert_many(rows[i:i + per_statement]).execute()
+            if log:
+                Change.log_many(ENTITIES[model],
+                                [row['id'] for row in rows], 'create')
+            if model is Post:
+                Post.index_references([(row['id'], row['body'],
+                                        row['timestamp']) for row in rows])
+        if model is Follow:
+            follow_graph.invalidate()
+
+    def secondary_indexes(self, model):
+        """``(name, sql)`` of the non-unique indexes of `model`."""
+        if not isinstance(db.database.obj, pw.SqliteDatabase):
+            return []
+        cursor = db.database.execute_sql(
+            "SELECT name, sql FROM sqlite_master WHERE type = 'index' "
+            "AND tbl_name = ? AND sql IS NOT NULL",
+            (model._meta.db_table,))
+        return [(name, sql) for name, sql in cursor.fetchall()
+                if not sql.upper().startswith('CREATE UNIQUE')]
+
+    def run(self, kind, path, format=None, defer_indexes=False):
+        """Import the records of `path` as `kind`; returns the counts."""
+        model = {'users': User, 'posts': Post, 'comments': Comment,
+                 'follows': Follow}[kind]
+        convert = getattr(self, kind[:-1])
+        prepare = getattr(self, 'prepare_' + kind, None)
+        if prepare is not None:
+            prepare()
+        ids = self.ids(kind)
+        next_id = (model.select(pw.fn.MAX(model.id)).scalar() or 0) + 1
+
+        dropped = self.secondary_indexes(model) if defer_indexes else []
+        for name, sql in dropped:
+            db.database.execute_sql('DROP INDEX "%s"' % name)
+
+        imported = rejected = 0
+        started = time.time()
+        records = read_records(path, format)
+        try:
+            while True:
+                chunk = list(itertools.islice(records, self.batch))
+                if not chunk:
+                    break
+                rows = []
+                for line, record in chunk:
+                    try:
+                        if isinstance(record, Exception):
+                            raise record
+                        if not isinstance(record, dict):
+                            raise InvalidRecord('not an object')
+                        row = convert(record)
+                    except InvalidRecord as e:
+                        rejected += 1
+                        self.echo('%s:%d: %s' % (path, line, e.args[0]))
+                        continue
+                    if row is None:
+                        continue
+                    row['id'] = next_id
+                    source = self.source_id(record)
+                    if source is not None:
+                        ids[str(source)] = next_id
+                    next_id += 1
+                    rows.append(row)
+                if not rows:
+                    continue
+                if model in (Post, Comment):
+                    html = self.render(model, [row['body'] for row in rows])
+                    for row, body_html in zip(rows, html):
+                        row['body_html'] = body_html
+                self.fill_defaults(model, rows)
+                self.insert(model, rows)
+                imported += len(rows)
+                self.echo('%s: %d imported, %d rejected (%.0f rows/s)' % (
+                    kind, imported, rejected,
+                    imported / max(time.time() - started, 1e-6)))
+        finally:
+            if dropped:
+                self.echo('%s: rebuilding %d indexes' % (kind, len(dropped)))
+            for name, sql in dropped:
+                db.database.execute_sql(sql)
+        return {'imported': imported, 'rejected': rejected,
+                'seconds': time.time() - started}
@@ -0,0 +1,162 @@
+"""Response and template fragment caches.
+
+Anonymous visitors all get the same HTML for a given URL, so with
+``FLASKR_PAGE_CACHE`` enabled the views decorated with
+:meth:`PageCache.cached` store their rendered response for
+``FLASKR_PAGE_CACHE_TTL`` seconds.  Concurrent misses for the same URL
+are computed once.  Views tag the page with what it shows (``posts``,
+``post:<id>``, ``user:<id>``) and the models invalidate those tags when
+they are written.  Responses carry an ``X-Cache`` header with ``HIT``,
+``MISS`` or ``BYPASS``.
+
+The cache lives in the process, so with several worker processes a write
+only invalidates the pages of the worker that handled it; the TTL bounds
+how long the other workers serve the old page.
+
+:class:`FragmentCache` caches parts of templates instead, for every
+visitor; see :class:`FragmentCacheExtension`.
+"""
+from functools import wraps
+
+from flask import current_app, g, has_app_context, request, session
+from flask_login import current_user
+from jinja2 import nodes
+from jinja2.ext import Extension
+
+from utils.cache import TTLCache
+
+
+class PageCache(object):
+    def __init__(self, app=None):
+        self.cache = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('FLASKR_PAGE_CACHE', False)
+        app.config.setdefault('FLASKR_PAGE_CACHE_TTL', 30)
+        app.config.setdefault('FLASKR_PAGE_CACHE_SIZE', 1000)
+        self.cache = TTLCache(maxsize=app.config['FLASKR_PAGE_CACHE_SIZE'],
+                              ttl=app.config['FLASKR_PAGE_CACHE_TTL'])
+
+    def enabled(self):
+        return (self.cache is not None and has_app_context() and
+                current_app.config['FLASKR_PAGE_CACHE'])
+
+    def tag(self, *tags):
+        """Tag the page being rendered so writes can invalidate it."""
+        g.page_cache_tags = g.get('page_cache_tags', ()) + tags
+
+    def invalidate(self, *tags):
+        if self.cache is not None:
+            self.cache.invalidate(*tags)
+
+    def clear(self):
+        if self.cache is not None:
+            self.cache.clear()
+
+    def _cacheable(self):
+        return (request.method == 'GET' and
+                not current_user.is_authenticated and
+                '_flashes' not in session)
+
+    def cached(self, view):
+        """Cache the responses `view` gives to anonymous GET requests."""
+        @wraps(view)
+        def inner(*args, **kwargs):
+            if not self.enabled():
+                return view(*args, **kwargs)
+            if not self._cacheable():
+                response = current_app.make_response(view(*args, **kwargs))
+                response.headers['X-Cache'] = 'BYPASS'
+                return response
+
+            rendered = []
+
+            def render():
+                response = current_app.make_response(view(*args, **kwargs))
+                rendered.append(response)
+                if response.status_code != 200:
+                    return None, ()
+                return ((response.get_data(), list(response.headers)),
+                        g.get('page_cache_tags', ()))
+
+            entry, hit = self.cache.get_or_set(request.url, render)
+            if rendered:
+                response = rendered[0]
+            else:
+                body, headers = entry
+                response = current_app.response_class(body, headers=headers)
+            response.headers['X-Cache'] = 'HIT' if hit else 'MISS'
+            return response
+        return inner
+
+
+class FragmentCacheExtension(Extension):
+    """``{% cache %}`` tag caching the rendered body of the block.
+
+    ::
+
+        {% cache 'post', post.id, post.updated tags 'post:%d' % post.id %}
+            ...
+        {% endcache %}
+
+    The values before ``tags`` form the key, together with the template
+    name and line, so they must cover everything the block depends on.
+    The optional tags allow :meth:`FragmentCache.invalidate` to drop the
+    fragment early; otherwise it stays until it is least recently used.
+    """
+    tags = set(['cache'])
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+        key = [nodes.Const(parser.name), nodes.Const(lineno),
+               parser.parse_expression()]
+        while parser.stream.skip_if('comma'):
+            key.append(parser.parse_expression())
+        tags = []
+        if parser.stream.skip_if('name:tags'):
+            tags.append(parser.parse_expression())
+            while parser.stream.skip_if('comma'):
+                tags.append(parser.parse_expression())
+        body = parser.parse_statements(['name:endcache'], drop_needle=True)
+        call = self.call_method('_render', [nodes.Tuple(key, 'load'),
+                                            nodes.List(tags)])
+        return nodes.CallBlock(call, [], [], body).set_lineno(lineno)
+
+    def _render(self, key, tags, caller):
+        fragments = self.environment.fragment_cache
+        if not fragments.enabled():
+            return caller()
+        fragment, hit = fragments.cache.get_or_set(
+            key, lambda: (caller(), tags))
+        return fragment
+
+
+class FragmentCache(object):
+    """Bounded cache of rendered template fragments.
+
+    Enabled with ``FLASKR_FRAGMENT_CACHE``; at most
+    ``FLASKR_FRAGMENT_CACHE_SIZE`` fragments are kept.
+    """
+
+    def __init__(self, app=None):
+        self.cache = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('FLASKR_FRAGMENT_CACHE', False)
+        app.config.setdefault('FLASKR_FRAGMENT_CACHE_SIZE', 5000)
+        self.cache = TTLCache(
+            maxsize=app.config['FLASKR_FRAGMENT_CACHE_SIZE'])
+        app.jinja_env.add_extension(FragmentCacheExtension)
+        app.jinja_env.fragment_cache = self
+
+    def enabled(self):
+        return (self.cache is not None and has_app_context() and
+                current_app.config['FLASKR_FRAGMENT_CACHE'])
+
+    def invalidate(self, *tags):
+        if self.cache is not None:
+            self.cache.invalidate(*tags)
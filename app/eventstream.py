@@ -0,0 +1,172 @@
+"""Server-sent events announcing new posts and comments.
+
+Creating a post or a comment publishes a ``post`` or ``comment`` event
+to an in-process hub.  Every open stream (``/events`` for the browser,
+``/api/v1.0/events`` for API clients) subscribes to the hub and forwards
+the matching events::
+
+    id: 120-431
+    event: comment
+    data: {"author": 7, "id": 431, "post": 98}
+
+``?followed=1`` keeps the posts and comments written by the users the
+client follows, ``?post=<id>`` the comments of one post.  A comment is
+sent every ``FLASKR_EVENTS_HEARTBEAT`` seconds so proxies keep idle
+streams open.
+
+Event ids are the largest post and comment ids sent so far.  A client
+reconnecting with ``Last-Event-ID`` first gets what it missed from the
+database, so a restart or another worker process loses nothing.  A
+client too far behind (more than ``FLASKR_EVENTS_BACKLOG`` rows, or a
+full queue) gets a ``reset`` event and should reload instead.
+
+Streams only wait on their subscription and never touch the database
+after the response has started.  Under gevent or eventlet workers
+(``gunicorn -c gunicorn.conf.py``) they hold a greenlet instead of a
+thread; with thread-based servers every open stream holds a thread,
+which is why at most ``FLASKR_EVENTS_MAX_STREAMS`` are open at once.
+
+The hub is per process: streams get the events published by the process
+serving them live, and those of other processes only when they resume.
+Live delivery takes a single (gevent) worker.
+"""
+import queue
+
+from flask import Response, abort, current_app, request
+import peewee as pw
+
+from utils.pubsub import PubSub
+
+
+class EventStream(object):
+    def __init__(self, app=None):
+        self.hub = PubSub()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('FLASKR_EVENTS_HEARTBEAT', 15)
+        app.config.setdefault('FLASKR_EVENTS_BACKLOG', 100)
+        app.config.setdefault('FLASKR_EVENTS_QUEUE', 1000)
+        app.config.setdefault('FLASKR_EVENTS_MAX_STREAMS', 1000)
+
+    def publish(self, kind, **data):
+        self.hub.publish((kind, data))
+
+    def post_created(self, post):
+        self.publish('post', id=post.id, author=post.author_id)
+
+    def comment_created(self, comment):
+        self.publish('comment', id=comment.id, post=comment.post_id,
+                     author=comment.author_id)
+
+    @staticmethod
+    def _last_ids():
+        from .models import Post, Comment
+        return (Post.select(pw.fn.MAX(Post.id)).scalar() or 0,
+                Comment.select(pw.fn.MAX(Comment.id)).scalar() or 0)
+
+    @staticmethod
+    def _parse_event_id(value):
+        try:
+            last_post, last_comment = (int(n) for n in value.split('-'))
+        except ValueError:
+            return None
+        return last_post, last_comment
+
+    def _missed(self, last_post, last_comment, accept, limit):
+        """Events since the given ids, or None when there are too many."""
+        from .models import Post, Comment
+        posts = (Post.select(Post.id, Post.author)
+                 .where(Post.id > last_post)
+                 .order_by(Post.id).limit(limit + 1).tuples())
+        comments = (Comment.select(Comment.id, Comment.post, Comment.author)
+                    .where(Comment.id > last_comment)
+                    .order_by(Comment.id).limit(limit + 1).tuples())
+        events = [('post', dict(id=id, author=author))
+                  for id, author in posts]
+        events += [('comment', dict(id=id, post=post, author=author))
+                   for id, post, author in comments]
+        if len(events) > limit:
+            return None
+        return [event for event in events if accept(*event)]
+
+    def response(self, user):
+        """Stream the events matching the filters of the request for `user`.
+
+        Everything the stream needs from the database is loaded here,
+        before the response starts.
+        """
+        from .models import Follow
+        followed = None
+        post_id = request.args.get('post', type=int)
+        if request.args.get('followed') and not user.is_anonymous:
+            followed = set(f for f, in (Follow.select(Follow.followed)
+                                        .where(Follow.follower == user.id)
+                                        .tuples()))
+            followed.add(user.id)
+        config = current_app.config
+        if len(self.hub) >= config['FLASKR_EVENTS_MAX_STREAMS']:
+            abort(503)
+
+        def accept(kind, data):
+            if post_id is not None:
+                return kind == 'comment' and data['post'] == post_id
+            if followed is not None:
+                return data['author'] in followed
+            return True
+
+        dumps = current_app.extensions['json_provider'].dumps
+        heartbeat = config['FLASKR_EVENTS_HEARTBEAT']
+        subscription = self.hub.subscribe(config['FLASKR_EVENTS_QUEUE'])
+        resume = request.headers.get('Last-Event-ID') or \
+            request.args.get('last_event_id')
+        last = resume and self._parse_event_id(resume)
+        if last:
+            missed = self._missed(last[0], last[1], accept,
+                                  config['FLASKR_EVENTS_BACKLOG'])
+        else:
+            last, missed = self._last_ids(), []
+
+        def generate():
+            last_post, last_comment = last
+            replayed = set()
+            try:
+                yield 'retry: 3000\n\n'
+                if missed is None:
+                    yield 'event: reset\ndata: {}\n\n'
+                    return
+                pending = iter(missed)
+                while True:
+                    event = next(pending, None)
+                    if event is not None:
+                        replayed.add((event[0], event[1]['id']))
+                    else:
+                        try:
+                            event = subscription.get(timeout=heartbeat)
+                        except queue.Empty:
+                            yield ': keepalive\n\n'
+                            continue
+                        if subscription.overflowed:
+                            yield 'event: reset\ndata: {}\n\n'
+                            return
+                        # the resume query may have sent it already
+                        if (event[0], event[1]['id']) in replayed:
+                            continue
+                    kind, data = event
+                    if kind == 'post':
+                        last_post = max(last_post, data['id'])
+                    else:
+                        last_comment = max(last_comment, data['id'])
+                    if accept(kind, data):
+                        yield 'id: %d-%d\nevent: %s\ndata: %s\n\n' % (
+                            last_post, last_comment, kind, dumps(data))
+            finally:
+                subscription.close()
+
+        response = Response(generate(), mimetype='text/event-stream',
+                            headers={'Cache-Control': 'no-cache',
+                                     'X-Accel-Buffering': 'no'})
+        # also when the response is dropped before it was iterated
+        response.call_on_close(subscription.close)
+        return response
@@ -0,0 +1,223 @@
+"""High-volume synthetic data for benchmarking.
+
+Unlike :meth:`User.generate_fake` and :meth:`Post.generate_fake`, which
+hash a password per user and look up a random author per post, this
+generator
+
+- hashes a single shared password once,
+- assigns the ids itself, above the largest one in use, and keeps them
+  in memory instead of querying them back,
+- inserts with multi-row ``INSERT`` statements, committing every
+  `batch` rows,
+- draws follower counts and user activity from power-law (Pareto)
+  weights, so a few users are very popular or very active,
+- is reproducible: the same `seed` on the same database produces the
+  same data, apart from timestamps, which are relative to the run.
+
+Bodies are plain lorem ipsum sentences, so ``body_html`` is rendered as a
+single paragraph without going through markdown.
+"""
+from datetime import datetime, timedelta
+import hashlib
+import itertools
+import random
+import time
+
+from werkzeug.security import generate_password_hash
+
+from . import db, follow_graph
+from .models import Role, User, Follow, Post, Comment
+
+
+WORDS = ('lorem ipsum dolor sit amet consectetur adipiscing elit sed do '
+         'eiusmod tempor incididunt ut labore et dolore magna aliqua enim '
+         'ad minim veniam quis nostrud exercitation ullamco laboris nisi '
+         'aliquip ex ea commodo consequat duis aute irure in reprehenderit '
+         'voluptate velit esse cillum fugiat nulla pariatur excepteur sint '
+         'occaecat cupidatat non proident sunt culpa qui officia deserunt '
+         'mollit anim id est laborum').split()
+
+CITIES = ('Amsterdam', 'Berlin', 'Chengdu', 'Dublin', 'Lima', 'Lisbon',
+          'Nairobi', 'Osaka', 'Oslo', 'Porto', 'Quito', 'Seoul')
+
+# SQLite limits the number of bound parameters per statement.
+MAX_VARIABLES = 999
+
+
+class Generator(object):
+    def __init__(self, seed=0, batch=50000, days=365, echo=None):
+        self.rng = random.Random(seed)
+        self.batch = batch
+        self.now = datetime.utcnow().replace(microsecond=0)
+        self.seconds = days * 24 * 3600
+        self.echo = echo or (lambda message: None)
+        self.user_ids = []
+        self.post_ids = []
+        self.post_times = []
+        self._user_weights = None
+        self._popularity = None
+        self._post_weights = None
+
+    def sentence(self, low=4, high=16):
+        words = self.rng.sample(WORDS, self.rng.randint(low, high))
+        return ' '.join(words).capitalize() + '.'
+
+    def paragraph(self, low=1, high=5):
+        return ' '.join(self.sentence()
+                        for _ in range(self.rng.randint(low, high)))
+
+    def timestamp(self, after=None):
+        if after is None:
+            return self.now - timedelta(
+                seconds=self.rng.randrange(self.seconds))
+        left = max(int((self.now - after).total_seconds()), 1)
+        return after + timedelta(seconds=self.rng.randrange(left))
+
+    def pareto(self, count, alpha):
+        """Cumulative power-law weights for `count` items."""
+        return list(itertools.accumulate(
+            self.rng.paretovariate(alpha) for _ in range(count)))
+
+    def insert(self, model, rows):
+        """Insert `rows`, several per statement, committing every `batch`."""
+        total = 0
+        per_statement = None
+        started = time.time()
+        rows = iter(rows)
+        while True:
+            chunk = list(itertools.islice(rows, self.batch))
+            if not chunk:
+                break
+            if per_statement is None:
+                per_statement = max(1, MAX_VARIABLES // len(chunk[0]))
+            with db.database.atomic():
+                for i in range(0, len(chunk), per_statement):
+                    model.insert_many(chunk[i:i + per_statement]).execute()
+            total += len(chunk)
+            self.echo('%s: %d rows (%.0f rows/s)' % (
+                model._meta.db_table, total,
+                total / max(time.time() - started, 1e-6)))
+        if model is Follow:
+            follow_graph.invalidate()
+        return total
+
+    def users(self, count):
+        role = Role.select().where(Role.default == True).first()
+        password_hash = generate_password_hash('password')
+        first = (User.select(User.id).order_by(User.id.desc())
+                 .scalar() or 0) + 1
+
+        def rows():
+            for n in range(first, first + count):
+                email = 'user%d@example.com' % n
+                # rendering a user without one would save it
+                avatar_hash = hashlib.md5(
+                    email.lower().encode('utf-8')).hexdigest()
+                yield dict(id=n, email=email, avatar_hash=avatar_hash,
+                           username='user%d' % n,
+                           password_hash=password_hash,
+                           confirmed=True,
+                           role=role.id if role else None,
+                           name='User %d' % n,
+                           location=self.rng.choice(CITIES),
+                           about_me=self.sentence(),
+                           member_since=self.timestamp())
+        self.insert(User, rows())
+        new_ids = list(range(first, first + count))
+        self.user_ids.extend(new_ids)
+        self._user_weights = self._popularity = None
+        return new_ids
+
+    def _pick_user(self):
+        if self._user_weights is None:
+            self._user_weights = self.pareto(len(self.user_ids), 1.5)
+        return self.rng.choices(self.user_ids,
+                                cum_weights=self._user_weights)[0]
+
+    def _pick_followed(self):
+        if self._popularity is None:
+            self._popularity = self.pareto(len(self.user_ids), 1.2)
+        return self.rng.choices(self.user_ids,
+                                cum_weights=self._popularity)[0]
+
+    def follows(self, count):
+        ids = self.user_ids
+        known = set(ids)
+        seen = set((f, t) for f, t in Follow.select(Follow.follower,
+                                                    Follow.followed).tuples()
+                   if f != t and f in known and t in known)
+        # users do not follow themselves
+        free = len(ids) * (len(ids) - 1) - len(seen)
+        count = min(count, free)
+
+        def sampled():
+            made = 0
+            while made < count:
+                pair = (self._pick_user(), self._pick_followed())
+                if pair[0] == pair[1] or pair in seen:
+                    continue
+                seen.add(pair)
+                made += 1
+                yield pair
+
+        def rows(pairs):
+            for follower, followed in pairs:
+                yield dict(follower=follower, followed=followed,
+                           timestamp=self.timestamp())
+
+        if 2 * count > free:
+            # most draws would be rejected near saturation: draw uniformly
+            # from the free pairs, no more of them than there are follows
+            pairs = self.rng.sample([(f, t) for f in ids for t in ids
+                                     if f != t and (f, t) not in seen],
+                                    count)
+            return self.insert(Follow, rows(pairs))
+        return self.insert(Follow, rows(sampled()))
+
+    def posts(self, count):
+        first = (Post.select(Post.id).order_by(Post.id.desc())
+                 .scalar() or 0) + 1
+        times = [self.timestamp() for _ in range(count)]
+
+        def rows():
+            for id, ts in enumerate(times, first):
+                body = self.paragraph()
+                yield dict(id=id, body=body, body_html='<p>%s</p>' % body,
+                           timestamp=ts, author=self._pick_user())
+        self.insert(Post, rows())
+        self.post_ids.extend(range(first, first + count))
+        self.post_times.extend(times)
+        self._post_weights = None
+        return count
+
+    def comments(self, count):
+        if self._post_weights is None:
+            self._post_weights = self.pareto(len(self.post_ids), 1.3)
+        indexes = range(len(self.post_ids))
+
+        def rows():
+            for _ in range(count):
+                i = self.rng.choices(indexes,
+                                     cum_weights=self._post_weights)[0]
+                body = self.sentence()
+                yield dict(body=body, body_html=body,
+                           timestamp=self.timestamp(self.post_times[i]),
+                           disabled=self.rng.random() < 0.01,
+                           author=self._pick_user(), post=self.post_ids[i])
+        return self.insert(Comment, rows())
+
+
+def generate(users=1000, posts=10000, comments=30000, follows=20000,
+             seed=0, batch=50000, echo=None):
+    """Populate the database and return the number of rows per table."""
+    Role.insert_roles()
+    gen = Generator(seed=seed, batch=batch, echo=echo)
+    gen.users(users)
+    if not gen.user_ids:
+        return {}
+    return {
+        'users': len(gen.user_ids),
+        'follows': gen.follows(follows),
+        'posts': gen.posts(posts),
+        'comments': gen.comments(comments) if gen.post_ids else 0,
+    }
@@ -0,0 +1,79 @@
+"""In-memory follow graph for :meth:`User.is_following` and friends.
+
+Profile pages, the follow and unfollow views and the follower lists ask
+whether a user follows another; the graph (:class:`utils.graph.Digraph`)
+answers from memory instead of a ``follows`` query per check.  It is
+loaded by the first check after startup and kept up to date by
+:meth:`User.follow` and :meth:`User.unfollow`.  Every process has its
+own, which misses the follows of the other processes (and bulk inserts),
+so it is reconciled with the ``follows`` table every
+``FLASKR_FOLLOW_GRAPH_REFRESH`` seconds: a new graph is loaded and
+swapped in.  Follow and unfollow still check the table before writing,
+and repair the graph when it was stale.
+"""
+import threading
+import time
+
+from utils.graph import Digraph
+
+
+class FollowGraph(object):
+    def __init__(self, app=None):
+        self.graph = None
+        self.loaded = None
+        self.refresh = None
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('FLASKR_FOLLOW_GRAPH_REFRESH', 300)
+        self.refresh = app.config['FLASKR_FOLLOW_GRAPH_REFRESH']
+        self.graph = Digraph()
+        self.loaded = None
+
+    def load(self):
+        from .models import Follow
+        graph = Digraph()
+        graph.build(Follow.select(Follow.follower, Follow.followed)
+                    .order_by(Follow.follower, Follow.followed)
+                    .tuples()
+                    .iterator())
+        self.graph = graph
+        self.loaded = time.monotonic()
+
+    def invalidate(self):
+        """Reload on the next check, after follows were bulk inserted."""
+        self.loaded = None
+
+    def _ensure_loaded(self):
+        loaded = self.loaded
+        if loaded is not None and time.monotonic() - loaded < self.refresh:
+            return
+        with self._lock:
+            if self.loaded is loaded:
+                self.load()
+
+    def is_following(self, follower_id, followed_id):
+        self._ensure_loaded()
+        return self.graph.has_edge(follower_id, followed_id)
+
+    def followed_among(self, follower_id, ids):
+        """The set of `ids` that `follower_id` follows."""
+        self._ensure_loaded()
+        return self.graph.successors_in(follower_id, ids)
+
+    def followers_among(self, followed_id, ids):
+        """The set of `ids` that follow `followed_id`."""
+        self._ensure_loaded()
+        return self.graph.predecessors_in(followed_id, ids)
+
+    # kept up to date by the models; nothing to do before the first load
+
+    def followed(self, follower_id, followed_id):
+        if self.loaded is not None:
+            self.graph.add(follower_id, followed_id)
+
+    def unfollowed(self, follower_id, followed_id):
+        if self.loaded is not None:
+            self.graph.remove(follower_id, followed_id)
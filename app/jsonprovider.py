@@ -0,0 +1,138 @@
+"""JSON encoding of the API responses.
+
+:class:`JSONProvider` picks an encoder when the app is created:
+``orjson`` when it is installed, the standard library otherwise, or the
+one named by ``FLASKR_JSON_ENCODER`` (``'auto'``, ``'orjson'`` or
+``'stdlib'``).  Both encoders produce the same bytes: sorted keys, no
+whitespace, non-ASCII characters as UTF-8 rather than escaped, and
+datetimes in ISO-8601 with a ``Z`` suffix, since all the timestamps
+stored by the app are naive UTC.  Output is indented by two spaces only
+when ``JSONIFY_PRETTYPRINT_REGULAR`` is set and the request is not an
+XHR, like :func:`flask.jsonify`.
+
+Responses whose size has no bound, the NDJSON exports, are streamed by
+their views one :meth:`JSONProvider.dumps` per line.
+
+Use :func:`jsonify` from this module instead of :func:`flask.jsonify`.
+"""
+from datetime import date, datetime
+
+from flask import current_app, request, json as flask_json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def isoformat(value):
+    if isinstance(value, datetime) and value.tzinfo is None:
+        return value.isoformat() + 'Z'
+    return value.isoformat()
+
+
+_formats = ('%Y-%m-%dT%H:%M:%S.%f', '%Y-%m-%dT%H:%M:%S', '%Y-%m-%d')
+
+
+def parse_isoformat(value):
+    """Parse a timestamp written by :func:`isoformat` as naive UTC.
+
+    Raises ValueError for anything else.
+    """
+    if value.endswith('Z'):
+        value = value[:-1]
+    for fmt in _formats:
+        try:
+            return datetime.strptime(value, fmt)
+        except ValueError:
+            pass
+    raise ValueError('invalid timestamp %r' % value)
+
+
+class JSONEncoder(flask_json.JSONEncoder):
+    """Flask's encoder, with ISO-8601 instead of HTTP dates."""
+
+    def default(self, o):
+        if isinstance(o, date):
+            return isoformat(o)
+        return super(JSONEncoder, self).default(o)
+
+
+def _default(o):
+    # orjson handles datetimes itself; this only sees the rest
+    return JSONEncoder().default(o)
+
+
+class StdlibEncoder(object):
+    name = 'stdlib'
+
+    def dumps(self, obj, indent=None):
+        # the layout of orjson
+        separators = (',', ': ') if indent else (',', ':')
+        return flask_json.dumps(obj, cls=JSONEncoder, sort_keys=True,
+                                ensure_ascii=False, indent=indent,
+                                separators=separators)
+
+
+class OrjsonEncoder(object):
+    name = 'orjson'
+
+    def __init__(self):
+        self.options = (orjson.OPT_SORT_KEYS | orjson.OPT_NAIVE_UTC |
+                        orjson.OPT_UTC_Z)
+
+    def dumps(self, obj, indent=None):
+        options = self.options
+        if indent:
+            options |= orjson.OPT_INDENT_2
+        return orjson.dumps(obj, default=_default,
+                            option=options).decode('utf-8')
+
+
+encoders = {'stdlib': StdlibEncoder, 'orjson': OrjsonEncoder}
+
+
+class JSONProvider(object):
+    def __init__(self, app=None):
+        self.encoder = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('FLASKR_JSON_ENCODER', 'auto')
+        name = app.config['FLASKR_JSON_ENCODER']
+        if name == 'auto':
+            name = 'stdlib' if orjson is None else 'orjson'
+        if name == 'orjson' and orjson is None:
+            raise RuntimeError('FLASKR_JSON_ENCODER is orjson but orjson '
+                               'is not installed')
+        self.encoder = encoders[name]()
+        app.extensions['json_provider'] = self
+        # flask.jsonify and tojson use the same datetime format
+        app.json_encoder = JSONEncoder
+
+    def dumps(self, obj, indent=None):
+        return self.encoder.dumps(obj, indent=indent)
+
+    def _indent(self):
+        if current_app.config['JSONIFY_PRETTYPRINT_REGULAR'] and \
+                not request.is_xhr:
+            return 2
+        return None
+
+    def response(self, *args, **kwargs):
+        """Like :func:`flask.jsonify`."""
+        if args and kwargs:
+            raise TypeError('jsonify() behavior undefined when passed '
+                            'both args and kwargs')
+        elif len(args) == 1:
+            obj = args[0]
+        else:
+            obj = args or kwargs
+        return current_app.response_class(
+            self.dumps(obj, indent=self._indent()) + '\n',
+            mimetype=current_app.config['JSONIFY_MIMETYPE'])
+
+
+def jsonify(*args, **kwargs):
+    return current_app.extensions['json_provider'].response(*args, **kwargs)
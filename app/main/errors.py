@@ -1,6 +1,7 @@
-from flask import render_template, request, jsonify
+from flask import render_template, request
 
 from . import main
+from ..jsonprovider import jsonify
 
 
 @main.app_errorhandler(403)
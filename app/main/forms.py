@@ -4,11 +4,13 @@ from wtforms import (
     TextAreaField,
     BooleanField,
     SelectField,
-    SubmitField
+    SubmitField,
+    DateTimeField
 )
-from wtforms.validators import Required, Length, Email, Regexp
+from wtforms.validators import Required, Length, Email, Regexp, Optional
 from wtforms import ValidationError
 from flask_pagedown.fields import PageDownField
+from .. import availability
 from ..models import Role, User
 
 
@@ -46,12 +48,12 @@ class EditProfileAdminForm(FlaskForm):
 
     def validate_email(self, field):
         if (field.data != self.user.email and
-                User.select().where(User.email == field.data).first()):
+                availability.taken('email', field.data)):
             raise ValidationError('Email already registered.')
 
     def validate_username(self, field):
         if (field.data != self.user.username and
-                User.select().where(User.username == field.data).first()):
+                availability.taken('username', field.data)):
             raise ValidationError('Username already in use.')
 
 
@@ -63,3 +65,19 @@ class PostForm(FlaskForm):
 class CommentForm(FlaskForm):
     body = StringField('Enter your comment', validators=[Required()])
     submit = SubmitField('Submit')
+
+
+class BulkModerationForm(FlaskForm):
+    author = StringField('Author', validators=[Optional(), Length(1, 64)])
+    since = DateTimeField('Since', format='%Y-%m-%d %H:%M',
+                          validators=[Optional()])
+    until = DateTimeField('Until', format='%Y-%m-%d %H:%M',
+                          validators=[Optional()])
+    enable = SubmitField('Enable')
+    disable = SubmitField('Disable')
+
+    def validate_author(self, field):
+        self.author_user = User.select().where(
+            User.username == field.data).first()
+        if self.author_user is None:
+            raise ValidationError('Unknown user.')
@@ -8,16 +8,20 @@ from flask import (
 
 from flask_login import login_required, current_user
 
+import peewee as pw
 import playhouse.flask_utils as futils
 
 from . import main
+from .. import page_cache, events
+from .. import search as fulltext
 from .forms import (
     EditProfileForm,
     EditProfileAdminForm,
     PostForm,
-    CommentForm
+    CommentForm,
+    BulkModerationForm
 )
-from ..models import Permission, Role, User, Post, Follow, Comment
+from ..models import Permission, Role, User, Post, Follow, Comment, Tag
 from ..decorators import admin_required, permission_required
 
 from utils.paginate_peewee import Pagination
@@ -35,6 +39,7 @@ def server_shutdown():
 
 
 @main.route('/', methods=['GET', 'POST'])
+@page_cache.cached
 def index():
     form = PostForm()
     if (current_user.is_authenticated and
@@ -50,21 +55,61 @@ def index():
     if current_user.is_authenticated:
         show_followed = bool(request.cookies.get('show_followed', ''))
     if show_followed:
-        query = current_user.followed_posts
+        query = current_user.followed_posts.order_by(Post.timestamp.desc())
     else:
         query = Post.timeline()
     pagination = Pagination(query,
                             current_app.config['FLASKR_POSTS_PER_PAGE'],
                             check_bounds=False)
     posts = pagination.items
+    page_cache.tag('posts')
+    suggestions = []
+    if current_user.is_authenticated:
+        suggestions = current_user.suggested_users(
+            current_app.config['FLASKR_SUGGESTIONS_SHOWN'])
     return render_template('index.html', form=form, posts=posts,
-                           show_followed=show_followed, pagination=pagination)
+                           show_followed=show_followed, pagination=pagination,
+                           suggestions=suggestions)
+
+
+@main.route('/events')
+def stream_events():
+    return events.response(current_user._get_current_object())
+
+
+@main.route('/search')
+def search():
+    q = request.args.get('q', '').strip()
+    kind = request.args.get('in', 'posts')
+    if kind not in ('posts', 'comments'):
+        kind = 'posts'
+    model = Post if kind == 'posts' else Comment
+    available = fulltext.installed()
+    results, next = [], None
+    if q and available:
+        try:
+            after = fulltext.parse_cursor(request.args.get('after'))
+        except ValueError:
+            abort(400)
+        hits, next = fulltext.search(
+            model, q, after, current_app.config['FLASKR_SEARCH_PER_PAGE'])
+        if hits:
+            items = dict((item.id, item) for item in (
+                model.select(model, User)
+                .join(User, on=model.author)
+                .where(model.id << [hit.id for hit in hits])))
+            results = [(items[hit.id], hit) for hit in hits
+                       if hit.id in items]
+    return render_template('search.html', q=q, kind=kind, results=results,
+                           next=next, available=available)
 
 
 @main.route('/user/<username>')
+@page_cache.cached
 def user(username):
     user_query = User.select()
     user = futils.get_object_or_404(user_query, (User.username == username))
+    page_cache.tag('user:%d' % user.id)
     pagination = Pagination(user.posts.order_by(Post.timestamp.desc()),
                             current_app.config['FLASKR_POSTS_PER_PAGE'],
                             check_bounds=False)
@@ -73,6 +118,40 @@ def user(username):
                            pagination=pagination)
 
 
+@main.route('/user/<username>/mentions')
+def mentions(username):
+    user = futils.get_object_or_404(User.select(),
+                                    (User.username == username))
+    per_page = current_app.config['FLASKR_POSTS_PER_PAGE']
+    posts = list(Post.mentioning(user, request.args.get('before', type=int))
+                 .limit(per_page + 1))
+    more = None
+    if len(posts) > per_page:
+        posts = posts[:per_page]
+        more = url_for('.mentions', username=username,
+                       before=posts[-1].id)
+    return render_template('referenced.html', posts=posts, more=more,
+                           title='Posts mentioning %s' % user.username)
+
+
+@main.route('/tag/<tag>')
+def tag(tag):
+    before = request.args.get('before')
+    try:
+        before = Tag.parse_cursor(before) if before else None
+    except ValueError:
+        abort(400)
+    per_page = current_app.config['FLASKR_POSTS_PER_PAGE']
+    posts = list(Post.tagged(tag, before).limit(per_page + 1))
+    more = None
+    if len(posts) > per_page:
+        posts = posts[:per_page]
+        more = url_for('.tag', tag=tag, before=Tag.cursor(posts[-1].timestamp,
+                                                   posts[-1].id))
+    return render_template('referenced.html', posts=posts, more=more,
+                           title='Posts tagged #%s' % tag.lower())
+
+
 @main.route('/edit-profile', methods=['GET', 'POST'])
 @login_required
 def edit_profile():
@@ -105,7 +184,13 @@ def edit_profile_admin(id):
         user.name = form.name.data
         user.location = form.location.data
         user.about_me = form.about_me.data
-        user.save()
+        try:
+            user.save()
+        except pw.IntegrityError:
+            # taken since the form was validated
+            flash('Email or username already in use.')
+            return render_template('edit_profile.html', form=form,
+                                   user=user)
         flash('The profile has been updated.')
         return redirect(url_for('.user', username=user.username))
     form.email.data = user.email
@@ -119,9 +204,11 @@ def edit_profile_admin(id):
 
 
 @main.route('/post/<int:id>', methods=['GET', 'POST'])
+@page_cache.cached
 def post(id):
     post_query = Post.select()
     post = futils.get_object_or_404(post_query, (Post.id == id))
+    page_cache.tag('post:%d' % post.id)
     form = CommentForm()
     if form.validate_on_submit():
         comment = Comment(body=form.body.data,
@@ -171,10 +258,12 @@ def follow(username):
     if user is None:
         flash('Invalid user.')
         return redirect(url_for('.index'))
-    if current_user.is_following(user):
+    if user.id == current_user.id:
+        flash('You cannot follow yourself.')
+        return redirect(url_for('.user', username=username))
+    if not current_user.follow(user):
         flash('You are already following this user.')
         return redirect(url_for('.user', username=username))
-    current_user.follow(user)
     flash('You are now following %s.' % username)
     return redirect(url_for('.user', username=username))
 
@@ -187,20 +276,31 @@ def unfollow(username):
     if user is None:
         flash('Invalid user.')
         return redirect(url_for('.index'))
-    if not current_user.is_following(user):
+    if not current_user.unfollow(user):
         flash('You are not following this user.')
         return redirect(url_for('.user', username=username))
-    current_user.unfollow(user)
     flash('You are not following %s anymore.' % username)
     return redirect(url_for('.user', username=username))
 
 
+def mark_followed(follows):
+    """Flag the listed users the current user follows, from memory."""
+    followed = set()
+    if current_user.is_authenticated:
+        followed = current_user.followed_among(
+            [follow['user'].id for follow in follows])
+    for follow in follows:
+        follow['followed'] = follow['user'].id in followed
+
+
 @main.route('/followers/<username>')
+@page_cache.cached
 def followers(username):
     user = User.select().where(User.username == username).first()
     if user is None:
         flash('Invalid user.')
         return redirect(url_for('.index'))
+    page_cache.tag('user:%d' % user.id)
     page = request.args.get('page', 1, type=int)
     pagination = Pagination(Follow.followers_of(user),
                             current_app.config['FLASKR_FOLLOWERS_PER_PAGE'],
@@ -208,6 +308,7 @@ def followers(username):
                             check_bounds=False)
     follows = [{'user': item.follower, 'timestamp': item.timestamp}
                for item in pagination.items]
+    mark_followed(follows)
     return render_template('followers.html', user=user,
                            title='Followers of',
                            endpoint='.followers', pagination=pagination,
@@ -215,11 +316,13 @@ def followers(username):
 
 
 @main.route('/followed-by/<username>')
+@page_cache.cached
 def followed_by(username):
     user = User.select().where(User.username == username).first()
     if user is None:
         flash('Invalid user.')
         return redirect(url_for('.index'))
+    page_cache.tag('user:%d' % user.id)
     page = request.args.get('page', 1, type=int)
     pagination = Pagination(Follow.followed_by(user),
                             current_app.config['FLASKR_FOLLOWERS_PER_PAGE'],
@@ -227,6 +330,7 @@ def followed_by(username):
                             check_bounds=False)
     follows = [{'user': item.followed, 'timestamp': item.timestamp}
                for item in pagination.items]
+    mark_followed(follows)
     return render_template('followers.html', user=user, title='Followed by',
                            endpoint='.followed_by', pagination=pagination,
                            follows=follows)
@@ -248,38 +352,71 @@ def show_followed():
     return resp
 
 
+MODERATION_STATES = ('unreviewed', 'disabled', 'all')
+
+
 @main.route('/moderate')
 @login_required
 @permission_required(Permission.MODERATE_COMMENTS)
 def moderate():
+    state = request.args.get('state', 'unreviewed')
+    if state not in MODERATION_STATES:
+        abort(404)
     pagination = Pagination(
-        Comment.timeline(),
+        Comment.moderation_queue(state),
         current_app.config['FLASKR_COMMENTS_PER_PAGE'],
         check_bounds=False)
     comments = pagination.items
     return render_template('moderate.html', comments=comments,
-                           pagination=pagination, page=pagination.page)
+                           pagination=pagination, page=pagination.page,
+                           state=state, states=MODERATION_STATES,
+                           form=BulkModerationForm())
+
+
+def back_to_moderation():
+    return redirect(url_for('.moderate',
+                            state=request.args.get('state', 'unreviewed'),
+                            page=request.args.get('page', 1, type=int)))
 
 
 @main.route('/moderate/enable/<int:id>')
 @login_required
 @permission_required(Permission.MODERATE_COMMENTS)
 def moderate_enable(id):
-    comment = futils.get_object_or_404(Comment.select(),
-                                       (Comment.id == id))
-    comment.disabled = False
-    comment.save()
-    return redirect(url_for('.moderate',
-                            page=request.args.get('page', 1, type=int)))
+    futils.get_object_or_404(Comment.select(Comment.id), (Comment.id == id))
+    Comment.moderate(False, ids=[id])
+    return back_to_moderation()
 
 
 @main.route('/moderate/disable/<int:id>')
 @login_required
 @permission_required(Permission.MODERATE_COMMENTS)
 def moderate_disable(id):
-    comment = futils.get_object_or_404(Comment.select(),
-                                       (Comment.id == id))
-    comment.disabled = True
-    comment.save()
-    return redirect(url_for('.moderate',
-                            page=request.args.get('page', 1, type=int)))
+    futils.get_object_or_404(Comment.select(Comment.id), (Comment.id == id))
+    Comment.moderate(True, ids=[id])
+    return back_to_moderation()
+
+
+@main.route('/moderate/bulk', methods=['POST'])
+@login_required
+@permission_required(Permission.MODERATE_COMMENTS)
+def moderate_bulk():
+    form = BulkModerationForm()
+    if not form.validate_on_submit():
+        for errors in form.errors.values():
+            for error in errors:
+                flash(error)
+        return back_to_moderation()
+    ids = request.form.getlist('ids', type=int) or None
+    author = form.author_user if form.author.data else None
+    if ids is None and author is None and form.since.data is None and \
+            form.until.data is None:
+        flash('Select comments, an author or a time range.')
+        return back_to_moderation()
+    count = Comment.moderate(bool(form.disable.data), ids=ids,
+                             author=author, since=form.since.data,
+                             until=form.until.data)
+    flash('%d comment%s %s.' % (count, '' if count == 1 else 's',
+                               'disabled' if form.disable.data
+                               else 'enabled'))
+    return back_to_moderation()
@@ -1,5 +1,8 @@
 from datetime import datetime
+from functools import reduce
 import hashlib
+import operator
+import re
 
 from flask import current_app, request, url_for
 
@@ -18,7 +21,11 @@ from requests.exceptions import ConnectionError, HTTPError
 from app.exceptions import ValidationError
 from . import db
 from . import login_manager
+from . import writer
+from . import page_cache, fragment_cache, events, usernames, availability
+from . import follow_graph
 from .decorators import require_instance
+from .jsonprovider import isoformat, parse_isoformat
 from utils.identicon import IdenticonSVG
 
 
@@ -29,6 +36,44 @@ def refresh(self):
 
 
 db.Model.refresh = refresh
+db.Model.save = writer.serialized(db.Model.save)
+
+
+def save_logged(entity, instance, save, *args, **kwargs):
+    """Run `save` and log it to :class:`Change` in the same transaction."""
+    op = 'update' if instance._get_pk_value() else 'create'
+
+    def unit():
+        with db.database.atomic():
+            result = save(*args, **kwargs)
+            Change.log(entity, instance._get_pk_value(), op)
+        return result
+    return writer.run(unit)
+
+
+def render_markdown(body, allowed_tags):
+    """Render markdown `body` to HTML restricted to `allowed_tags`."""
+    return bleach.linkify(bleach.clean(
+        markdown(body, output_format='html'),
+        tags=allowed_tags, strip=True))
+
+
+MENTION = re.compile(r'(?<![\w@/])@([A-Za-z][A-Za-z0-9_.]{0,63})')
+HASHTAG = re.compile(r'(?<![\w#&/])#(\w*[^\W\d_]\w*)', re.UNICODE)
+
+
+def extract_references(body):
+    """The usernames mentioned in markdown `body` and its #tags."""
+    body = body or ''
+    mentions = set(name.rstrip('.') for name in MENTION.findall(body))
+    tags = set(tag.lower()[:64] for tag in HASHTAG.findall(body))
+    return mentions, tags
+
+
+def chunked(items, size):
+    items = list(items)
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
 
 
 class Permission:
@@ -106,12 +151,6 @@ class User(UserMixin, db.Model):
             with db.database.atomic():
                 User.insert_many(fake_data[idx:idx+10]).execute()
 
-    @staticmethod
-    def add_self_follows():
-        for user in User.select():
-            if not user.is_following(user):
-                user.follow(user)
-
     def __init__(self, **kwargs):
         super(User, self).__init__(**kwargs)
         self._role()
@@ -128,10 +167,26 @@ class User(UserMixin, db.Model):
             if self.role is None:
                 self.role = Role.select().where(Role.default == True).first()
 
+    @writer.serialized
     def save(self, *args, **kwargs):
-        super(self.__class__, self).save(*args, **kwargs)
-        if not self.is_following(self):
-            self.follow(self)
+        # posts and comments show the author's name and avatar
+        shown = set(['username', 'email', 'avatar_hash'])
+        profile_changed = any(f.name in shown for f in self.dirty_fields)
+        renamed = any(f.name == 'username' for f in self.dirty_fields)
+        created = self.id is None
+        with db.database.atomic():
+            super(self.__class__, self).save(*args, **kwargs)
+            # last_seen changes on every request, don't log it
+            if created or profile_changed:
+                Change.log('user', self.id, 'create' if created else 'update')
+        writer.after_commit(page_cache.invalidate, 'user:%d' % self.id)
+        if profile_changed:
+            writer.after_commit(fragment_cache.invalidate,
+                                'user:%d' % self.id)
+        if created or renamed:
+            writer.after_commit(usernames.user_saved, self)
+        if created or profile_changed:
+            writer.after_commit(availability.user_saved, self)
 
     @property
     def password(self):
@@ -208,6 +263,7 @@ class User(UserMixin, db.Model):
     def is_administrator(self):
         return self.can(Permission.ADMINISTER)
 
+    @writer.serialized
     def ping(self):
         self.last_seen = datetime.utcnow()
         self.save()
@@ -239,30 +295,62 @@ class User(UserMixin, db.Model):
         return gravatar_url
 
     @require_instance
+    @writer.serialized
     def follow(self, user):
-        if not self.is_following(user):
+        """Follow `user`; returns False if already following, or if
+        `user` is this user."""
+        if user.id == self.id:
+            return False
+        # the table decides; the graph may miss other processes' writes
+        if self.followed.where(Follow.followed == user.id).first() is None:
             f = Follow(follower=self, followed=user)
             f.save()
+            return True
+        follow_graph.followed(self.id, user.id)
+        return False
 
+    @writer.serialized
     def unfollow(self, user):
+        """Unfollow `user`; returns False if not following."""
         f = self.followed.where(Follow.followed == user.id).first()
         if f:
             f.delete_instance()
+            return True
+        follow_graph.unfollowed(self.id, user.id)
+        return False
 
     def is_following(self, user):
-        return self.followed.where(
-            Follow.followed == user.id).first() is not None
+        return follow_graph.is_following(self.id, user.id)
 
     def is_followed_by(self, user):
-        return self.followers.where(
-            Follow.follower == user.id).first() is not None
+        return follow_graph.is_following(user.id, self.id)
+
+    def followed_among(self, ids):
+        """The set of user `ids` this user follows."""
+        return follow_graph.followed_among(self.id, ids)
+
+    def suggested_users(self, limit):
+        """Users to follow, best first, with their `score`.
+
+        The suggestions are computed in batch; the users followed since
+        are skipped.
+        """
+        users = list(User.select(User, Suggestion.score)
+                     .join(Suggestion, on=(Suggestion.suggested == User.id))
+                     .where(Suggestion.user == self)
+                     .order_by(Suggestion.rank)
+                     .naive())
+        followed = self.followed_among([user.id for user in users])
+        return [user for user in users if user.id not in followed][:limit]
 
     @property
     def followed_posts(self):
+        """Posts of the followed users and of the user themselves."""
+        authors = Follow.feed_authors(self.id)
         return (Post.select(Post, self.__class__)
-                .join(Follow, on=(Post.author == Follow.followed))
-                .join(self.__class__, on=(Post.author == self.__class__.id))
-                .where(Follow.follower == self))
+                .join(authors, on=(Post.author == authors.c.id))
+                .switch(Post)
+                .join(self.__class__, on=(Post.author == self.__class__.id)))
 
     def to_json(self):
         json_user = {
@@ -321,6 +409,41 @@ class Follow(db.Model):
                                   on_delete='CASCADE')
     timestamp = pw.DateTimeField(default=datetime.utcnow)
 
+    def save(self, *args, **kwargs):
+        created = self.id is None
+        result = save_logged('follow', self, super(Follow, self).save,
+                             *args, **kwargs)
+        writer.after_commit(self.invalidate_pages)
+        if created:
+            writer.after_commit(usernames.follow_changed, self, 1)
+            writer.after_commit(follow_graph.followed, self.follower_id,
+                                self.followed_id)
+        return result
+
+    @writer.serialized
+    def delete_instance(self, *args, **kwargs):
+        with db.database.atomic():
+            Change.log('follow', self.id, 'delete')
+            result = super(Follow, self).delete_instance(*args, **kwargs)
+        writer.after_commit(self.invalidate_pages)
+        writer.after_commit(usernames.follow_changed, self, -1)
+        writer.after_commit(follow_graph.unfollowed, self.follower_id,
+                            self.followed_id)
+        return result
+
+    def invalidate_pages(self):
+        page_cache.invalidate('user:%s' % self.follower_id,
+                              'user:%s' % self.followed_id)
+
+    @classmethod
+    def feed_authors(cls, user_id):
+        """Subquery of the ids of the users followed by `user_id`, and of
+        `user_id`: a UNION ALL, which SQLite plans as two index lookups."""
+        return (cls.select(cls.followed.alias('id'))
+                .where(cls.follower == user_id)
+                .union_all(User.select(User.id).where(User.id == user_id))
+                .alias('authors'))
+
     @classmethod
     def followers_of(cls, user):
         """Followers of user."""
@@ -346,6 +469,7 @@ class Post(db.Model):
     body = pw.TextField(null=True)
     body_html = pw.TextField(null=True)
     timestamp = pw.DateTimeField(index=True, default=datetime.utcnow)
+    updated = pw.DateTimeField(default=datetime.utcnow, null=True)
     author = pw.ForeignKeyField(User, related_name='posts', null=True)
 
     @staticmethod
@@ -366,14 +490,36 @@ class Post(db.Model):
             with db.database.atomic():
                 Post.insert_many(fake_data[idx:idx+10]).execute()
 
+    allowed_tags = ['a', 'abbr', 'acronym', 'b', 'blockquote', 'code',
+                    'em', 'i', 'li', 'ol', 'pre', 'strong', 'ul',
+                    'h1', 'h2', 'h3', 'p']
+
     @require_instance
+    @writer.serialized
     def update_body_html(self):
-        allowed_tags = ['a', 'abbr', 'acronym', 'b', 'blockquote', 'code',
-                        'em', 'i', 'li', 'ol', 'pre', 'strong', 'ul',
-                        'h1', 'h2', 'h3', 'p']
-        self.__class__.update(body_html=bleach.linkify(bleach.clean(
-            markdown(self.body, output_format='html'),
-            tags=allowed_tags, strip=True))).where(self._pk_expr()).execute()
+        body_html = render_markdown(self.body, self.allowed_tags)
+        with db.database.atomic():
+            self.__class__.update(body_html=body_html,
+                                  updated=datetime.utcnow()).where(
+                self._pk_expr()).execute()
+            Change.log('post', self.id, 'update')
+            Post.index_references([(self.id, self.body, self.timestamp)])
+        writer.after_commit(self.invalidate_pages)
+
+    def save(self, *args, **kwargs):
+        created = self.id is None
+        self.updated = datetime.utcnow()
+        result = save_logged('post', self, super(Post, self).save,
+                             *args, **kwargs)
+        writer.after_commit(self.invalidate_pages)
+        if created:
+            writer.after_commit(events.post_created, self)
+        return result
+
+    def invalidate_pages(self):
+        page_cache.invalidate('posts', 'post:%d' % self.id,
+                              'user:%s' % self.author_id)
+        fragment_cache.invalidate('post:%d' % self.id)
 
     @classmethod
     def timeline(cls, order='desc'):
@@ -408,6 +554,85 @@ class Post(db.Model):
                 .where(cls.author == user)
                 .order_by(order))
 
+    @classmethod
+    def tagged(cls, tag, before=None):
+        """Posts with #`tag`, newest first, older than `before`
+        (see :meth:`Tag.parse_cursor`)."""
+        query = (cls.select(cls, User)
+                 .join(User, on=(cls.author == User.id))
+                 .switch(cls)
+                 .join(Tag, on=(Tag.post == cls.id))
+                 .where(Tag.tag == tag.lower()))
+        if before is not None:
+            ts, id = before
+            query = query.where((Tag.ts < ts) |
+                                ((Tag.ts == ts) & (Tag.post < id)))
+        return query.order_by(Tag.ts.desc(), Tag.post.desc())
+
+    @classmethod
+    def mentioning(cls, user, before=None):
+        """Posts mentioning `user`, newest first, with ids below `before`."""
+        query = (cls.select(cls, User)
+                 .join(User, on=(cls.author == User.id))
+                 .switch(cls)
+                 .join(Mention, on=(Mention.post == cls.id))
+                 .where(Mention.user == user.id))
+        if before is not None:
+            query = query.where(Mention.post < before)
+        return query.order_by(Mention.post.desc())
+
+    @classmethod
+    def index_references(cls, posts):
+        """Store the mentions and tags of `posts`, given as ``(id, body,
+        timestamp)``, in place of those stored before.
+
+        Runs inside the transaction that writes the posts.
+        """
+        found = [(id, timestamp) + extract_references(body)
+                 for id, body, timestamp in posts]
+        names = set()
+        for id, timestamp, mentions, tags in found:
+            names.update(mentions)
+        users = {}
+        for chunk in chunked(names, 500):
+            users.update(User.select(User.username, User.id)
+                         .where(User.username << chunk).tuples())
+        for chunk in chunked([id for id, _, _, _ in found], 500):
+            Mention.delete().where(Mention.post << chunk).execute()
+            Tag.delete().where(Tag.post << chunk).execute()
+        mentions = [dict(post=id, user=users[name])
+                    for id, timestamp, names, tags in found
+                    for name in names if name in users]
+        tags = [dict(tag=tag, post=id, ts=timestamp)
+                for id, timestamp, names, tags in found for tag in tags]
+        # at most 3 columns per row
+        for chunk in chunked(mentions, 300):
+            Mention.insert_many(chunk).execute()
+        for chunk in chunked(tags, 300):
+            Tag.insert_many(chunk).execute()
+
+    @classmethod
+    def backfill_references(cls, batch=1000, echo=None):
+        """Index the mentions and tags of every post; returns the count."""
+        last = done = 0
+        while True:
+            posts = list(cls.select(cls.id, cls.body, cls.timestamp)
+                         .where(cls.id > last)
+                         .order_by(cls.id)
+                         .limit(batch)
+                         .tuples())
+            if not posts:
+                return done
+
+            def unit():
+                with db.database.atomic():
+                    cls.index_references(posts)
+            writer.run(unit)
+            last = posts[-1][0]
+            done += len(posts)
+            if echo:
+                echo('%d posts indexed' % done)
+
     def to_json(self):
         json_post = {
             'url': url_for('api.get_post', id=self.id, _external=True),
@@ -439,16 +664,62 @@ class Comment(db.Model):
     body_html = pw.TextField(null=True)
     timestamp = pw.DateTimeField(index=True, default=datetime.utcnow)
     disabled = pw.BooleanField(null=True, default=False)
+    # set once a moderator enabled or disabled the comment
+    reviewed = pw.BooleanField(default=False)
+    updated = pw.DateTimeField(default=datetime.utcnow, null=True)
     author = pw.ForeignKeyField(User, related_name='comments', null=True)
     post = pw.ForeignKeyField(Post, related_name='comments', null=True)
 
+    allowed_tags = ['a', 'abbr', 'acronym', 'b', 'code', 'em', 'i',
+                    'strong']
+
     @require_instance
+    @writer.serialized
     def update_body_html(self):
-        allowed_tags = ['a', 'abbr', 'acronym', 'b', 'code', 'em', 'i',
-                        'strong']
-        self.__class__.update(body_html=bleach.linkify(bleach.clean(
-            markdown(self.body, output_format='html'),
-            tags=allowed_tags, strip=True))).where(self._pk_expr()).execute()
+        body_html = render_markdown(self.body, self.allowed_tags)
+        with db.database.atomic():
+            self.__class__.update(body_html=body_html,
+                                  updated=datetime.utcnow()).where(
+                self._pk_expr()).execute()
+            Change.log('comment', self.id, 'update')
+            post_author_id = self._post_author_id()
+        writer.after_commit(self.invalidate_pages, post_author_id)
+
+    @writer.serialized
+    def save(self, *args, **kwargs):
+        created = self.id is None
+        self.updated = datetime.utcnow()
+        result = save_logged('comment', self, super(Comment, self).save,
+                             *args, **kwargs)
+        writer.after_commit(self.invalidate_pages, self._post_author_id())
+        if created:
+            writer.after_commit(events.comment_created, self)
+        return result
+
+    def _post_author_id(self):
+        """Author of the post of the comment, for :meth:`invalidate_pages`.
+
+        Read in the write unit, from the post when it is loaded already;
+        None when the page cache is off or the comment has no post.
+        """
+        if not page_cache.enabled() or self.post_id is None:
+            return None
+        post = self._obj_cache.get('post')
+        if post is not None:
+            return post.author_id
+        return (Post.select(Post.author)
+                .where(Post.id == self.post_id).scalar())
+
+    def invalidate_pages(self, post_author_id=None):
+        fragment_cache.invalidate('comment:%s' % self.id)
+        if page_cache.enabled():
+            tags = ['posts', 'user:%s' % self.author_id]
+            if self.post_id is not None:
+                tags.append('post:%s' % self.post_id)
+            if post_author_id is not None:
+                # the post author's page shows the comment count of the post
+                tags.append('user:%s' % post_author_id)
+            page_cache.invalidate(*tags)
 
     @classmethod
     def timeline(cls, order='desc'):
@@ -461,6 +732,74 @@ class Comment(db.Model):
                 .join(User, on=cls.author)
                 .order_by(order))
 
+    @classmethod
+    def moderation_queue(cls, state='unreviewed'):
+        """Comments not reviewed yet, disabled ones or all, newest first."""
+        query = cls.timeline()
+        if state == 'unreviewed':
+            query = query.where(cls.reviewed == False)
+        elif state == 'disabled':
+            query = query.where(cls.disabled == True)
+        return query
+
+    @classmethod
+    def moderate(cls, disabled, ids=None, author=None, since=None,
+                 until=None):
+        """Enable or disable the matching comments; returns their count.
+
+        Comments are matched by id, by author and by a ``[since, until)``
+        time range, all of the given criteria applying.  Comments already
+        reviewed into that state are left alone; the others are selected
+        once, then updated by id and logged in the same transaction.
+        """
+        criteria = []
+        if ids is not None:
+            criteria.append(cls.id << list(ids))
+        if author is not None:
+            criteria.append(cls.author == author)
+        if since is not None:
+            criteria.append(cls.timestamp >= since)
+        if until is not None:
+            criteria.append(cls.timestamp < until)
+        if not criteria:
+            raise ValueError('no comments selected')
+        where = reduce(operator.and_, criteria) & (
+            (pw.fn.COALESCE(cls.disabled, False) != disabled) |
+            (cls.reviewed == False))
+
+        def unit():
+            with db.database.atomic():
+                # comments whose post is gone are moderated too
+                rows = list(cls.select(cls.id, cls.post, cls.author,
+                                       Post.author)
+                            .join(Post, pw.JOIN.LEFT_OUTER,
+                                  on=(cls.post == Post.id))
+                            .where(where)
+                            .tuples())
+                ids = [row[0] for row in rows]
+                now = datetime.utcnow()
+                # at most 500 ids per statement
+                for i in range(0, len(ids), 500):
+                    cls.update(disabled=disabled, reviewed=True,
+                               updated=now).where(
+                        cls.id << ids[i:i + 500]).execute()
+                if ids:
+                    Change.log_many('comment', ids, 'update')
+            return rows
+        rows = writer.run(unit)
+        if rows:
+            fragment_cache.invalidate(*['comment:%d' % row[0]
+                                        for row in rows])
+            tags = set(['posts'])
+            for id, post_id, author_id, post_author_id in rows:
+                tags.add('user:%s' % author_id)
+                if post_id is not None:
+                    tags.add('post:%s' % post_id)
+                if post_author_id is not None:
+                    tags.add('user:%s' % post_author_id)
+            page_cache.invalidate(*tags)
+        return len(rows)
+
     def to_json(self):
         json_comment = {
             'url': url_for('api.get_comment', id=self.id, _external=True),
@@ -483,3 +822,146 @@ class Comment(db.Model):
 
     class Meta:
         db_table = 'comments'
+        indexes = (
+            # the moderation queue
+            (('disabled', 'timestamp'), False),
+            (('reviewed', 'timestamp'), False),
+        )
+
+
+class Change(db.Model):
+    """Append-only log of the writes, read by ``/api/v1.0/changes``.
+
+    Every create, update and delete of a user profile, post, comment or
+    follow adds a row in the same transaction as the write.  ``seq``
+    orders the log.  :meth:`compact` drops the rows superseded by a later
+    change of the same entity; :meth:`purge` drops old rows altogether
+    and records how far it went in a row with entity ``*``, so clients
+    that were behind know they have to resync.
+    """
+    seq = pw.PrimaryKeyField()
+    # the latest change of an entity kind is an index lookup
+    entity = pw.CharField(16, index=True)
+    entity_id = pw.IntegerField()
+    op = pw.CharField(8)
+    ts = pw.DateTimeField(index=True, default=datetime.utcnow)
+
+    PURGED = '*'
+
+    @classmethod
+    def log(cls, entity, entity_id, op):
+        cls.insert(entity=entity, entity_id=entity_id, op=op,
+                   ts=datetime.utcnow()).execute()
+
+    @classmethod
+    def log_many(cls, entity, ids, op):
+        now = datetime.utcnow()
+        rows = [dict(entity=entity, entity_id=id, op=op, ts=now)
+                for id in ids]
+        # at most 4 columns per row
+        for i in range(0, len(rows), 200):
+            cls.insert_many(rows[i:i + 200]).execute()
+
+    @classmethod
+    def purged_through(cls):
+        """The last seq removed by :meth:`purge`, or 0."""
+        return (cls.select(pw.fn.MAX(cls.entity_id))
+                .where(cls.entity == cls.PURGED).scalar() or 0)
+
+    @classmethod
+    def compact(cls, before):
+        """Drop the changes older than `before` that were superseded."""
+        table = cls._meta.db_table
+        cursor = db.database.execute_sql(
+            'DELETE FROM {0} WHERE ts < ? AND entity != ? AND EXISTS ('
+            'SELECT 1 FROM {0} AS newer WHERE newer.entity = {0}.entity '
+            'AND newer.entity_id = {0}.entity_id AND newer.seq > {0}.seq)'
+            .format(table).replace('?', db.database.interpolation),
+            (before, cls.PURGED))
+        return cursor.rowcount
+
+    @classmethod
+    def purge(cls, before):
+        """Drop every change older than `before`."""
+        with db.database.atomic():
+            last = (cls.select(pw.fn.MAX(cls.seq))
+                    .where((cls.ts < before) & (cls.entity != cls.PURGED))
+                    .scalar())
+            if last is None:
+                return 0
+            count = (cls.delete()
+                     .where((cls.seq < last) & (cls.entity != cls.PURGED))
+                     .execute())
+            cls.delete().where(cls.entity == cls.PURGED).execute()
+            # the row of `last` becomes the marker: SQLite hands out the
+            # seqs above the largest one left, never the purged ones
+            (cls.update(entity=cls.PURGED, entity_id=last, op='purge')
+             .where(cls.seq == last)
+             .execute())
+        return count + 1
+
+    class Meta:
+        db_table = 'changes'
+
+
+class Mention(db.Model):
+    """A user mentioned with ``@username`` in a post."""
+    # foreign keys are indexed, ``post`` included
+    post = pw.ForeignKeyField(Post, related_name='mentions',
+                              on_delete='CASCADE')
+    user = pw.ForeignKeyField(User, related_name='mentions',
+                              on_delete='CASCADE')
+
+    class Meta:
+        db_table = 'mentions'
+        indexes = (
+            (('user', 'post'), True),
+        )
+
+
+class Tag(db.Model):
+    """A ``#tag`` of a post; `ts` is the time of the post."""
+    tag = pw.CharField(64)
+    post = pw.ForeignKeyField(Post, related_name='tags',
+                              on_delete='CASCADE')
+    ts = pw.DateTimeField()
+
+    class Meta:
+        db_table = 'tags'
+        indexes = (
+            (('tag', 'ts', 'post'), False),
+            (('post', 'tag'), True),
+        )
+
+    @staticmethod
+    def cursor(timestamp, id):
+        """The `before` of :meth:`Post.tagged` following a post."""
+        return '%s_%d' % (isoformat(timestamp), id)
+
+    @staticmethod
+    def parse_cursor(value):
+        """``(ts, id)`` of a cursor; raises ValueError when invalid."""
+        ts, _, id = value.rpartition('_')
+        return parse_isoformat(ts), int(id)
+
+
+class Suggestion(db.Model):
+    """A user to follow, from ``flask suggest`` (see app/suggestions.py).
+
+    `score` is the number of users followed by `user` who follow
+    `suggested`; `rank` orders the suggestions of a user, best first.
+    """
+    # foreign keys are indexed, ``user`` included
+    user = pw.ForeignKeyField(User, related_name='suggestions',
+                              on_delete='CASCADE')
+    suggested = pw.ForeignKeyField(User, related_name='suggested_to',
+                                   on_delete='CASCADE')
+    rank = pw.IntegerField()
+    score = pw.IntegerField()
+    computed = pw.DateTimeField(default=datetime.utcnow, index=True)
+
+    class Meta:
+        db_table = 'suggestions'
+        indexes = (
+            (('user', 'rank'), True),
+        )
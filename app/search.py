@@ -0,0 +1,207 @@
+"""Full-text search of posts and comments with SQLite FTS5.
+
+``posts_fts`` and ``comments_fts`` are external-content FTS5 tables:
+they index ``posts.body`` and ``comments.body`` without keeping a copy
+of the text.  Triggers on the two tables keep the index in sync with
+every insert, edit and delete, including the multi-row inserts of the
+batch endpoints, ``flask import`` and ``flask fake``.  ``flask
+rebuild-search`` creates the index and rebuilds it from the tables.
+
+A query is a list of words that must all match; ``"a phrase"`` matches
+the words in a row and a trailing ``*`` a prefix.  Anything else in the
+query is ignored, so no input can make FTS5 raise a syntax error.
+
+Results are ranked by bm25 and paginated by keyset on ``(rank, id)``.
+A page takes three queries whatever the size of the table: the ids of
+the page, their snippets, and the rows to show.  The first one still
+scores every matching row, so very common words cost more than rare
+ones (see ``flask bench-search``).
+
+Search needs SQLite with FTS5; with another database, or before the
+index is created, :func:`installed` is false and the views say so.
+"""
+from collections import namedtuple
+import re
+
+from flask import Markup, escape
+import peewee as pw
+
+from . import db
+from .models import Post, Comment
+
+WORD = re.compile(r'\w+', re.UNICODE)
+TERM = re.compile(r'"([^"]*)"?|(\S+)')
+MAX_TERMS = 16
+
+# indexed column and filter of the rows shown, per model
+INDEXED = {
+    Post: ('body', None),
+    Comment: ('body', 'NOT comments.disabled'),
+}
+
+Hit = namedtuple('Hit', 'id rank snippet')
+
+
+def _database(database=None):
+    return database or db.database
+
+
+def _sqlite(database):
+    database = getattr(database, 'obj', database)
+    return isinstance(database, pw.SqliteDatabase)
+
+
+def index_name(model):
+    return model._meta.db_table + '_fts'
+
+
+def _ddl(model):
+    table = model._meta.db_table
+    column = INDEXED[model][0]
+    values = dict(fts=index_name(model), table=table, column=column)
+    insert = ('INSERT INTO {fts}(rowid, {column}) '
+              'VALUES (new.id, new.{column});').format(**values)
+    delete = ("INSERT INTO {fts}({fts}, rowid, {column}) "
+              "VALUES ('delete', old.id, old.{column});").format(**values)
+    return [
+        ("CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5("
+         "{column}, content='{table}', content_rowid='id', "
+         "tokenize='porter unicode61')").format(**values),
+        'CREATE TRIGGER IF NOT EXISTS {fts}_insert AFTER INSERT ON {table} '
+        'BEGIN {insert} END'.format(insert=insert, **values),
+        'CREATE TRIGGER IF NOT EXISTS {fts}_delete AFTER DELETE ON {table} '
+        'BEGIN {delete} END'.format(delete=delete, **values),
+        # saves write every column, only reindex when the text changed
+        'CREATE TRIGGER IF NOT EXISTS {fts}_update AFTER UPDATE OF {column} '
+        'ON {table} WHEN old.{column} IS NOT new.{column} '
+        'BEGIN {delete} {insert} END'.format(delete=delete, insert=insert,
+                                             **values),
+    ]
+
+
+def create_index(database=None):
+    """Create the index and its triggers, then rebuild it."""
+    database = _database(database)
+    if not _sqlite(database):
+        return False
+    with database.atomic():
+        for model in INDEXED:
+            for statement in _ddl(model):
+                database.execute_sql(statement)
+    rebuild(database)
+    return True
+
+
+def rebuild(database=None):
+    """Reindex every row, then merge the index into a single segment."""
+    database = _database(database)
+    for model in INDEXED:
+        fts = index_name(model)
+        with database.atomic():
+            database.execute_sql(
+                "INSERT INTO {0}({0}) VALUES ('rebuild')".format(fts))
+        database.execute_sql(
+            "INSERT INTO {0}({0}) VALUES ('optimize')".format(fts))
+
+
+def drop_index(database=None):
+    database = _database(database)
+    if not _sqlite(database):
+        return
+    with database.atomic():
+        for model in INDEXED:
+            fts = index_name(model)
+            for suffix in ('insert', 'delete', 'update'):
+                database.execute_sql('DROP TRIGGER IF EXISTS %s_%s' %
+                                     (fts, suffix))
+            database.execute_sql('DROP TABLE IF EXISTS %s' % fts)
+
+
+def installed():
+    if not _sqlite(db.database):
+        return False
+    cursor = db.database.execute_sql(
+        "SELECT COUNT(*) FROM sqlite_master WHERE type = 'table' "
+        "AND name IN (?, ?)", [index_name(model) for model in INDEXED])
+    return cursor.fetchone()[0] == len(INDEXED)
+
+
+def match_expression(q):
+    """Turn the query typed by a user into an FTS5 query, or ''."""
+    terms = []
+    for phrase, word in TERM.findall(q or ''):
+        if phrase:
+            words = WORD.findall(phrase)
+            if words:
+                terms.append('"%s"' % ' '.join(words))
+            continue
+        words = WORD.findall(word)
+        terms.extend('"%s"' % w for w in words)
+        if words and word.endswith('*'):
+            terms[-1] += '*'
+    return ' '.join(terms[:MAX_TERMS])
+
+
+def parse_cursor(value):
+    """``(rank, id)`` from the `after` value of a page, or None."""
+    if not value:
+        return None
+    rank, _, id = value.rpartition(':')
+    try:
+        return float(rank), int(id)
+    except ValueError:
+        raise ValueError('invalid cursor %r' % value)
+
+
+def format_cursor(hit):
+    return '%r:%d' % (hit.rank, hit.id)
+
+
+def highlight(snippet):
+    """The HTML of a snippet, with the matches in ``<mark>``."""
+    return Markup(escape(snippet).replace('\x02', Markup('<mark>'))
+                  .replace('\x03', Markup('</mark>')))
+
+
+def search(model, q, after=None, limit=20):
+    """Return ``(hits, next)`` for the query `q` over `model`.
+
+    `hits` are the :class:`Hit` of at most `limit` rows following the
+    cursor `after`, best first; `next` is the cursor of the next page,
+    or None on the last one.
+    """
+    expression = match_expression(q)
+    if not expression:
+        return [], None
+    fts = index_name(model)
+    table = model._meta.db_table
+    visible = INDEXED[model][1]
+    sql = ['SELECT {fts}.rowid, {fts}.rank FROM {fts}']
+    params = [expression]
+    if visible:
+        sql.append('JOIN {table} ON {table}.id = {fts}.rowid')
+    sql.append('WHERE {fts} MATCH ?')
+    if visible:
+        sql.append('AND ' + visible)
+    if after is not None:
+        sql.append('AND ({fts}.rank > ? OR ({fts}.rank = ? '
+                   'AND {fts}.rowid > ?))')
+        params.extend([after[0], after[0], after[1]])
+    sql.append('ORDER BY {fts}.rank, {fts}.rowid LIMIT ?')
+    params.append(limit + 1)
+    rows = db.database.execute_sql(
+        ' '.join(sql).format(fts=fts, table=table), params).fetchall()
+    more = len(rows) > limit
+    rows = rows[:limit]
+    if not rows:
+        return [], None
+
+    # snippets of the page only, not of every match
+    snippets = dict(db.database.execute_sql(
+        "SELECT rowid, snippet({fts}, 0, char(2), char(3), '...', 24) "
+        "FROM {fts} WHERE {fts} MATCH ? AND rowid IN ({ids})".format(
+            fts=fts, ids=', '.join('?' * len(rows))),
+        [expression] + [id for id, rank in rows]).fetchall())
+    hits = [Hit(id, rank, highlight(snippets.get(id, '')))
+            for id, rank in rows]
+    return hits, format_cursor(hits[-1]) if more else None
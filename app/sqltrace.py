@@ -0,0 +1,144 @@
+"""Per-request SQL instrumentation.
+
+:func:`install` wraps ``execute_sql`` of the peewee database behind
+``db.database`` so statements can be observed.  Observers are registered
+per thread, so an installed hook with nobody listening costs one
+thread-local lookup per statement; when ``FLASKR_SQL_TRACE`` is off and no
+:class:`QueryRecorder` is in use the hook is not installed at all.
+
+With tracing on, every request counts its statements and the time spent
+in the database, reports both in a ``Server-Timing`` header and logs the
+statements slower than ``FLASKR_SLOW_DB_QUERY_TIME`` seconds, tagged with
+the endpoint that issued them.
+"""
+import threading
+import time
+
+from flask import current_app, g, request
+
+
+_local = threading.local()
+
+
+def _listeners():
+    listeners = getattr(_local, 'listeners', None)
+    if listeners is None:
+        listeners = _local.listeners = []
+    return listeners
+
+
+def install(database=None):
+    """Hook `database` (default: the app database) to report statements."""
+    if database is None:
+        from . import db
+        database = db.database.obj
+    if getattr(database, '_flaskr_traced', False):
+        return
+    execute_sql = database.execute_sql
+
+    def traced_execute_sql(sql, params=None, require_commit=True):
+        listeners = getattr(_local, 'listeners', None)
+        if not listeners:
+            return execute_sql(sql, params, require_commit)
+        start = time.perf_counter()
+        try:
+            return execute_sql(sql, params, require_commit)
+        finally:
+            duration = time.perf_counter() - start
+            for listener in listeners:
+                listener(sql, params, duration)
+
+    database.execute_sql = traced_execute_sql
+    database._flaskr_traced = True
+
+
+class QueryRecorder(object):
+    """Context manager recording the statements issued by this thread.
+
+    ::
+
+        with QueryRecorder() as recorder:
+            ...
+        print(len(recorder), recorder.total_time)
+    """
+
+    def __init__(self, database=None):
+        self.database = database
+        self.queries = []
+
+    def __call__(self, sql, params, duration):
+        self.queries.append((sql, params, duration))
+
+    def __enter__(self):
+        install(self.database)
+        _listeners().append(self)
+        return self
+
+    def __exit__(self, *exc_info):
+        _listeners().remove(self)
+
+    def __len__(self):
+        return len(self.queries)
+
+    @property
+    def total_time(self):
+        return sum(duration for sql, params, duration in self.queries)
+
+
+class SQLTrace(object):
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('FLASKR_SQL_TRACE', False)
+        app.config.setdefault('FLASKR_SLOW_DB_QUERY_TIME', 0.5)
+        if not app.config['FLASKR_SQL_TRACE']:
+            return
+        app.before_request(self._start)
+        app.after_request(self._report)
+        app.teardown_request(self._stop)
+
+    def _start(self):
+        install()
+        g.sql_recorder = _RequestRecorder(
+            request.endpoint, current_app.config['FLASKR_SLOW_DB_QUERY_TIME'],
+            current_app.logger)
+        _listeners().append(g.sql_recorder)
+
+    def _report(self, response):
+        recorder = g.get('sql_recorder')
+        if recorder is not None:
+            response.headers.add(
+                'Server-Timing', 'db;dur=%.2f;desc="%d queries"' % (
+                    recorder.total_time * 1000, len(recorder)))
+        return response
+
+    def _stop(self, exc):
+        recorder = g.pop('sql_recorder', None)
+        if recorder is not None:
+            _listeners().remove(recorder)
+            recorder.logger.debug('%s: %d queries in %.2f ms',
+                                  recorder.endpoint, len(recorder),
+                                  recorder.total_time * 1000)
+
+
+class _RequestRecorder(object):
+    """Counts the statements of one request and logs the slow ones."""
+
+    def __init__(self, endpoint, threshold, logger):
+        self.endpoint = endpoint
+        self.threshold = threshold
+        self.logger = logger
+        self.count = 0
+        self.total_time = 0.0
+
+    def __call__(self, sql, params, duration):
+        self.count += 1
+        self.total_time += duration
+        if duration >= self.threshold:
+            self.logger.warning('Slow query in %s (%.2f ms): %s; params: %r',
+                                self.endpoint, duration * 1000, sql, params)
+
+    def __len__(self):
+        return self.count
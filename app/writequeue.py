@@ -0,0 +1,203 @@
+"""Single-writer queue for SQLite deployments.
+
+SQLite allows a single writer at a time, so concurrent request threads
+that write race for the database lock and fail with ``database is
+locked``.  When ``FLASKR_WRITE_QUEUE`` is enabled, write units are handed
+to one dedicated thread which owns the write connection; whatever has
+piled up while the previous transaction was committing is applied in a
+single transaction (group commit), which takes the write lock when it
+begins (``BEGIN IMMEDIATE``).  Each unit runs in its own savepoint, so a
+failing unit only rolls back itself.
+
+When the queue is disabled, write units run inline in the calling thread.
+
+What must only happen once the writes are durable -- dropping cached
+pages, publishing events, updating in-memory indexes -- is registered
+with :meth:`WriteQueue.after_commit`.  Run before the commit, a cache
+invalidation lets a concurrent reader cache the old rows again, and an
+event announces rows that are not visible yet, or never will be.
+"""
+from functools import wraps
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+from flask import current_app, has_app_context
+
+
+class WriteQueue(object):
+    def __init__(self, app=None):
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+        # post-commit callbacks of the unit running in this thread
+        self._local = threading.local()
+        self.batches = 0
+        self.units = 0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('FLASKR_WRITE_QUEUE', False)
+        app.config.setdefault('FLASKR_WRITE_QUEUE_BATCH', 64)
+        app.config.setdefault('FLASKR_WRITE_QUEUE_WINDOW', 0)
+
+    @property
+    def in_writer(self):
+        """True when called from the writer thread itself."""
+        return threading.current_thread() is self._thread
+
+    def enabled(self):
+        return (has_app_context() and
+                current_app.config['FLASKR_WRITE_QUEUE'])
+
+    def submit(self, func, *args, **kwargs):
+        """Queue a write unit and return a :class:`Future` for its result.
+
+        The future resolves once the transaction holding the unit has
+        been committed.
+        """
+        app = current_app._get_current_object()
+        self._start()
+        future = Future()
+        self._queue.put((app, future, func, args, kwargs))
+        return future
+
+    def run(self, func, *args, **kwargs):
+        """Run a write unit through the queue and wait for its result."""
+        if self.in_writer or not self.enabled():
+            if self._callbacks() is not None:
+                # nested in a unit, whose commit runs the callbacks
+                return func(*args, **kwargs)
+            self._local.callbacks = []
+            try:
+                result = func(*args, **kwargs)
+                callbacks = self._local.callbacks
+            finally:
+                self._local.callbacks = None
+            self._run_callbacks(callbacks)
+            return result
+        return self.submit(func, *args, **kwargs).result()
+
+    def after_commit(self, func, *args, **kwargs):
+        """Call `func` once the write unit running in this thread is
+        committed, or right away outside of a unit.
+
+        Nothing is called for a unit that fails.
+        """
+        callbacks = self._callbacks()
+        if callbacks is None:
+            func(*args, **kwargs)
+        else:
+            callbacks.append((func, args, kwargs))
+
+    def serialized(self, func):
+        """Decorator routing every call of `func` through :meth:`run`."""
+        @wraps(func)
+        def inner(*args, **kwargs):
+            return self.run(func, *args, **kwargs)
+        return inner
+
+    def close(self, timeout=None):
+        """Stop the writer thread once the pending units are committed."""
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            self._queue.put(None)
+            thread.join(timeout)
+
+    def _start(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._loop,
+                                                name='flaskr-writer')
+                self._thread.daemon = True
+                self._thread.start()
+
+    def _next_batch(self):
+        item = self._queue.get()
+        if item is None:
+            return None
+        batch = [item]
+        app = item[0]
+        max_batch = app.config['FLASKR_WRITE_QUEUE_BATCH']
+        deadline = time.time() + app.config['FLASKR_WRITE_QUEUE_WINDOW']
+        while len(batch) < max_batch:
+            try:
+                timeout = deadline - time.time()
+                if timeout > 0:
+                    item = self._queue.get(timeout=timeout)
+                else:
+                    item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                # finish this batch, then stop
+                self._queue.put(None)
+                break
+            batch.append(item)
+        return batch
+
+    def _loop(self):
+        from . import db
+
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                break
+            with batch[0][0].app_context():
+                done, callbacks = self._commit(db.database, batch)
+                # before the results: a request sees its own writes
+                self._run_callbacks(callbacks)
+            for future, result, exc in done:
+                if exc is not None:
+                    future.set_exception(exc)
+                else:
+                    future.set_result(result)
+        db.database.close()
+
+    def _callbacks(self):
+        return getattr(self._local, 'callbacks', None)
+
+    def _run_callbacks(self, callbacks):
+        for func, args, kwargs in callbacks:
+            try:
+                func(*args, **kwargs)
+            except Exception:
+                # the writes are committed whatever happens here
+                current_app.logger.exception('post-commit callback failed')
+
+    def _commit(self, database, batch):
+        """Apply `batch` in one transaction; returns the ``(future,
+        result, exception)`` of its units and the post-commit callbacks
+        of the units that succeeded."""
+        done = []
+        callbacks = []
+        try:
+            with database.atomic('IMMEDIATE'):
+                for app, future, func, args, kwargs in batch:
+                    if not future.set_running_or_notify_cancel():
+                        continue
+                    self._local.callbacks = []
+                    try:
+                        with database.atomic():
+                            result = func(*args, **kwargs)
+                    except Exception as exc:
+                        done.append((future, None, exc))
+                    else:
+                        done.append((future, result, None))
+                        callbacks.extend(self._local.callbacks)
+                    finally:
+                        self._local.callbacks = None
+        except Exception as exc:
+            # the group commit itself failed, nothing in it is durable
+            for app, future, func, args, kwargs in batch:
+                if future.running():
+                    future.set_exception(exc)
+            return [], []
+        self.batches += 1
+        self.units += len(done)
+        return done, callbacks
@@ -0,0 +1,30 @@
+"""Benchmarks for the ``flask bench-*`` commands.
+
+Benchmarks run against the ``benchmark`` configuration, which points at a
+database of its own (``data-bench.sqlite`` by default) so the development
+data is never touched.
+"""
+import math
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of `values` (`pct` in 0..100)."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = int(math.ceil(pct / 100.0 * len(ordered))) - 1
+    return ordered[max(rank, 0)]
+
+
+def summarize(latencies):
+    """Summarize a list of latencies (in seconds) in milliseconds."""
+    if not latencies:
+        return {'count': 0}
+    return {
+        'count': len(latencies),
+        'mean_ms': 1000.0 * sum(latencies) / len(latencies),
+        'p50_ms': 1000.0 * percentile(latencies, 50),
+        'p95_ms': 1000.0 * percentile(latencies, 95),
+        'p99_ms': 1000.0 * percentile(latencies, 99),
+        'max_ms': 1000.0 * max(latencies),
+    }
@@ -0,0 +1,46 @@
+"""Encode time of a page of posts with each available JSON encoder.
+
+``flask`` is the encoding ``jsonify`` used before the JSON provider
+(stdlib, HTTP dates, indented); the others are the provider's encoders
+without indentation, as in production.
+"""
+import time
+
+from flask import json as flask_json
+
+from app.api_1_0.serializers import dump_posts
+from app.jsonprovider import encoders, orjson
+from app.models import Post
+
+from . import summarize
+
+
+def _time(func, repeat):
+    latencies = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        latencies.append(time.perf_counter() - start)
+    return summarize(latencies)
+
+
+def run(app, page_size=100, repeat=200):
+    with app.test_request_context():
+        page = {'posts': dump_posts(Post.timeline().paginate(1, page_size)),
+                'prev': None, 'next': None, 'count': page_size}
+        cases = [('flask', lambda: flask_json.dumps(
+            page, cls=flask_json.JSONEncoder, indent=2,
+            separators=(', ', ': ')))]
+        for name in sorted(encoders):
+            if name == 'orjson' and orjson is None:
+                continue
+            encoder = encoders[name]()
+            cases.append((name, lambda encoder=encoder: encoder.dumps(page)))
+        results = []
+        for name, func in cases:
+            result = _time(func, repeat)
+            result['encoder'] = name
+            result['page_size'] = page_size
+            result['bytes'] = len(func().encode('utf-8'))
+            results.append(result)
+    return results
@@ -0,0 +1,259 @@
+"""Endpoint latency and throughput benchmark.
+
+Two kinds of numbers are collected for every endpoint:
+
+- *micro*: requests issued sequentially through the Flask test client,
+  which measures the application code without any network or server
+  overhead;
+- *macro*: a local multi-threaded HTTP load generator against the app
+  served by a threaded WSGI server, which adds the server, the sockets
+  and contention between concurrent requests.
+
+Results are plain dicts so they can be dumped to JSON and compared
+between runs.
+"""
+from base64 import b64encode
+import http.client
+import json
+import platform
+import threading
+import time
+from urllib.parse import urlencode
+
+from werkzeug.serving import make_server
+import peewee as pw
+
+from app import db
+from app.fake import generate
+from app.models import Role, User, Follow, Post, Comment
+
+from . import summarize
+
+
+class Endpoint(object):
+    def __init__(self, name, path, method='GET', auth=None, body=None,
+                 cookies=None):
+        self.name = name
+        self.path = path
+        self.method = method
+        self.auth = auth
+        self.body = body
+        self.cookies = cookies or {}
+
+
+def endpoints(ctx):
+    """The benchmarked endpoints, with ids taken from the dataset."""
+    return [
+        Endpoint('index', '/'),
+        Endpoint('index_followed', '/', auth='session',
+                 cookies={'show_followed': '1'}),
+        Endpoint('user', '/user/%s' % ctx['username']),
+        Endpoint('post', '/post/%d' % ctx['post_id']),
+        Endpoint('followers', '/followers/%s' % ctx['username']),
+        Endpoint('followed_by', '/followed-by/%s' % ctx['username']),
+        Endpoint('moderate', '/moderate', auth='session'),
+        Endpoint('api_posts', '/api/v1.0/posts/', auth='token'),
+        Endpoint('api_post', '/api/v1.0/posts/%d' % ctx['post_id'],
+                 auth='token'),
+        Endpoint('api_post_comments',
+                 '/api/v1.0/posts/%d/comments/' % ctx['post_id'],
+                 auth='token'),
+        Endpoint('api_comments', '/api/v1.0/comments/', auth='token'),
+        Endpoint('api_user', '/api/v1.0/users/%d' % ctx['user_id'],
+                 auth='token'),
+        Endpoint('api_user_posts', '/api/v1.0/users/%d/posts' % ctx['user_id'],
+                 auth='token'),
+        Endpoint('api_user_timeline',
+                 '/api/v1.0/users/%d/timeline/' % ctx['user_id'],
+                 auth='token'),
+        Endpoint('api_new_post', '/api/v1.0/posts/', method='POST',
+                 auth='token', body={'body': 'benchmark *post*'}),
+        Endpoint('api_new_comment',
+                 '/api/v1.0/posts/%d/comments' % ctx['post_id'],
+                 method='POST', auth='token',
+                 body={'body': 'benchmark *comment*'}),
+    ]
+
+
+def prepare(app, seed_data=True, **sizes):
+    """Seed the benchmark database and pick the ids to request."""
+    with app.app_context():
+        if seed_data:
+            db.database.drop_tables(db.models, safe=True)
+            db.database.create_tables(db.models, safe=True)
+            generate(**sizes)
+        # the most followed user, who also moderates, and the post with
+        # the most comments
+        user = (User.select(User, pw.fn.COUNT(Follow.id).alias('n'))
+                .join(Follow, on=(Follow.followed == User.id))
+                .group_by(User.id)
+                .order_by(pw.fn.COUNT(Follow.id).desc()).first())
+        moderator = Role.select().where(Role.name == 'Moderator').first()
+        User.update(role=moderator).where(User.id == user.id).execute()
+        post = (Post.select(Post.id)
+                .join(Comment, on=(Comment.post == Post.id))
+                .group_by(Post.id)
+                .order_by(pw.fn.COUNT(Comment.id).desc()).first() or
+                Post.select(Post.id).first())
+        return {
+            'user_id': user.id,
+            'username': user.username,
+            'email': user.email,
+            'password': 'password',
+            'post_id': post.id,
+            'token': user.generate_auth_token(24 * 3600),
+        }
+
+
+def _headers(endpoint, ctx):
+    headers = {'Accept': 'application/json'}
+    if endpoint.auth == 'token':
+        headers['Authorization'] = 'Basic ' + b64encode(
+            (ctx['token'] + ':').encode('utf-8')).decode('utf-8')
+    if endpoint.body is not None:
+        headers['Content-Type'] = 'application/json'
+    return headers
+
+
+def micro(app, ctx, requests=50):
+    """Time `requests` sequential test-client requests per endpoint."""
+    anonymous = app.test_client()
+    session = app.test_client(use_cookies=True)
+    session.post('/auth/login', data={'email': ctx['email'],
+                                      'password': ctx['password']})
+    results = {}
+    for endpoint in endpoints(ctx):
+        client = session if endpoint.auth == 'session' else anonymous
+        for key, value in endpoint.cookies.items():
+            client.set_cookie('localhost', key, value)
+        data = json.dumps(endpoint.body) if endpoint.body else None
+        latencies = []
+        statuses = {}
+        started = time.perf_counter()
+        for _ in range(requests):
+            start = time.perf_counter()
+            response = client.open(endpoint.path, method=endpoint.method,
+                                   headers=_headers(endpoint, ctx),
+                                   data=data)
+            latencies.append(time.perf_counter() - start)
+            statuses[response.status_code] = (
+                statuses.get(response.status_code, 0) + 1)
+        elapsed = time.perf_counter() - started
+        for key in endpoint.cookies:
+            client.delete_cookie('localhost', key)
+        result = summarize(latencies)
+        result['throughput_rps'] = len(latencies) / elapsed
+        result['statuses'] = statuses
+        results[endpoint.name] = result
+    return results
+
+
+class _LoadWorker(threading.Thread):
+    def __init__(self, host, port, method, path, body, headers, remaining):
+        super(_LoadWorker, self).__init__()
+        self.daemon = True
+        self.conn = http.client.HTTPConnection(host, port, timeout=60)
+        self.request = (method, path, body, headers)
+        self.remaining = remaining
+        self.latencies = []
+        self.errors = 0
+
+    def run(self):
+        while self.remaining():
+            start = time.perf_counter()
+            try:
+                self.conn.request(*self.request)
+                response = self.conn.getresponse()
+                response.read()
+                if response.status >= 500:
+                    self.errors += 1
+            except (http.client.HTTPException, OSError):
+                self.errors += 1
+                self.conn.close()
+            self.latencies.append(time.perf_counter() - start)
+        self.conn.close()
+
+
+def _login_cookie(host, port, ctx):
+    conn = http.client.HTTPConnection(host, port)
+    body = urlencode({'email': ctx['email'], 'password': ctx['password']})
+    conn.request('POST', '/auth/login', body,
+                 {'Content-Type': 'application/x-www-form-urlencoded'})
+    response = conn.getresponse()
+    response.read()
+    conn.close()
+    cookies = [c.split(';', 1)[0]
+               for c in response.msg.get_all('Set-Cookie') or []]
+    return '; '.join(cookies)
+
+
+def macro(app, ctx, requests=500, concurrency=8):
+    """Run a load test per endpoint against a threaded WSGI server."""
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    host, port = '127.0.0.1', server.server_port
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    results = {}
+    try:
+        session_cookie = _login_cookie(host, port, ctx)
+        for endpoint in endpoints(ctx):
+            headers = _headers(endpoint, ctx)
+            cookies = ['%s=%s' % item for item in endpoint.cookies.items()]
+            if endpoint.auth == 'session':
+                cookies.append(session_cookie)
+            if cookies:
+                headers['Cookie'] = '; '.join(cookies)
+            body = json.dumps(endpoint.body) if endpoint.body else None
+
+            lock = threading.Lock()
+            budget = [requests]
+
+            def remaining():
+                with lock:
+                    budget[0] -= 1
+                    return budget[0] >= 0
+
+            workers = [_LoadWorker(host, port, endpoint.method,
+                                   endpoint.path, body, headers, remaining)
+                       for _ in range(concurrency)]
+            started = time.perf_counter()
+            for worker in workers:
+                worker.start()
+            for worker in workers:
+                worker.join()
+            elapsed = time.perf_counter() - started
+            latencies = [l for w in workers for l in w.latencies]
+            result = summarize(latencies)
+            result['throughput_rps'] = len(latencies) / elapsed
+            result['errors'] = sum(w.errors for w in workers)
+            result['concurrency'] = concurrency
+            results[endpoint.name] = result
+    finally:
+        server.shutdown()
+    return results
+
+
+def run(app, seed_data=True, sizes=None, requests=50, macro_requests=500,
+        concurrency=8, skip_macro=False):
+    sizes = sizes or {}
+    ctx = prepare(app, seed_data=seed_data, **sizes)
+    with app.app_context():
+        counts = dict((model._meta.db_table, model.select().count())
+                      for model in (User, Follow, Post, Comment))
+    report = {
+        'meta': {
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+            'python': platform.python_version(),
+            'database': app.config['PEEWEE_DATABASE_URI'],
+            'rows': counts,
+            'requests': requests,
+            'macro_requests': macro_requests,
+            'concurrency': concurrency,
+        },
+        'micro': micro(app, ctx, requests=requests),
+    }
+    if not skip_macro:
+        report['macro'] = macro(app, ctx, requests=macro_requests,
+                                concurrency=concurrency)
+    return report
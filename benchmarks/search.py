@@ -0,0 +1,86 @@
+"""Latency of the full-text search against a ``LIKE '%word%'`` scan.
+
+The benchmark database is filled up to `posts` posts (a million by
+default) with the generator of ``flask fake``, whose bodies are lorem
+ipsum: a single word matches about a third of the posts, which is the
+worst case for ranking, since every match is scored.  Each query is
+timed on its first page and on the page after it (keyset cursor); the
+``LIKE`` baseline returns the newest matches unranked and can stop
+early for common words, but scans the whole table for rare ones.
+"""
+import time
+
+from app import db, search
+from app.fake import Generator
+from app.models import Role, User, Post
+
+from . import summarize
+
+QUERIES = (
+    ('common', 'lorem'),
+    ('two_words', 'lorem ipsum'),
+    ('phrase', '"dolor sit"'),
+    ('prefix', 'cons*'),
+    ('rare', 'zebra'),
+)
+
+
+def _time(func, repeat):
+    latencies = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        latencies.append(time.perf_counter() - start)
+    return summarize(latencies)
+
+
+def prepare(posts, seed=0, echo=None):
+    """Fill the database up to `posts` posts and index them."""
+    db.database.create_tables(db.models, safe=True)
+    if not search.installed():
+        started = time.time()
+        search.create_index()
+        if echo:
+            echo('index built in %.1f s' % (time.time() - started))
+    missing = posts - Post.select().count()
+    if missing > 0:
+        Role.insert_roles()
+        gen = Generator(seed=seed, echo=echo)
+        gen.user_ids = [u for u, in User.select(User.id).tuples()]
+        if not gen.user_ids:
+            gen.users(1000)
+        started = time.time()
+        gen.posts(missing)
+        if echo:
+            echo('%d posts inserted and indexed in %.1f s' % (
+                missing, time.time() - started))
+
+
+def run(app, posts=1000000, page_size=20, repeat=20, like_repeat=3,
+        echo=None):
+    results = []
+    with app.app_context():
+        prepare(posts, echo=echo)
+        total = Post.select().count()
+        for name, q in QUERIES:
+            hits, cursor = search.search(Post, q, limit=page_size)
+            first = _time(lambda: search.search(Post, q, limit=page_size),
+                          repeat)
+            after = search.parse_cursor(cursor)
+            second = _time(lambda: search.search(Post, q, after,
+                                                 page_size), repeat)
+            word = search.WORD.findall(q)[0]
+            like = _time(lambda: list(Post.select(Post.id)
+                                      .where(Post.body.contains(word))
+                                      .order_by(Post.id.desc())
+                                      .limit(page_size).tuples()),
+                         like_repeat)
+            results.append({
+                'query': name,
+                'posts': total,
+                'fts_p50_ms': first['p50_ms'],
+                'fts_p99_ms': first['p99_ms'],
+                'fts_next_page_p50_ms': second['p50_ms'],
+                'like_p50_ms': like['p50_ms'],
+            })
+    return results
@@ -0,0 +1,43 @@
+"""Per-item ``to_json`` vs. the bulk serializers on full API pages.
+
+Both sides serialize the same page of posts and comments (100 items by
+default) inside a request context, so the difference is the instances,
+``url_for`` calls and per-post COUNT queries saved by the serializers.
+"""
+import time
+
+from app.api_1_0.serializers import dump_posts, dump_comments
+from app.models import Post, Comment
+
+from . import summarize
+
+
+def _time(func, repeat):
+    latencies = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        latencies.append(time.perf_counter() - start)
+    return summarize(latencies)
+
+
+def run(app, page_size=100, repeat=50):
+    results = []
+    with app.test_request_context():
+        cases = (
+            ('posts', Post.timeline().paginate(1, page_size), dump_posts),
+            ('comments', Comment.timeline().paginate(1, page_size),
+             dump_comments),
+        )
+        for name, query, dump in cases:
+            to_json = _time(lambda: [item.to_json() for item in query],
+                            repeat)
+            bulk = _time(lambda: dump(query), repeat)
+            results.append({
+                'resource': name,
+                'page_size': page_size,
+                'to_json_p50_ms': to_json['p50_ms'],
+                'bulk_p50_ms': bulk['p50_ms'],
+                'speedup': to_json['p50_ms'] / bulk['p50_ms'],
+            })
+    return results
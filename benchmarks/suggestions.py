@@ -0,0 +1,86 @@
+"""Runtime and memory of the follow suggestions on a synthetic graph.
+
+The graph has `users` users and `edges` distinct follows (a million by
+default), drawn like ``flask fake`` does: followers and followed users
+from power-law weights, so a few users follow or are followed a lot.
+It is built in memory, without the database, and ranked by
+:func:`app.suggestions.rank` -- with SciPy when it is installed, in pure
+Python otherwise -- once timing every chunk, then once more tracing the
+peak memory with :mod:`tracemalloc` (NumPy reports its buffers to it).
+Storing the rows is left out: it costs the same ``INSERT`` whichever
+way they are ranked.
+"""
+import time
+import tracemalloc
+
+from app import suggestions
+from app.fake import Generator
+
+from . import summarize
+
+
+def graph(users, edges, seed=0):
+    """``(followers, followed)`` lists of `edges` distinct follows."""
+    gen = Generator(seed=seed)
+    ids = list(range(1, users + 1))
+    activity = gen.pareto(users, 1.5)
+    popularity = gen.pareto(users, 1.2)
+    pairs = set()
+    while len(pairs) < edges:
+        missing = edges - len(pairs)
+        for pair in zip(gen.rng.choices(ids, cum_weights=activity, k=missing),
+                        gen.rng.choices(ids, cum_weights=popularity,
+                                        k=missing)):
+            if pair[0] != pair[1]:
+                pairs.add(pair)
+    pairs = sorted(pairs)[:edges]
+    return [a for a, b in pairs], [b for a, b in pairs]
+
+
+def _rank(followers, followed, k, chunk):
+    """Latency of every chunk, suggestion count and total time."""
+    latencies = []
+    stored = 0
+    started = time.perf_counter()
+    chunks = suggestions.rank(followers, followed, k, chunk)
+    while True:
+        start = time.perf_counter()
+        found = next(chunks, None)
+        if found is None:
+            break
+        latencies.append(time.perf_counter() - start)
+        stored += len(found[0])
+    return latencies, stored, time.perf_counter() - started
+
+
+def run(users=100000, edges=1000000, k=20, chunk=4096, seed=0, echo=None):
+    started = time.time()
+    followers, followed = graph(users, edges, seed)
+    if echo:
+        echo('%d follows between %d users drawn in %.1f s' % (
+            len(followers), users, time.time() - started))
+    if suggestions.np is not None:
+        followers = suggestions.np.asarray(followers)
+        followed = suggestions.np.asarray(followed)
+
+    latencies, stored, seconds = _rank(followers, followed, k, chunk)
+    # a second run for the memory, tracing slows the first one down
+    tracemalloc.start()
+    try:
+        baseline = tracemalloc.get_traced_memory()[0]
+        _rank(followers, followed, k, chunk)
+        peak = tracemalloc.get_traced_memory()[1] - baseline
+    finally:
+        tracemalloc.stop()
+    result = {
+        'implementation': 'scipy' if suggestions.sparse is not None
+        else 'python',
+        'users': users,
+        'edges': len(followers),
+        'suggestions': stored,
+        'seconds': seconds,
+        'peak_mb': peak / 2.0 ** 20,
+    }
+    result.update(('chunk_' + key, value)
+                  for key, value in summarize(latencies).items())
+    return result
@@ -0,0 +1,128 @@
+"""Concurrent write benchmark: direct writes vs. the single-writer queue.
+
+Every worker thread runs a random mix of the writes the app issues during
+normal traffic -- ``ping()``, follow/unfollow, posting a comment and
+toggling its moderation flag -- and records the latency of each one.
+``database is locked`` errors are retried with a short backoff and
+counted, so both the tail latency and the lock contention of each mode
+show up in the results.
+"""
+import random
+import threading
+import time
+
+import peewee as pw
+from werkzeug.security import generate_password_hash
+
+from app import db, writer
+from app.models import Role, User, Post, Comment
+
+from . import summarize
+
+
+def seed(user_count=200, post_count=50):
+    db.database.drop_tables(db.models, safe=True)
+    db.database.create_tables(db.models, safe=True)
+    Role.insert_roles()
+    role = Role.select().where(Role.default == True).first()
+    password_hash = generate_password_hash('bench')
+    with db.database.atomic():
+        User.insert_many([
+            dict(email='bench%d@example.com' % i, username='bench%d' % i,
+                 password_hash=password_hash, confirmed=True, role=role.id)
+            for i in range(user_count)]).execute()
+        user_ids = [u.id for u in User.select(User.id)]
+        Post.insert_many([dict(body='post %d' % i,
+                               author=random.choice(user_ids))
+                          for i in range(post_count)]).execute()
+    post_ids = [p.id for p in Post.select(Post.id)]
+    return user_ids, post_ids
+
+
+class _Worker(object):
+    def __init__(self, user_ids, post_ids, ops, retries, rng):
+        self.user_ids = user_ids
+        self.post_ids = post_ids
+        self.ops = ops
+        self.retries = retries
+        self.rng = rng
+        self.latencies = []
+        self.lock_errors = 0
+        self.failures = 0
+
+    def ping(self):
+        User.get(User.id == self.rng.choice(self.user_ids)).ping()
+
+    def follow(self):
+        a, b = self.rng.sample(self.user_ids, 2)
+        user, other = User.get(User.id == a), User.get(User.id == b)
+        if user.is_following(other):
+            user.unfollow(other)
+        else:
+            user.follow(other)
+
+    def comment(self):
+        comment = Comment(body='*benchmark* comment',
+                          author=self.rng.choice(self.user_ids),
+                          post=self.rng.choice(self.post_ids))
+        comment.save()
+        comment.update_body_html()
+
+    def moderate(self):
+        comment = Comment.select().order_by(pw.fn.Random()).first()
+        if comment is not None:
+            Comment.moderate(not comment.disabled, ids=[comment.id])
+
+    def run(self, app):
+        operations = [self.ping, self.follow, self.comment, self.moderate]
+        with app.app_context():
+            for _ in range(self.ops):
+                operation = self.rng.choice(operations)
+                start = time.perf_counter()
+                for attempt in range(self.retries + 1):
+                    try:
+                        operation()
+                        break
+                    except pw.OperationalError as e:
+                        if 'locked' not in str(e):
+                            raise
+                        self.lock_errors += 1
+                        time.sleep(0.01 * (attempt + 1))
+                else:
+                    self.failures += 1
+                self.latencies.append(time.perf_counter() - start)
+            db.database.close()
+
+
+def run(app, threads=8, ops=200, retries=5, queued=False, seed_value=0):
+    """Run one benchmark round and return its summary."""
+    app.config['FLASKR_WRITE_QUEUE'] = queued
+    with app.app_context():
+        user_ids, post_ids = seed()
+    workers = [_Worker(user_ids, post_ids, ops, retries,
+                       random.Random(seed_value + i))
+               for i in range(threads)]
+    pool = [threading.Thread(target=w.run, args=(app,)) for w in workers]
+    start = time.perf_counter()
+    for t in pool:
+        t.start()
+    for t in pool:
+        t.join()
+    elapsed = time.perf_counter() - start
+    writer.close()
+
+    latencies = [l for w in workers for l in w.latencies]
+    result = summarize(latencies)
+    result.update({
+        'mode': 'queued' if queued else 'direct',
+        'threads': threads,
+        'throughput_ops': len(latencies) / elapsed,
+        'lock_errors': sum(w.lock_errors for w in workers),
+        'failures': sum(w.failures for w in workers),
+    })
+    return result
+
+
+def compare(app, **kwargs):
+    """Run the benchmark with direct writes, then through the queue."""
+    return [run(app, queued=False, **kwargs), run(app, queued=True, **kwargs)]
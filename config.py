@@ -21,6 +21,64 @@ class Config(object):
 
     FLASKR_FOLLOWERS_PER_PAGE = 50
     FLASKR_COMMENTS_PER_PAGE = 30
+    # Most ids a ?ids= batch lookup of the API may ask for.
+    FLASKR_API_BATCH_SIZE = 100
+    # Rows read per query by the NDJSON exports of the API.
+    FLASKR_EXPORT_CHUNK = 1000
+    # Changes returned per page by /api/v1.0/changes.
+    FLASKR_CHANGES_PER_PAGE = 500
+    # `flask compact-changes` keeps the change log for this many days.
+    FLASKR_CHANGES_RETENTION_DAYS = 30
+    # Results per page of the full-text search (see app/search.py).
+    FLASKR_SEARCH_PER_PAGE = 20
+    # Username suggestions of /api/v1.0/users/autocomplete, from an
+    # in-memory index reloaded every FLASKR_AUTOCOMPLETE_REFRESH seconds
+    # (see app/autocomplete.py).
+    FLASKR_AUTOCOMPLETE_LIMIT = 10
+    FLASKR_AUTOCOMPLETE_REFRESH = 300
+    # Bloom filters of the taken usernames and emails, checked before
+    # the database (see app/availability.py).
+    FLASKR_AVAILABILITY_ERROR_RATE = 0.01
+    FLASKR_AVAILABILITY_REFRESH = 300
+    # Follow checks answered by an in-memory graph, reconciled with the
+    # follows table every FLASKR_FOLLOW_GRAPH_REFRESH seconds (see
+    # app/followgraph.py).
+    FLASKR_FOLLOW_GRAPH_REFRESH = 300
+    # Follow suggestions stored per user by `flask suggest`, and shown on
+    # the index page (see app/suggestions.py).
+    FLASKR_SUGGESTIONS_PER_USER = 20
+    FLASKR_SUGGESTIONS_SHOWN = 5
+
+    # Serialize writes through a single writer thread (see app/writequeue.py).
+    FLASKR_WRITE_QUEUE = bool(os.environ.get('FLASKR_WRITE_QUEUE'))
+    FLASKR_WRITE_QUEUE_BATCH = 64
+    FLASKR_WRITE_QUEUE_WINDOW = 0
+
+    # Count queries per request, add a Server-Timing header and log the
+    # queries slower than FLASKR_SLOW_DB_QUERY_TIME seconds.
+    FLASKR_SQL_TRACE = bool(os.environ.get('FLASKR_SQL_TRACE'))
+    FLASKR_SLOW_DB_QUERY_TIME = 0.5
+
+    # Cache the pages rendered for anonymous visitors (see app/cache.py).
+    FLASKR_PAGE_CACHE = bool(os.environ.get('FLASKR_PAGE_CACHE'))
+    FLASKR_PAGE_CACHE_TTL = 30
+    FLASKR_PAGE_CACHE_SIZE = 1000
+
+    # Cache the rendered post and comment blocks of _posts.html and
+    # _comments.html, for every visitor.
+    FLASKR_FRAGMENT_CACHE = bool(os.environ.get('FLASKR_FRAGMENT_CACHE'))
+    FLASKR_FRAGMENT_CACHE_SIZE = 5000
+
+    # JSON encoder of the API: 'auto' uses orjson when it is installed
+    # (see app/jsonprovider.py).
+    FLASKR_JSON_ENCODER = os.environ.get('FLASKR_JSON_ENCODER') or 'auto'
+    JSONIFY_PRETTYPRINT_REGULAR = False
+
+    # Server-sent events of new posts and comments (see app/eventstream.py).
+    FLASKR_EVENTS_HEARTBEAT = 15
+    FLASKR_EVENTS_BACKLOG = 100
+    FLASKR_EVENTS_QUEUE = 1000
+    FLASKR_EVENTS_MAX_STREAMS = 1000
 
     @classmethod
     def init_app(cls, app):
@@ -29,6 +87,7 @@ class Config(object):
 
 class DevelopmentConfig(Config):
     DEBUG = True
+    JSONIFY_PRETTYPRINT_REGULAR = True
     PEEWEE_DATABASE_URI = (
         os.environ.get('DEV_DATABASE_URL') or
         'sqlite:///' + os.path.join(basedir, 'data-dev.sqlite')
@@ -57,10 +116,20 @@ class ProductionConfig(Config):
     )
 
 
+class BenchmarkConfig(Config):
+    DEBUG = False
+    PEEWEE_DATABASE_URI = (
+        os.environ.get('BENCH_DATABASE_URL') or
+        'sqlite:///' + os.path.join(basedir, 'data-bench.sqlite')
+    )
+    WTF_CSRF_ENABLED = False
+
+
 config = {
     'development': DevelopmentConfig,
     'testing': TestingConfig,
     'production': ProductionConfig,
+    'benchmark': BenchmarkConfig,
 
     'default': DevelopmentConfig
 }
@@ -0,0 +1,23 @@
+"""Gunicorn settings: gevent workers, so that an open event stream holds
+a greenlet instead of a thread (see app/eventstream.py)::
+
+    gunicorn -c gunicorn.conf.py manage:app
+
+The worker patches the standard library before loading the app, which
+turns the threads, locks and queues of the event hub and of the write
+queue into their cooperative versions.
+
+A single worker by default: the event hub lives in the process, so an
+event published by one worker never reaches the streams held by another
+one.  Their clients would only get it by reconnecting and replaying
+from ``Last-Event-ID``.  One gevent worker holds many streams; only run
+more when the streams can do without live delivery.
+"""
+import os
+
+bind = os.environ.get('GUNICORN_BIND', '127.0.0.1:8000')
+workers = int(os.environ.get('GUNICORN_WORKERS', 1))
+worker_class = 'gevent'
+# concurrent requests per worker, open streams included; keep
+# FLASKR_EVENTS_MAX_STREAMS below it
+worker_connections = int(os.environ.get('GUNICORN_CONNECTIONS', 1000))
@@ -67,6 +67,240 @@ def test(coverage):
         cov.erase()
 
 
+@app.cli.command()
+@click.option('--users', default=1000, help='Number of users.')
+@click.option('--posts', default=10000, help='Number of posts.')
+@click.option('--comments', default=30000, help='Number of comments.')
+@click.option('--follows', default=20000, help='Number of follows.')
+@click.option('--seed', default=0, help='Random seed.')
+@click.option('--batch', default=50000, help='Rows per transaction.')
+def fake(users, posts, comments, follows, seed, batch):
+    """Generate a large synthetic dataset."""
+    from app.fake import generate
+    counts = generate(users=users, posts=posts, comments=comments,
+                      follows=follows, seed=seed, batch=batch,
+                      echo=click.echo)
+    click.echo(', '.join('%d %s' % (n, table)
+                         for table, n in sorted(counts.items())))
+
+
+@app.cli.command('import')
+@click.argument('kind', type=click.Choice(['users', 'posts', 'comments',
+                                           'follows']))
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--format', type=click.Choice(['ndjson', 'csv']),
+              help='Input format, guessed from the extension by default.')
+@click.option('--batch', default=10000, help='Records per transaction.')
+@click.option('--workers', default=None, type=int,
+              help='Processes rendering body_html (0 to render inline).')
+@click.option('--defer-indexes', default=False, is_flag=True,
+              help='Drop the non-unique indexes while loading.')
+@click.option('--id-map', type=click.Path(dir_okay=False),
+              help='JSON file mapping source ids to new ids, read before '
+                   'and written after the import.')
+def import_data(kind, path, format, batch, workers, defer_indexes, id_map):
+    """Import users, posts, comments or follows from NDJSON or CSV.
+
+    Import users first, then posts, comments and follows, with the same
+    --id-map file so references are remapped to the new ids.
+    """
+    import json
+    from app.bulkimport import Importer
+    ids = {}
+    if id_map and os.path.exists(id_map):
+        with open(id_map) as f:
+            ids = json.load(f)
+    importer = Importer(batch=batch, workers=workers, id_map=ids,
+                        echo=click.echo)
+    try:
+        result = importer.run(kind, path, format=format,
+                              defer_indexes=defer_indexes)
+    finally:
+        importer.close()
+        if id_map:
+            with open(id_map, 'w') as f:
+                json.dump(ids, f)
+    click.echo('%(imported)d imported, %(rejected)d rejected '
+               'in %(seconds).1f s' % result)
+
+
+@app.cli.command('rebuild-search')
+@click.option('--drop', default=False, is_flag=True,
+              help='Drop the index and its triggers instead.')
+def rebuild_search(drop):
+    """Create and rebuild the full-text search index (SQLite only)."""
+    from app import search
+    if drop:
+        search.drop_index()
+        click.echo('search index dropped')
+        return
+    if not search.create_index():
+        click.echo('full-text search needs SQLite with FTS5')
+        return
+    click.echo('search index rebuilt')
+
+
+@app.cli.command('backfill-references')
+@click.option('--batch', default=1000, help='Posts per transaction.')
+def backfill_references(batch):
+    """Index the @mentions and #tags of the existing posts."""
+    from app.models import Post
+    count = Post.backfill_references(batch=batch, echo=click.echo)
+    click.echo('%d posts indexed' % count)
+
+
+@app.cli.command()
+@click.option('--per-user', default=None, type=int,
+              help='Suggestions stored per user '
+                   '[default: FLASKR_SUGGESTIONS_PER_USER].')
+@click.option('--chunk', default=4096, help='Users ranked at a time.')
+def suggest(per_user, chunk):
+    """Compute the follow suggestions of every user."""
+    from app import suggestions
+    if per_user is None:
+        per_user = app.config['FLASKR_SUGGESTIONS_PER_USER']
+    result = suggestions.compute(per_user, chunk, echo=click.echo)
+    click.echo('%(suggestions)d suggestions from %(follows)d follows '
+               'in %(seconds).1f s' % result)
+
+
+@app.cli.command('compact-changes')
+@click.option('--compact-hours', default=24,
+              help='Drop superseded changes older than this many hours.')
+@click.option('--retention-days', default=None, type=int,
+              help='Drop all changes older than this many days '
+                   '[default: FLASKR_CHANGES_RETENTION_DAYS].')
+def compact_changes(compact_hours, retention_days):
+    """Compact and purge the change log of /api/v1.0/changes."""
+    from datetime import datetime, timedelta
+    from app.models import Change
+    if retention_days is None:
+        retention_days = app.config['FLASKR_CHANGES_RETENTION_DAYS']
+    now = datetime.utcnow()
+    compacted = Change.compact(now - timedelta(hours=compact_hours))
+    purged = Change.purge(now - timedelta(days=retention_days))
+    click.echo('%d superseded and %d expired changes removed' %
+               (compacted, purged))
+
+
+@app.cli.command()
+@click.option('--users', default=1000, help='Number of users to seed.')
+@click.option('--posts', default=10000, help='Number of posts to seed.')
+@click.option('--comments', default=30000, help='Number of comments to seed.')
+@click.option('--follows', default=20000, help='Number of follows to seed.')
+@click.option('--seed/--no-seed', 'seed_data', default=True,
+              help='Reseed the benchmark database (default) or reuse it.')
+@click.option('--requests', default=50,
+              help='Test client requests per endpoint.')
+@click.option('--macro-requests', default=500,
+              help='HTTP requests per endpoint in the load test.')
+@click.option('--concurrency', default=8, help='Load generator threads.')
+@click.option('--skip-macro', default=False, is_flag=True,
+              help='Only run the test client benchmark.')
+@click.option('--output', default='bench_output.json',
+              help='Where to write the JSON results.')
+def bench(users, posts, comments, follows, seed_data, requests,
+          macro_requests, concurrency, skip_macro, output):
+    """Benchmark the main and API endpoints."""
+    import json
+    from benchmarks import endpoints
+    bench_app = create_app('benchmark')
+    report = endpoints.run(
+        bench_app, seed_data=seed_data,
+        sizes=dict(users=users, posts=posts, comments=comments,
+                   follows=follows),
+        requests=requests, macro_requests=macro_requests,
+        concurrency=concurrency, skip_macro=skip_macro)
+    for kind in ('micro', 'macro'):
+        for name, result in sorted(report.get(kind, {}).items()):
+            click.echo(('{kind:>5} {name:<18} p50 {p50_ms:8.1f} ms  '
+                        'p99 {p99_ms:8.1f} ms  {throughput_rps:8.1f} req/s'
+                        ).format(kind=kind, name=name, **result))
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+    click.echo('Results written to %s' % output)
+
+
+@app.cli.command('bench-writes')
+@click.option('--threads', default=8, help='Number of writer threads.')
+@click.option('--ops', default=200, help='Write operations per thread.')
+def bench_writes(threads, ops):
+    """Compare concurrent writes with and without the write queue."""
+    from benchmarks import writes
+    bench_app = create_app('benchmark')
+    for result in writes.compare(bench_app, threads=threads, ops=ops):
+        click.echo(('{mode:>6}: {count} writes, {throughput_ops:.1f} ops/s, '
+                    'p50 {p50_ms:.1f} ms, p99 {p99_ms:.1f} ms, '
+                    '{lock_errors} lock errors, {failures} failures'
+                    ).format(**result))
+
+
+@app.cli.command('bench-serializers')
+@click.option('--page-size', default=100, help='Items per page.')
+@click.option('--repeat', default=50, help='Repetitions per serializer.')
+def bench_serializers(page_size, repeat):
+    """Compare to_json with the bulk API serializers.
+
+    Run `flask bench` or `flask fake` first to fill the benchmark database.
+    """
+    from benchmarks import serializers
+    bench_app = create_app('benchmark')
+    for result in serializers.run(bench_app, page_size=page_size,
+                                  repeat=repeat):
+        click.echo(('{resource:>8} x{page_size}: to_json {to_json_p50_ms:.1f} '
+                    'ms, bulk {bulk_p50_ms:.1f} ms, {speedup:.1f}x'
+                    ).format(**result))
+
+
+@app.cli.command('bench-json')
+@click.option('--page-size', default=100, help='Posts per page.')
+@click.option('--repeat', default=200, help='Encodings per encoder.')
+def bench_json(page_size, repeat):
+    """Compare the JSON encoders on a page of posts.
+
+    Run `flask bench` or `flask fake` first to fill the benchmark database.
+    """
+    from benchmarks import encoding
+    bench_app = create_app('benchmark')
+    for result in encoding.run(bench_app, page_size=page_size,
+                               repeat=repeat):
+        click.echo(('{encoder:>6} x{page_size}: p50 {p50_ms:.2f} ms, '
+                    'p99 {p99_ms:.2f} ms, {bytes} bytes').format(**result))
+
+
+@app.cli.command('bench-search')
+@click.option('--posts', default=1000000,
+              help='Posts in the benchmark database, added when missing.')
+@click.option('--page-size', default=20, help='Results per page.')
+@click.option('--repeat', default=20, help='Repetitions per query.')
+def bench_search(posts, page_size, repeat):
+    """Compare full-text search latency with a LIKE scan."""
+    from benchmarks import search
+    bench_app = create_app('benchmark')
+    for result in search.run(bench_app, posts=posts, page_size=page_size,
+                             repeat=repeat, echo=click.echo):
+        click.echo(('{query:>10}: fts p50 {fts_p50_ms:.1f} ms, '
+                    'p99 {fts_p99_ms:.1f} ms, next page '
+                    '{fts_next_page_p50_ms:.1f} ms; like p50 '
+                    '{like_p50_ms:.1f} ms ({posts} posts)').format(**result))
+
+
+@app.cli.command('bench-suggestions')
+@click.option('--users', default=100000, help='Users of the graph.')
+@click.option('--edges', default=1000000, help='Follows of the graph.')
+@click.option('--per-user', default=20, help='Suggestions per user.')
+@click.option('--chunk', default=4096, help='Users ranked at a time.')
+def bench_suggestions(users, edges, per_user, chunk):
+    """Time the follow suggestions on a synthetic graph."""
+    from benchmarks import suggestions
+    result = suggestions.run(users=users, edges=edges, k=per_user,
+                             chunk=chunk, echo=click.echo)
+    click.echo(('{implementation}: {suggestions} suggestions for {users} '
+                'users from {edges} follows in {seconds:.1f} s '
+                '(chunk p50 {chunk_p50_ms:.0f} ms, max {chunk_max_ms:.0f} '
+                'ms), peak {peak_mb:.0f} MB').format(**result))
+
+
 @app.shell_context_processor
 def make_shell_context():
     from app.models import Permission
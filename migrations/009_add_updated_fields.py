@@ -0,0 +1,34 @@
+"""Peewee migrations -- 009_add_updated_fields.py.
+
+Some examples (model - class or model name)::
+
+    > Model = migrator.orm['model_name']            # Return model in current state by name
+
+    > migrator.sql(sql)                             # Run custom SQL
+    > migrator.python(func, *args, **kwargs)        # Run python code
+    > migrator.create_model(Model)                  # Create a model (could be used as decorator)
+    > migrator.remove_model(model, cascade=True)    # Remove a model
+    > migrator.add_fields(model, **fields)          # Add fields to a model
+    > migrator.change_fields(model, **fields)       # Change fields
+    > migrator.remove_fields(model, *field_names, cascade=True)
+    > migrator.rename_field(model, old_field_name, new_field_name)
+    > migrator.rename_table(model, new_table_name)
+    > migrator.add_index(model, *col_names, unique=False)
+    > migrator.drop_index(model, *col_names)
+    > migrator.add_not_null(model, *field_names)
+    > migrator.drop_not_null(model, *field_names)
+    > migrator.add_default(model, field_name, default)
+
+"""
+
+from app.models import Post, Comment
+
+
+def migrate(migrator, database, fake=False, **kwargs):
+    migrator.add_fields(Post, updated=Post.updated)
+    migrator.add_fields(Comment, updated=Comment.updated)
+
+
+def rollback(migrator, database, fake=False, **kwargs):
+    migrator.remove_fields(Post, 'updated')
+    migrator.remove_fields(Comment, 'updated')
@@ -0,0 +1,38 @@
+"""Peewee migrations -- 013_comment_add_reviewed_field.py.
+
+Some examples (model - class or model name)::
+
+    > Model = migrator.orm['model_name']            # Return model in current state by name
+
+    > migrator.sql(sql)                             # Run custom SQL
+    > migrator.python(func, *args, **kwargs)        # Run python code
+    > migrator.create_model(Model)                  # Create a model (could be used as decorator)
+    > migrator.remove_model(model, cascade=True)    # Remove a model
+    > migrator.add_fields(model, **fields)          # Add fields to a model
+    > migrator.change_fields(model, **fields)       # Change fields
+    > migrator.remove_fields(model, *field_names, cascade=True)
+    > migrator.rename_field(model, old_field_name, new_field_name)
+    > migrator.rename_table(model, new_table_name)
+    > migrator.add_index(model, *col_names, unique=False)
+    > migrator.drop_index(model, *col_names)
+    > migrator.add_not_null(model, *field_names)
+    > migrator.drop_not_null(model, *field_names)
+    > migrator.add_default(model, field_name, default)
+
+"""
+
+from app.models import Comment
+
+
+def migrate(migrator, database, fake=False, **kwargs):
+    migrator.add_fields(Comment, reviewed=Comment.reviewed)
+    # the comments disabled so far were moderated
+    migrator.sql('UPDATE comments SET reviewed = 1 WHERE disabled = 1')
+    migrator.add_index(Comment, 'disabled', 'timestamp')
+    migrator.add_index(Comment, 'reviewed', 'timestamp')
+
+
+def rollback(migrator, database, fake=False, **kwargs):
+    migrator.drop_index(Comment, 'reviewed', 'timestamp')
+    migrator.drop_index(Comment, 'disabled', 'timestamp')
+    migrator.remove_fields(Comment, 'reviewed')
@@ -0,0 +1,40 @@
+"""Peewee migrations -- 015_remove_self_follows.py.
+
+Some examples (model - class or model name)::
+
+    > Model = migrator.orm['model_name']            # Return model in current state by name
+
+    > migrator.sql(sql)                             # Run custom SQL
+    > migrator.python(func, *args, **kwargs)        # Run python code
+    > migrator.create_model(Model)                  # Create a model (could be used as decorator)
+    > migrator.remove_model(model, cascade=True)    # Remove a model
+    > migrator.add_fields(model, **fields)          # Add fields to a model
+    > migrator.change_fields(model, **fields)       # Change fields
+    > migrator.remove_fields(model, *field_names, cascade=True)
+    > migrator.rename_field(model, old_field_name, new_field_name)
+    > migrator.rename_table(model, new_table_name)
+    > migrator.add_index(model, *col_names, unique=False)
+    > migrator.drop_index(model, *col_names)
+    > migrator.add_not_null(model, *field_names)
+    > migrator.drop_not_null(model, *field_names)
+    > migrator.add_default(model, field_name, default)
+
+"""
+
+
+def migrate(migrator, database, fake=False, **kwargs):
+    # followed_posts includes the user's own posts without a self follow;
+    # log the deletes for the clients of /api/v1.0/changes
+    migrator.sql(
+        "INSERT INTO changes (entity, entity_id, op, ts) "
+        "SELECT 'follow', id, 'delete', CURRENT_TIMESTAMP FROM follows "
+        "WHERE follower_id = followed_id")
+    migrator.sql('DELETE FROM follows WHERE follower_id = followed_id')
+
+
+def rollback(migrator, database, fake=False, **kwargs):
+    migrator.sql(
+        'INSERT INTO follows (follower_id, followed_id, timestamp) '
+        'SELECT id, id, COALESCE(member_since, CURRENT_TIMESTAMP) '
+        'FROM users WHERE id NOT IN '
+        '(SELECT follower_id FROM follows WHERE follower_id = followed_id)')
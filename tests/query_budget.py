@@ -0,0 +1,49 @@
+"""Query-count budgets for the test suite.
+
+::
+
+    with max_queries(5):
+        self.client.get(url_for('main.index'))
+
+    @query_budget(5)
+    def test_index(self):
+        ...
+
+When the budget is exceeded the failure message lists every statement
+that ran, with the ones over the budget marked by ``>``.
+"""
+from contextlib import contextmanager
+from functools import wraps
+
+from app.sqltrace import QueryRecorder
+
+
+def format_queries(queries, limit):
+    lines = []
+    for i, (sql, params, duration) in enumerate(queries, 1):
+        lines.append('%s %3d. %s %r (%.2f ms)' % (
+            '>' if i > limit else ' ', i, sql, tuple(params or ()),
+            duration * 1000))
+    return '\n'.join(lines)
+
+
+@contextmanager
+def max_queries(limit):
+    """Fail if the block issues more than `limit` SQL statements."""
+    with QueryRecorder() as recorder:
+        yield recorder
+    if len(recorder) > limit:
+        raise AssertionError(
+            'Expected at most %d queries, got %d:\n%s' % (
+                limit, len(recorder), format_queries(recorder.queries, limit)))
+
+
+def query_budget(limit):
+    """Decorator form of :func:`max_queries` for whole test methods."""
+    def decorator(f):
+        @wraps(f)
+        def inner(*args, **kwargs):
+            with max_queries(limit):
+                return f(*args, **kwargs)
+        return inner
+    return decorator
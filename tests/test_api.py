@@ -2,10 +2,12 @@ import unittest
 import json
 import re
 from base64 import b64encode
+from datetime import datetime, timedelta
 
 from flask import url_for
-from app import create_app, db
-from app.models import User, Role, Post, Comment
+from app import create_app, db, search, suggestions, jsonprovider
+from app.models import User, Role, Post, Comment, Change, Mention, Tag
+from app.api_1_0.serializers import dump_posts, dump_comments
 
 
 class APITestCase(unittest.TestCase):
@@ -270,3 +272,546 @@ class APITestCase(unittest.TestCase):
         json_response = json.loads(response.data.decode('utf-8'))
         self.assertIsNotNone(json_response.get('comments'))
         self.assertTrue(json_response.get('count', 0) == 2)
+
+    def test_conditional_get(self):
+        # add a user and a post
+        r = Role.select().where(Role.name == 'User').first()
+        self.assertIsNotNone(r)
+        u = User(email='ann@example.com', username='ann',
+                 password='cat', confirmed=True, role=r)
+        u.save()
+        post = Post(body='body of the post', author=u)
+        post.save()
+
+        headers = self.get_api_headers('ann@example.com', 'cat')
+        response = self.client.get(url_for('api.get_posts'), headers=headers)
+        self.assertTrue(response.status_code == 200)
+        etag = response.headers.get('ETag')
+        self.assertIsNotNone(etag)
+        self.assertIsNotNone(response.headers.get('Last-Modified'))
+
+        # the same representation is not sent again
+        headers['If-None-Match'] = etag
+        response = self.client.get(url_for('api.get_posts'), headers=headers)
+        self.assertTrue(response.status_code == 304)
+        self.assertTrue(response.data == b'')
+
+        # a new comment changes the comment count of the post
+        comment = Comment(body='comment', author=u, post=post)
+        comment.save()
+        response = self.client.get(url_for('api.get_posts'), headers=headers)
+        self.assertTrue(response.status_code == 200)
+        self.assertTrue(response.headers.get('ETag') != etag)
+
+        # embedded authors are part of the representation
+        del headers['If-None-Match']
+        url = url_for('api.get_posts', embed='author')
+        response = self.client.get(url, headers=headers)
+        self.assertTrue(response.status_code == 200)
+        etag = response.headers.get('ETag')
+        headers['If-None-Match'] = etag
+        response = self.client.get(url, headers=headers)
+        self.assertTrue(response.status_code == 304)
+        u.username = 'anne'
+        u.save()
+        response = self.client.get(url, headers=headers)
+        self.assertTrue(response.status_code == 200)
+        self.assertTrue(response.headers.get('ETag') != etag)
+        json_response = json.loads(response.data.decode('utf-8'))
+        self.assertEqual(json_response['posts'][0]['author']['username'],
+                         'anne')
+
+        # the followed timeline changes with the follows, which leave no
+        # timestamp on unfollow: it is validated by its ETag alone
+        url = url_for('api.get_user_followed_posts', id=u.id)
+        del headers['If-None-Match']
+        response = self.client.get(url, headers=headers)
+        self.assertTrue(response.status_code == 200)
+        self.assertIsNone(response.headers.get('Last-Modified'))
+        headers['If-Modified-Since'] = 'Fri, 01 Jan 2100 00:00:00 GMT'
+        response = self.client.get(url, headers=headers)
+        self.assertTrue(response.status_code == 200)
+
+    def test_bulk_serializers(self):
+        r = Role.select().where(Role.name == 'User').first()
+        u = User(email='ann@example.com', username='ann',
+                 password='cat', confirmed=True, role=r)
+        u.save()
+        for i in range(3):
+            post = Post(body='post *%d*' % i, author=u)
+            post.save()
+            post.update_body_html()
+            for j in range(i):
+                Comment(body='comment %d' % j, author=u, post=post).save()
+
+        with self.app.test_request_context():
+            posts = Post.timeline()
+            self.assertEqual(
+                json.dumps(dump_posts(posts), sort_keys=True, default=str),
+                json.dumps([p.to_json() for p in posts], sort_keys=True,
+                           default=str))
+            comments = Comment.timeline()
+            self.assertEqual(
+                json.dumps(dump_comments(comments), sort_keys=True,
+                           default=str),
+                json.dumps([c.to_json() for c in comments], sort_keys=True,
+                           default=str))
+
+    def test_sparse_fields_and_embed(self):
+        r = Role.select().where(Role.name == 'User').first()
+        u = User(email='ann@example.com', username='ann',
+                 password='cat', confirmed=True, role=r)
+        u.save()
+        post = Post(body='body of the post', author=u)
+        post.save()
+        headers = self.get_api_headers('ann@example.com', 'cat')
+
+        response = self.client.get(
+            url_for('api.get_posts', fields='id,body,timestamp'),
+            headers=headers)
+        self.assertTrue(response.status_code == 200)
+        json_response = json.loads(response.data.decode('utf-8'))
+        self.assertEqual(json_response['posts'][0],
+                         {'id': post.id, 'body': 'body of the post',
+                          'timestamp': json_response['posts'][0]['timestamp']})
+
+        response = self.client.get(
+            url_for('api.get_post', id=post.id, embed='author',
+                    fields='body,author.username'),
+            headers=headers)
+        self.assertTrue(response.status_code == 200)
+        json_response = json.loads(response.data.decode('utf-8'))
+        self.assertEqual(json_response, {'body': 'body of the post',
+                                         'author': {'username': 'ann'}})
+
+        response = self.client.get(
+            url_for('api.get_comments', fields='nope'), headers=headers)
+        self.assertTrue(response.status_code == 400)
+        response = self.client.get(
+            url_for('api.get_user', id=u.id, embed='author'),
+            headers=headers)
+        self.assertTrue(response.status_code == 400)
+
+    def test_json_encoding(self):
+        r = Role.select().where(Role.name == 'User').first()
+        u = User(email='ann@example.com', username='ann',
+                 password='cat', confirmed=True, role=r)
+        u.save()
+        Post(body='body of the post', author=u).save()
+        headers = self.get_api_headers('ann@example.com', 'cat')
+
+        response = self.client.get(url_for('api.get_posts'), headers=headers)
+        json_response = json.loads(response.data.decode('utf-8'))
+        self.assertTrue(re.match(r'\d{4}-\d\d-\d\dT\d\d:\d\d:\d\d.*Z$',
+                                 json_response['posts'][0]['timestamp']))
+
+        # non-ASCII characters are sent as UTF-8
+        stdlib = jsonprovider.StdlibEncoder()
+        self.assertEqual(stdlib.dumps({'body': 'caf\u00e9'}),
+                         '{"body":"caf\u00e9"}')
+
+    @unittest.skipIf(jsonprovider.orjson is None, 'orjson is not installed')
+    def test_json_encoders_agree(self):
+        obj = {'posts': [{'body': 'caf\u00e9 \u2603 \U0001f600',
+                          'timestamp': datetime(2017, 7, 1, 12, 30, 5, 1000),
+                          'comments': [], 'author': None, 'count': 2.5}],
+               'next': {}, 'ok': True}
+        stdlib = jsonprovider.StdlibEncoder()
+        fast = jsonprovider.OrjsonEncoder()
+        for indent in (None, 2):
+            self.assertEqual(stdlib.dumps(obj, indent=indent).encode('utf-8'),
+                             fast.dumps(obj, indent=indent).encode('utf-8'))
+
+    def test_batch_lookup(self):
+        r = Role.select().where(Role.name == 'User').first()
+        users = []
+        for name in ('ann', 'bob', 'cid'):
+            u = User(email='%s@example.com' % name, username=name,
+                     password='cat', confirmed=True, role=r)
+            u.save()
+            users.append(u)
+        headers = self.get_api_headers('ann@example.com', 'cat')
+
+        ids = '%d,%d,9999,%d' % (users[2].id, users[0].id, users[2].id)
+        response = self.client.get(url_for('api.get_users', ids=ids),
+                                   headers=headers)
+        self.assertTrue(response.status_code == 200)
+        json_response = json.loads(response.data.decode('utf-8'))
+        self.assertEqual([u['username'] for u in json_response['users']],
+                         ['cid', 'ann'])
+        self.assertEqual(json_response['missing'], [9999])
+        response = self.client.get(url_for('api.get_users'),
+                                   headers=headers)
+        self.assertTrue(response.status_code == 400)
+
+        post = Post(body='body of the post', author=users[1])
+        post.save()
+        response = self.client.get(
+            url_for('api.get_posts', ids=str(post.id), fields='id'),
+            headers=headers)
+        json_response = json.loads(response.data.decode('utf-8'))
+        self.assertEqual(json_response['posts'], [{'id': post.id}])
+
+        self.app.config['FLASKR_API_BATCH_SIZE'] = 2
+        response = self.client.get(url_for('api.get_comments', ids='1,2,3'),
+                                   headers=headers)
+        self.assertTrue(response.status_code == 400)
+        response = self.client.get(url_for('api.get_comments', ids='1,x'),
+                                   headers=headers)
+        self.assertTrue(response.status_code == 400)
+        # duplicates count too: the list is bounded before it is parsed
+        response = self.client.get(url_for('api.get_comments', ids='1,1,1'),
+                                   headers=headers)
+        self.assertTrue(response.status_code == 400)
+
+    def test_export(self):
+        r = Role.select().where(Role.name == 'User').first()
+        admin = User(email=self.app.config['FLASKR_ADMIN'], username='admin',
+                     password='cat', confirmed=True)
+        admin.save()
+        u = User(email='ann@example.com', username='ann',
+                 password='cat', confirmed=True, role=r)
+        u.save()
+        for i in range(5):
+            Post(body='post %d' % i, author=u).save()
+        self.app.config['FLASKR_EXPORT_CHUNK'] = 2
+
+        response = self.client.get(
+            url_for('api.export_posts'),
+            headers=self.get_api_headers('ann@example.com', 'cat'))
+        self.assertTrue(response.status_code == 403)
+
+        headers = self.get_api_headers(self.app.config['FLASKR_ADMIN'], 'cat')
+        response = self.client.get(url_for('api.export_posts'),
+                                   headers=headers)
+        self.assertTrue(response.status_code == 200)
+        # one line at a time, whatever the size of the table
+        self.assertTrue(response.is_streamed)
+        lines = response.data.decode('utf-8').splitlines()
+        posts = [json.loads(line) for line in lines]
+        self.assertEqual([p['body'] for p in posts],
+                         ['post %d' % i for i in range(5)])
+
+        response = self.client.get(
+            url_for('api.export_follows', since='2999-01-01T00:00:00Z'),
+            headers=headers)
+        self.assertTrue(response.data == b'')
+        response = self.client.get(
+            url_for('api.export_comments', since='yesterday'),
+            headers=headers)
+        self.assertTrue(response.status_code == 400)
+
+    def test_batch_create(self):
+        r = Role.select().where(Role.name == 'User').first()
+        u = User(email='ann@example.com', username='ann',
+                 password='cat', confirmed=True, role=r)
+        u.save()
+        headers = self.get_api_headers('ann@example.com', 'cat')
+
+        response = self.client.post(
+            url_for('api.new_posts'), headers=headers,
+            data=json.dumps({'posts': [{'body': '*one*'}, {'body': 'two'}]}))
+        self.assertTrue(response.status_code == 201)
+        results = json.loads(response.data.decode('utf-8'))['results']
+        self.assertEqual([r['status'] for r in results], [201, 201])
+        response = self.client.get(results[0]['url'], headers=headers)
+        json_response = json.loads(response.data.decode('utf-8'))
+        self.assertEqual(json_response['body_html'], '<p><em>one</em></p>')
+        post_url = results[0]['url']
+
+        # partial failure
+        response = self.client.post(
+            url_for('api.new_comments'), headers=headers,
+            data=json.dumps([{'body': 'good', 'post': post_url},
+                             {'body': '', 'post': post_url},
+                             {'body': 'orphan', 'post': 9999}]))
+        self.assertTrue(response.status_code == 207)
+        results = json.loads(response.data.decode('utf-8'))['results']
+        self.assertEqual([r['status'] for r in results], [201, 400, 400])
+        self.assertEqual(Comment.select().count(), 1)
+
+        self.app.config['FLASKR_API_BATCH_SIZE'] = 1
+        response = self.client.post(
+            url_for('api.new_posts'), headers=headers,
+            data=json.dumps([{'body': 'a'}, {'body': 'b'}]))
+        self.assertTrue(response.status_code == 400)
+
+    def test_changes(self):
+        r = Role.select().where(Role.name == 'User').first()
+        u = User(email='ann@example.com', username='ann',
+                 password='cat', confirmed=True, role=r)
+        u.save()
+        headers = self.get_api_headers('ann@example.com', 'cat')
+        response = self.client.post(url_for('api.new_post'), headers=headers,
+                                    data=json.dumps({'body': 'first'}))
+        post_url = response.headers.get('Location')
+        post_id = int(post_url.rsplit('/', 1)[-1])
+
+        # created and edited in the window: a single create
+        response = self.client.get(url_for('api.get_changes'),
+                                   headers=headers)
+        self.assertTrue(response.status_code == 200)
+        json_response = json.loads(response.data.decode('utf-8'))
+        changes = dict(((c['entity'], c['id']), c)
+                       for c in json_response['changes'])
+        self.assertEqual(changes[('post', post_id)]['op'], 'create')
+        self.assertEqual(changes[('post', post_id)]['url'], post_url)
+        self.assertEqual(changes[('user', u.id)]['op'], 'create')
+        self.assertFalse(json_response['more'])
+        since = json_response['next']
+
+        response = self.client.put(post_url, headers=headers,
+                                   data=json.dumps({'body': 'edited'}))
+        self.assertTrue(response.status_code == 200)
+        response = self.client.get(url_for('api.get_changes', since=since),
+                                   headers=headers)
+        json_response = json.loads(response.data.decode('utf-8'))
+        self.assertEqual([(c['entity'], c['id'], c['op'])
+                          for c in json_response['changes']],
+                         [('post', post_id, 'update')])
+
+        # paging
+        response = self.client.get(url_for('api.get_changes', limit=1),
+                                   headers=headers)
+        json_response = json.loads(response.data.decode('utf-8'))
+        self.assertTrue(json_response['more'])
+
+        # compaction keeps the latest change, purging answers 410
+        now = datetime.utcnow() + timedelta(seconds=1)
+        self.assertTrue(Change.compact(now) > 0)
+        self.assertEqual(Change.select().where(
+            (Change.entity == 'post') & (Change.entity_id == post_id))
+            .count(), 1)
+        Change.purge(now)
+        response = self.client.get(url_for('api.get_changes', since=since),
+                                   headers=headers)
+        self.assertTrue(response.status_code == 410)
+        latest = json.loads(response.data.decode('utf-8'))['latest']
+        response = self.client.get(url_for('api.get_changes', since=latest),
+                                   headers=headers)
+        self.assertTrue(response.status_code == 200)
+
+        # the purged seqs are not handed out again
+        self.client.put(post_url, headers=headers,
+                        data=json.dumps({'body': 'after the purge'}))
+        response = self.client.get(url_for('api.get_changes', since=latest),
+                                   headers=headers)
+        json_response = json.loads(response.data.decode('utf-8'))
+        self.assertEqual([(c['entity'], c['id'], c['op'])
+                          for c in json_response['changes']],
+                         [('post', post_id, 'update')])
+
+    def test_search(self):
+        search.create_index()
+        try:
+            r = Role.select().where(Role.name == 'User').first()
+            u = User(email='ann@example.com', username='ann',
+                     password='cat', confirmed=True, role=r)
+            u.save()
+            headers = self.get_api_headers('ann@example.com', 'cat')
+            p1 = Post(body='running <b>late</b> again', author=u)
+            p1.save()
+            p2 = Post(body='we run, run, run', author=u)
+            p2.save()
+            Post(body='nothing to see', author=u).save()
+            Comment(body='a run in the park', post=p1, author=u).save()
+            Comment(body='a hidden run', post=p1, author=u,
+                    disabled=True).save()
+
+            # ranked and highlighted, stemmed by the porter tokenizer
+            response = self.client.get(
+                url_for('api.search', q='run', limit=1), headers=headers)
+            self.assertTrue(response.status_code == 200)
+            json_response = json.loads(response.data.decode('utf-8'))
+            results = json_response['results']
+            self.assertEqual(len(results), 1)
+            self.assertTrue(results[0]['url'].endswith('/%d' % p2.id))
+            self.assertIn('<mark>run</mark>', results[0]['snippet'])
+            response = self.client.get(json_response['next'],
+                                       headers=headers)
+            json_response = json.loads(response.data.decode('utf-8'))
+            self.assertTrue(json_response['results'][0]['url']
+                            .endswith('/%d' % p1.id))
+            self.assertIn('&lt;b&gt;', json_response['results'][0]['snippet'])
+            self.assertIsNone(json_response['next'])
+
+            # edits and deletions are indexed, disabled comments hidden
+            p2.body = 'walking'
+            p2.save()
+            response = self.client.get(url_for('api.search', q='run'),
+                                       headers=headers)
+            json_response = json.loads(response.data.decode('utf-8'))
+            self.assertEqual(len(json_response['results']), 1)
+            p1.comments.where(Comment.disabled == False).get() \
+                .delete_instance()
+            response = self.client.get(
+                url_for('api.search', q='"run in"', type='comments'),
+                headers=headers)
+            json_response = json.loads(response.data.decode('utf-8'))
+            self.assertEqual(json_response['results'], [])
+            response = self.client.get(
+                url_for('api.search', q='hid*', type='comments'),
+                headers=headers)
+            json_response = json.loads(response.data.decode('utf-8'))
+            self.assertEqual(json_response['results'], [])
+
+            # query syntax errors cannot reach FTS5
+            response = self.client.get(
+                url_for('api.search', q='"unbalanced AND ( *'),
+                headers=headers)
+            self.assertTrue(response.status_code == 200)
+            response = self.client.get(url_for('api.search', q=''),
+                                       headers=headers)
+            self.assertTrue(response.status_code == 400)
+
+            response = self.client.get(url_for('main.search', q='walk'))
+            self.assertTrue(response.status_code == 200)
+            self.assertIn(b'<mark>walking</mark>', response.data)
+        finally:
+            search.drop_index()
+
+    def test_autocomplete(self):
+        r = Role.select().where(Role.name == 'User').first()
+        ann = User(email='ann@example.com', username='ann',
+                   password='cat', confirmed=True, role=r)
+        ann.save()
+        anna = User(email='anna@example.com', username='Anna',
+                    password='cat', confirmed=True, role=r)
+        anna.save()
+        bob = User(email='bob@example.com', username='bob',
+                   password='cat', confirmed=True, role=r)
+        bob.save()
+        bob.follow(anna)
+        headers = self.get_api_headers('ann@example.com', 'cat')
+
+        def suggest(q, **kwargs):
+            response = self.client.get(
+                url_for('api.autocomplete_users', q=q, **kwargs),
+                headers=headers)
+            self.assertTrue(response.status_code == 200)
+            users = json.loads(response.data.decode('utf-8'))['users']
+            return [(u['username'], u['followers']) for u in users]
+
+        # most followed first, case insensitive
+        self.assertEqual(suggest('AN'), [('Anna', 1), ('ann', 0)])
+        self.assertEqual(suggest('an', limit=1), [('Anna', 1)])
+        self.assertEqual(suggest('x'), [])
+        self.assertEqual(suggest(''), [])
+
+        # kept up to date without reloading
+        ann.follow(ann)
+        bob.follow(ann)
+        ann.follow(ann)
+        ann.follow(anna)
+        self.assertEqual(suggest('an'), [('Anna', 2), ('ann', 1)])
+        bob.unfollow(anna)
+        bob.username = 'annika'
+        bob.save()
+        carl = User(email='carl@example.com', username='anders',
+                    password='cat', confirmed=True, role=r)
+        carl.save()
+        self.assertEqual(suggest('an'), [('ann', 1), ('Anna', 1),
+                                         ('anders', 0), ('annika', 0)])
+        self.assertEqual(suggest('b'), [])
+
+    def test_mentions_and_tags(self):
+        r = Role.select().where(Role.name == 'User').first()
+        ann = User(email='ann@example.com', username='ann',
+                   password='cat', confirmed=True, role=r)
+        ann.save()
+        bob = User(email='bob@example.com', username='bob',
+                   password='cat', confirmed=True, role=r)
+        bob.save()
+        headers = self.get_api_headers('ann@example.com', 'cat')
+        bodies = ['hi @bob, see #Flask', 'more #flask for @bob.',
+                  'mail bob@example.com about #python and @nobody',
+                  'nothing here']
+        for body in bodies:
+            response = self.client.post(url_for('api.new_post'),
+                                        headers=headers,
+                                        data=json.dumps({'body': body}))
+            self.assertTrue(response.status_code == 201)
+        response = self.client.post(
+            url_for('api.new_posts'), headers=headers,
+            data=json.dumps([{'body': '#flask from a batch'}]))
+        self.assertTrue(response.status_code == 201)
+
+        # newest first, in keyset pages
+        self.app.config['FLASKR_POSTS_PER_PAGE'] = 2
+        response = self.client.get(
+            url_for('api.get_tagged_posts', tag='FLASK'), headers=headers)
+        json_response = json.loads(response.data.decode('utf-8'))
+        bodies_seen = [p['body'] for p in json_response['posts']]
+        response = self.client.get(json_response['next'], headers=headers)
+        json_response = json.loads(response.data.decode('utf-8'))
+        bodies_seen += [p['body'] for p in json_response['posts']]
+        self.assertIsNone(json_response['next'])
+        self.assertEqual(sorted(bodies_seen), sorted(
+            ['hi @bob, see #Flask', 'more #flask for @bob.',
+             '#flask from a batch']))
+
+        response = self.client.get(
+            url_for('api.get_user_mentions', id=bob.id), headers=headers)
+        json_response = json.loads(response.data.decode('utf-8'))
+        self.assertEqual([p['body'] for p in json_response['posts']],
+                         ['more #flask for @bob.', 'hi @bob, see #Flask'])
+        self.assertIsNone(json_response['next'])
+
+        # edits replace the references
+        post = Post.select().where(Post.body == 'nothing here').get()
+        post.body = 'now for @ann #python'
+        post.save()
+        post.update_body_html()
+        self.assertEqual(Post.tagged('python').count(), 2)
+        self.assertEqual(Post.mentioning(ann).count(), 1)
+
+        # backfill rebuilds everything
+        Tag.delete().execute()
+        Mention.delete().execute()
+        self.assertEqual(Post.backfill_references(batch=2), 5)
+        self.assertEqual(Tag.select().count(), 5)
+        self.assertEqual(Mention.select().count(), 3)
+
+        response = self.client.get(url_for('main.tag', tag='flask'))
+        self.assertTrue(response.status_code == 200)
+        self.assertTrue(b'from a batch' in response.data)
+        response = self.client.get(url_for('main.mentions', username='bob'))
+        self.assertTrue(response.status_code == 200)
+
+    def test_suggestions(self):
+        r = Role.select().where(Role.name == 'User').first()
+        users = {}
+        for name in ('ann', 'bob', 'cat', 'dan', 'eve', 'fay'):
+            users[name] = User(email='%s@example.com' % name, username=name,
+                               password='cat', confirmed=True, role=r)
+            users[name].save()
+        for follower, followed in [('ann', 'bob'), ('ann', 'cat'),
+                                   ('bob', 'dan'), ('cat', 'dan'),
+                                   ('bob', 'eve'), ('fay', 'eve'),
+                                   ('bob', 'ann'), ('bob', 'cat')]:
+            users[follower].follow(users[followed])
+        result = suggestions.compute(k=3)
+        self.assertEqual(result['follows'], 8)
+        headers = self.get_api_headers('ann@example.com', 'cat')
+
+        def suggested(user, **kwargs):
+            response = self.client.get(
+                url_for('api.get_user_suggestions', id=users[user].id,
+                        **kwargs),
+                headers=headers)
+            self.assertTrue(response.status_code == 200)
+            found = json.loads(response.data.decode('utf-8'))['users']
+            return [(u['username'], u['score']) for u in found]
+
+        # followed users and the user themselves are left out
+        self.assertEqual(suggested('ann'), [('dan', 2), ('eve', 1)])
+        self.assertEqual(suggested('ann', limit=1), [('dan', 2)])
+        self.assertEqual(suggested('cat'), [])
+
+        # follows made since are skipped until the next run
+        users['ann'].follow(users['dan'])
+        self.assertEqual(suggested('ann'), [('eve', 1)])
+        users['bob'].unfollow(users['eve'])
+        suggestions.compute(k=3)
+        self.assertEqual(suggested('ann'), [])
+        self.assertEqual(suggested('fay'), [])
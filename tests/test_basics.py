@@ -1,7 +1,8 @@
 import unittest
 
 from flask import current_app
-from app import create_app, db
+from app import create_app, db, writer
+from app.models import Change
 
 
 class BasicsTestCase(unittest.TestCase):
@@ -20,3 +21,30 @@ class BasicsTestCase(unittest.TestCase):
 
     def test_app_is_testing(self):
         self.assertTrue(current_app.config['TESTING'])
+
+    def test_after_commit(self):
+        depths = []
+
+        def unit(fail=False):
+            with db.database.atomic():
+                Change.log('post', 1, 'create')
+                writer.after_commit(
+                    lambda: depths.append(db.database.transaction_depth()))
+            if fail:
+                raise ValueError('failed')
+
+        for queued in (False, True):
+            self.app.config['FLASKR_WRITE_QUEUE'] = queued
+            try:
+                del depths[:]
+                writer.run(unit)
+                # called once the outermost transaction is committed
+                self.assertEqual(depths, [0])
+                with self.assertRaises(ValueError):
+                    writer.run(unit, fail=True)
+                self.assertEqual(depths, [0])
+            finally:
+                writer.close()
+        # outside of a write unit, called right away
+        writer.after_commit(depths.append, 'now')
+        self.assertEqual(depths[-1], 'now')
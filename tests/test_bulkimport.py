@@ -0,0 +1,80 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from app import create_app, db
+from app.bulkimport import Importer
+from app.models import User, Role, Follow, Post, Comment
+
+
+class BulkImportTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.database.create_tables(db.models, safe=True)
+        Role.insert_roles()
+        self.dir = tempfile.mkdtemp()
+        self.messages = []
+        self.importer = Importer(batch=2, workers=0,
+                                 echo=self.messages.append)
+
+    def tearDown(self):
+        self.importer.close()
+        shutil.rmtree(self.dir)
+        db.database.drop_tables(db.models, safe=True)
+        self.app_context.pop()
+
+    def write(self, name, text):
+        path = os.path.join(self.dir, name)
+        with open(path, 'w') as f:
+            f.write(text)
+        return path
+
+    def ndjson(self, name, records):
+        return self.write(name, ''.join(json.dumps(r) + '\n'
+                                        for r in records))
+
+    def test_import(self):
+        User(email='john@example.com', username='john', password='cat').save()
+        users = self.write('users.csv', (
+            'url,username,member_since,confirmed\n'
+            'http://localhost/api/v1.0/users/7,ann,2017-06-01T10:00:00Z,1\n'
+            '8,bob,,0\n'
+            '9,john,,0\n'))
+        result = self.importer.run('users', users)
+        self.assertEqual((result['imported'], result['rejected']), (2, 1))
+        ann = User.get(User.username == 'ann')
+        self.assertTrue(ann.confirmed)
+        self.assertEqual(ann.member_since.year, 2017)
+        self.assertFalse(ann.is_following(ann))
+
+        posts = self.ndjson('posts.ndjson', [
+            {'id': 3, 'author': 7, 'body': '*one*'},
+            {'id': 4, 'author': 'http://localhost/api/v1.0/users/8',
+             'body': 'two', 'timestamp': '2017-06-02T10:00:00.5Z'},
+            {'id': 5, 'author': 42, 'body': 'unknown author'},
+            {'id': 6, 'author': 7, 'body': ''},
+        ])
+        result = self.importer.run('posts', posts)
+        self.assertEqual((result['imported'], result['rejected']), (2, 2))
+        post = Post.get(Post.body == '*one*')
+        self.assertEqual(post.author_id, ann.id)
+        self.assertEqual(post.body_html, '<p><em>one</em></p>')
+
+        comments = self.ndjson('comments.ndjson', [
+            {'id': 1, 'post': 3, 'author': 8, 'body': 'nice'}])
+        self.importer.run('comments', comments)
+        self.assertEqual(Comment.get().post_id, post.id)
+
+        follows = self.write('follows.ndjson',
+                             '{"follower": 7, "followed": 8}\n'
+                             '{"follower": 7, "followed": 7}\n'
+                             'not json\n')
+        result = self.importer.run('follows', follows, defer_indexes=True)
+        self.assertEqual((result['imported'], result['rejected']), (1, 1))
+        self.assertTrue(ann.is_following(User.get(User.username == 'bob')))
+        self.assertEqual(Follow.select().count(), 1)
+        self.assertTrue(any('follows.ndjson:3' in m for m in self.messages))
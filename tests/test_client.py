@@ -1,9 +1,15 @@
+import importlib
+import json
 import re
 import unittest
 
+import peewee as pw
+
 from flask import url_for
-from app import create_app, db
-from app.models import User, Role
+from app import create_app, db, fragment_cache, availability
+from app.models import User, Role, Post, Comment, Change
+
+from query_budget import max_queries
 
 
 class FlaskClientTestCase(unittest.TestCase):
@@ -52,3 +58,230 @@ class FlaskClientTestCase(unittest.TestCase):
         response = self.client.get(url_for('auth.logout'),
                                    follow_redirects=True)
         self.assertTrue(b'You have been logged out' in response.data)
+
+    def test_availability(self):
+        def available(**kwargs):
+            response = self.client.get(url_for('auth.available', **kwargs))
+            self.assertTrue(response.status_code == 200)
+            return json.loads(response.data.decode('utf-8'))['available']
+
+        response = self.client.post(
+            url_for('auth.register'),
+            data={'email': 'john@example.com', 'username': 'john',
+                  'password': 'cat', 'password2': 'cat'})
+        self.assertTrue(response.status_code == 302)
+        self.assertFalse(available(username='john'))
+        self.assertFalse(available(email='john@example.com'))
+
+        # free names are answered by the Bloom filter alone
+        with max_queries(0):
+            self.assertTrue(available(username='mary'))
+            self.assertTrue(available(email='mary@example.com'))
+        # the filter is case insensitive, the check is not
+        confirmed = availability.confirmed
+        self.assertTrue(available(username='JOHN'))
+        self.assertEqual(availability.confirmed, confirmed + 1)
+
+        # users saved later are added to the filter
+        u = User(email='susan@example.com', username='susan', password='dog')
+        u.save()
+        self.assertFalse(available(username='susan'))
+        response = self.client.post(
+            url_for('auth.register'),
+            data={'email': 'susan@example.com', 'username': 'sue',
+                  'password': 'cat', 'password2': 'cat'})
+        self.assertTrue(response.status_code == 200)
+        self.assertTrue(b'Email already registered.' in response.data)
+
+        response = self.client.get(url_for('auth.available'))
+        self.assertTrue(response.status_code == 400)
+
+        # users saved while the filters are rebuilt are not lost
+        module = importlib.import_module('app.availability')
+        BloomFilter = module.BloomFilter
+
+        class Racing(BloomFilter):
+            @classmethod
+            def from_items(cls, items, **kwargs):
+                if not User.select().where(User.username == 'tom').exists():
+                    User(email='tom@example.com', username='tom',
+                         password='cat').save()
+                return BloomFilter.from_items(items, **kwargs)
+        availability.loaded = None
+        module.BloomFilter = Racing
+        try:
+            self.assertFalse(available(username='tom'))
+        finally:
+            module.BloomFilter = BloomFilter
+        with max_queries(0):
+            self.assertTrue('tom' in availability.filters['username'])
+
+    def test_edit_profile_admin_conflict(self):
+        admin = User(email=self.app.config['FLASKR_ADMIN'], username='admin',
+                     password='cat', confirmed=True)
+        admin.save()
+        john = User(email='john@example.com', username='john',
+                    password='cat', confirmed=True)
+        john.save()
+        self.client.post(url_for('auth.login'),
+                         data={'email': admin.email, 'password': 'cat'})
+
+        # taken between the form validation and the save
+        availability.taken = lambda kind, value: False
+        try:
+            response = self.client.post(
+                url_for('main.edit_profile_admin', id=john.id),
+                data={'email': admin.email, 'username': 'john',
+                      'confirmed': 'y', 'role': john.role_id,
+                      'name': '', 'location': '', 'about_me': ''})
+        finally:
+            del availability.taken
+        self.assertTrue(response.status_code == 200)
+        self.assertTrue(b'Email or username already in use.' in response.data)
+        self.assertEqual(User.get(User.id == john.id).email,
+                         'john@example.com')
+
+    def test_page_cache(self):
+        self.app.config['FLASKR_PAGE_CACHE'] = True
+        response = self.client.get(url_for('main.index'))
+        self.assertEqual(response.headers.get('X-Cache'), 'MISS')
+        response = self.client.get(url_for('main.index'))
+        self.assertEqual(response.headers.get('X-Cache'), 'HIT')
+
+        # writing a post invalidates the pages listing posts
+        u = User(email='john@example.com', username='john', password='cat')
+        u.save()
+        post = Post(body='cached?', author=u)
+        post.save()
+        response = self.client.get(url_for('main.index'))
+        self.assertEqual(response.headers.get('X-Cache'), 'MISS')
+        self.assertTrue(b'cached?' in response.data)
+
+        # a comment invalidates the page of the post author
+        url = url_for('main.user', username='john')
+        self.client.get(url)
+        response = self.client.get(url)
+        self.assertEqual(response.headers.get('X-Cache'), 'HIT')
+        susan = User(email='susan@example.com', username='susan',
+                     password='dog')
+        susan.save()
+        comment = Comment(body='comment', author=susan, post=post.id)
+        comment.save()
+        comment.update_body_html()
+        response = self.client.get(url)
+        self.assertEqual(response.headers.get('X-Cache'), 'MISS')
+
+        # a comment without a post has no post author to invalidate
+        Comment(body='orphan', author=susan).save()
+
+    def test_fragment_cache(self):
+        self.app.config['FLASKR_FRAGMENT_CACHE'] = True
+        u = User(email='john@example.com', username='john', password='cat')
+        u.save()
+        post = Post(body='first', author=u)
+        post.save()
+        post.update_body_html()
+        self.client.get(url_for('main.index'))
+        hits = fragment_cache.cache.hits
+        response = self.client.get(url_for('main.index'))
+        self.assertEqual(fragment_cache.cache.hits, hits + 1)
+        self.assertTrue(b'first' in response.data)
+
+        # editing the post renders it again
+        post = Post.get(Post.id == post.id)
+        post.body = 'second'
+        post.save()
+        post.update_body_html()
+        response = self.client.get(url_for('main.index'))
+        self.assertTrue(b'second' in response.data)
+        self.assertFalse(b'first' in response.data)
+
+    def test_event_stream(self):
+        self.app.config['FLASKR_EVENTS_HEARTBEAT'] = 0.01
+        u = User(email='john@example.com', username='john', password='cat')
+        u.save()
+        response = self.client.get(url_for('main.stream_events'),
+                                   buffered=False)
+        self.assertEqual(response.mimetype, 'text/event-stream')
+        chunks = (chunk.decode('utf-8') for chunk in response.response)
+        self.assertEqual(next(chunks), 'retry: 3000\n\n')
+        self.assertEqual(next(chunks), ': keepalive\n\n')
+        post = Post(body='live', author=u)
+        post.save()
+        event = next(chunks)
+        self.assertTrue(event.startswith('id: %d-0\nevent: post\n' % post.id))
+        response.close()
+
+        # resuming sends what was missed
+        response = self.client.get(url_for('main.stream_events'),
+                                   headers={'Last-Event-ID': '0-0'},
+                                   buffered=False)
+        chunks = (chunk.decode('utf-8') for chunk in response.response)
+        next(chunks)
+        self.assertTrue('event: post' in next(chunks))
+        response.close()
+
+    def test_bulk_moderation(self):
+        mod_role = Role.select().where(Role.name == 'Moderator').first()
+        mod = User(email='mod@example.com', username='mod', password='cat',
+                   confirmed=True, role=mod_role)
+        mod.save()
+        u = User(email='john@example.com', username='john', password='cat',
+                 confirmed=True)
+        u.save()
+        post = Post(body='post', author=u)
+        post.save()
+        comments = []
+        for body, author in [('one', u), ('two', u), ('three', mod)]:
+            comment = Comment(body=body, author=author, post=post)
+            comment.save()
+            comments.append(comment.id)
+        self.client.post(url_for('auth.login'), data={
+            'email': 'mod@example.com', 'password': 'cat'})
+
+        # everything starts in the unreviewed queue
+        response = self.client.get(url_for('main.moderate'))
+        self.assertEqual(response.data.count(b'name="ids"'), 3)
+
+        # by author
+        seq = Change.select(pw.fn.MAX(Change.seq)).scalar()
+        response = self.client.post(url_for('main.moderate_bulk'), data={
+            'author': 'john', 'disable': 'Disable'}, follow_redirects=True)
+        self.assertTrue(b'2 comments disabled.' in response.data)
+        self.assertEqual(Change.select().where(Change.seq > seq).count(), 2)
+        disabled = [c.id for c in Comment.select().where(Comment.disabled)]
+        self.assertEqual(sorted(disabled), comments[:2])
+        response = self.client.get(url_for('main.moderate', state='disabled'))
+        self.assertEqual(response.data.count(b'name="ids"'), 2)
+        response = self.client.get(url_for('main.moderate'))
+        self.assertEqual(response.data.count(b'name="ids"'), 1)
+
+        # already disabled comments are left alone
+        response = self.client.post(url_for('main.moderate_bulk'), data={
+            'author': 'john', 'disable': 'Disable'}, follow_redirects=True)
+        self.assertTrue(b'0 comments disabled.' in response.data)
+
+        # by id
+        response = self.client.post(url_for('main.moderate_bulk'), data={
+            'ids': [str(comments[0]), str(comments[2])], 'enable': 'Enable'},
+            follow_redirects=True)
+        self.assertTrue(b'2 comments enabled.' in response.data)
+        disabled = [c.id for c in Comment.select().where(Comment.disabled)]
+        self.assertEqual(disabled, [comments[1]])
+        self.assertEqual(
+            Comment.select().where(Comment.reviewed == False).count(), 0)
+
+        # nothing selected
+        response = self.client.post(url_for('main.moderate_bulk'), data={
+            'enable': 'Enable'}, follow_redirects=True)
+        self.assertTrue(b'Select comments' in response.data)
+        with self.assertRaises(ValueError):
+            Comment.moderate(True)
+
+        # a comment without a post is updated, logged and counted
+        orphan = Comment(body='orphan', author=u)
+        orphan.save()
+        seq = Change.select(pw.fn.MAX(Change.seq)).scalar()
+        self.assertEqual(Comment.moderate(True, ids=[orphan.id]), 1)
+        self.assertTrue(Comment.get(Comment.id == orphan.id).disabled)
+        self.assertEqual(Change.select().where(Change.seq > seq).count(), 1)
@@ -0,0 +1,245 @@
+import hashlib
+import json
+import random
+import unittest
+from base64 import b64encode
+from datetime import datetime, timedelta
+
+from flask import url_for
+from werkzeug.security import generate_password_hash
+
+from app import create_app, db
+from app.models import User, Role, Follow, Post, Comment
+
+from query_budget import max_queries
+
+
+class QueryBudgetTestCase(unittest.TestCase):
+    """Upper bounds on the number of SQL statements issued per route.
+
+    The budgets are the measured counts plus a small margin; pages that
+    still do per-row lookups (comment counts, author roles) carry a
+    per-row allowance in their budget.  Lower a budget when an N+1 is
+    removed so it cannot come back unnoticed.  Every request also checks
+    its status: an error page or a redirect to the login page runs
+    almost no queries and would pass any budget.
+    """
+
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.database.create_tables(db.models, safe=True)
+        Role.insert_roles()
+        self.client = self.app.test_client(use_cookies=True)
+        self.seed()
+
+    def tearDown(self):
+        db.database.drop_tables(db.models, safe=True)
+        self.app_context.pop()
+
+    def seed(self):
+        rng = random.Random(0)
+        roles = dict((r.name, r.id) for r in Role.select())
+        password_hash = generate_password_hash('cat')
+        now = datetime.utcnow()
+
+        users = [('john', 'User'), ('mod', 'Moderator'),
+                 ('admin', 'Administrator')]
+        users += [('user%02d' % i, 'User') for i in range(40)]
+        with db.database.atomic():
+            User.insert_many([
+                dict(email='%s@example.com' % name, username=name,
+                     password_hash=password_hash, confirmed=True,
+                     role=roles[role],
+                     avatar_hash=hashlib.md5(
+                         ('%s@example.com' % name).encode('utf-8'))
+                     .hexdigest())
+                for name, role in users]).execute()
+        ids = dict((u.username, u.id)
+                   for u in User.select(User.id, User.username))
+        self.john = ids['john']
+        others = [ids['user%02d' % i] for i in range(40)]
+
+        follows = [dict(follower=self.john, followed=i) for i in others[:20]]
+        follows += [dict(follower=i, followed=self.john)
+                    for i in others[10:35]]
+        posts = [dict(body='post by john', body_html='<p>post by john</p>',
+                      author=self.john, timestamp=now - timedelta(minutes=i))
+                 for i in range(20)]
+        posts += [dict(body='post', body_html='<p>post</p>',
+                       author=rng.choice(others),
+                       timestamp=now - timedelta(minutes=i, seconds=30))
+                  for i in range(100)]
+        with db.database.atomic():
+            Follow.insert_many(follows).execute()
+            Post.insert_many(posts).execute()
+        post_ids = [p.id for p in Post.select(Post.id)]
+        self.busy_post = (Post.select(Post.id)
+                          .where(Post.author == self.john)
+                          .order_by(Post.timestamp.desc()).first().id)
+
+        comments = [dict(body='comment', body_html='comment',
+                         author=rng.choice(others), post=self.busy_post,
+                         timestamp=now - timedelta(seconds=i))
+                    for i in range(35)]
+        comments += [dict(body='comment', body_html='comment',
+                          author=rng.choice(others),
+                          post=rng.choice(post_ids),
+                          timestamp=now - timedelta(minutes=i))
+                     for i in range(80)]
+        with db.database.atomic():
+            Comment.insert_many(comments).execute()
+        self.comment = Comment.select(Comment.id).first().id
+
+    def login(self, username):
+        self.client.post(url_for('auth.login'),
+                         data={'email': username + '@example.com',
+                               'password': 'cat'})
+
+    def check(self, limit, method, url, status=200, location=None,
+              **kwargs):
+        """Request `url` in at most `limit` queries and check the status,
+        and the redirect target when `location` is given."""
+        with max_queries(limit):
+            response = getattr(self.client, method)(url, **kwargs)
+        self.assertEqual(response.status_code, status)
+        if location is not None:
+            self.assertEqual(response.headers['Location'],
+                             url_for(location[0], _external=True,
+                                     **location[1]))
+        return response
+
+    def get_api_headers(self, username):
+        return {
+            'Authorization': 'Basic ' + b64encode(
+                (username + '@example.com:cat').encode('utf-8')
+            ).decode('utf-8'),
+            'Accept': 'application/json',
+            'Content-Type': 'application/json'
+        }
+
+    def test_main_anonymous(self):
+        self.check(35, 'get', url_for('main.index'))
+        self.check(56, 'get', url_for('main.user', username='john'))
+        self.check(40, 'get', url_for('main.post', id=self.busy_post))
+        self.check(40, 'get', url_for('main.post', id=self.busy_post,
+                                      page=-1))
+        self.check(32, 'get', url_for('main.followers', username='john'))
+        self.check(27, 'get', url_for('main.followed_by', username='john'))
+
+    def test_main_authenticated(self):
+        self.login('john')
+        self.check(42, 'get', url_for('main.index'))
+        self.check(5, 'get', url_for('main.show_followed'), 302,
+                   ('main.index', {}))
+        self.check(42, 'get', url_for('main.index'))
+        self.check(5, 'get', url_for('main.show_all'), 302,
+                   ('main.index', {}))
+        self.check(60, 'get', url_for('main.user', username='john'))
+        self.check(6, 'get', url_for('main.edit_profile'))
+        self.check(9, 'get', url_for('main.edit', id=self.busy_post))
+        # the write paths of the pages
+        self.check(14, 'post', url_for('main.index'), 302,
+                   ('main.index', {}), data={'body': 'new *post*'})
+        self.check(13, 'post', url_for('main.post', id=self.busy_post), 302,
+                   ('main.post', {'id': self.busy_post, 'page': -1}),
+                   data={'body': 'new comment'})
+        self.check(17, 'post', url_for('main.edit', id=self.busy_post), 302,
+                   ('main.post', {'id': self.busy_post}),
+                   data={'body': 'edited'})
+        self.check(8, 'post', url_for('main.edit_profile'), 302,
+                   ('main.user', {'username': 'john'}),
+                   data={'name': 'John', 'location': 'Lima',
+                         'about_me': 'about'})
+        self.assertEqual(Post.get(Post.id == self.busy_post).body, 'edited')
+        self.assertEqual(User.get(User.id == self.john).location, 'Lima')
+        self.check(12, 'get', url_for('main.follow', username='user39'),
+                   302, ('main.user', {'username': 'user39'}))
+        self.check(12, 'get', url_for('main.unfollow', username='user00'),
+                   302, ('main.user', {'username': 'user00'}))
+        self.assertTrue(User.get(User.id == self.john).is_following(
+            User.get(User.username == 'user39')))
+        self.assertFalse(User.get(User.id == self.john).is_following(
+            User.get(User.username == 'user00')))
+
+    def test_main_moderation(self):
+        self.login('mod')
+        queue = ('main.moderate', {'state': 'unreviewed', 'page': 1})
+        self.check(40, 'get', url_for('main.moderate'))
+        self.check(12, 'get', url_for('main.moderate_disable',
+                                      id=self.comment), 302, queue)
+        self.check(12, 'get', url_for('main.moderate_enable',
+                                      id=self.comment), 302, queue)
+        # one UPDATE per 500 comments
+        author = Comment.get(Comment.id == self.comment).author
+        self.check(13, 'post', url_for('main.moderate_bulk'), 302, queue,
+                   data={'author': author.username, 'disable': 'Disable'})
+        self.assertEqual(
+            Comment.select().where(Comment.disabled == True).count(),
+            Comment.select().where(Comment.author == author).count())
+
+    def test_main_admin(self):
+        self.login('admin')
+        self.check(10, 'get', url_for('main.edit_profile_admin',
+                                      id=self.john))
+
+    def test_auth(self):
+        self.check(1, 'get', url_for('auth.login'))
+        self.check(1, 'get', url_for('auth.register'))
+        self.check(7, 'post', url_for('auth.register'), 302,
+                   ('auth.login', {}),
+                   data={'email': 'new@example.com', 'username': 'new',
+                         'password': 'cat', 'password2': 'cat'})
+        self.check(1, 'get', url_for('auth.password_reset_request'))
+        token = User.get(User.id == self.john).generate_reset_token()
+        self.check(8, 'post', url_for('auth.password_reset',
+                                       token=token.decode('ascii')), 302,
+                   ('auth.login', {}),
+                   data={'email': 'john@example.com', 'password': 'dog',
+                         'password2': 'dog'})
+        self.check(3, 'post', url_for('auth.login'), 302,
+                   ('main.index', {}),
+                   data={'email': 'john@example.com', 'password': 'dog'})
+        self.check(5, 'get', url_for('auth.change_password'))
+        self.check(5, 'get', url_for('auth.change_email_request'))
+        self.check(5, 'get', url_for('auth.confirm', token='bad-token'),
+                   302, ('main.index', {}))
+        token = User.get(User.id == self.john).generate_email_change_token(
+            'johnny@example.com')
+        self.check(10, 'get', url_for('auth.change_email',
+                                      token=token.decode('ascii')), 302,
+                   ('main.index', {}))
+        self.assertTrue(User.select()
+                        .where(User.email == 'johnny@example.com').exists())
+        self.check(5, 'get', url_for('auth.logout'), 302,
+                   ('main.index', {}))
+
+    def test_api_reads(self):
+        headers = self.get_api_headers('john')
+        self.check(3, 'get', url_for('api.get_token'), headers=headers)
+        self.check(9, 'get', url_for('api.get_posts'), headers=headers)
+        self.check(8, 'get', url_for('api.get_post', id=self.busy_post),
+                   headers=headers)
+        self.check(5, 'get', url_for('api.get_user', id=self.john),
+                   headers=headers)
+        self.check(9, 'get', url_for('api.get_user_posts', id=self.john),
+                   headers=headers)
+        self.check(13, 'get', url_for('api.get_user_followed_posts',
+                                      id=self.john), headers=headers)
+        self.check(5, 'get', url_for('api.get_comments'), headers=headers)
+        self.check(4, 'get', url_for('api.get_comment', id=self.comment),
+                   headers=headers)
+        self.check(9, 'get', url_for('api.get_post_comments',
+                                     id=self.busy_post), headers=headers)
+
+    def test_api_writes(self):
+        headers = self.get_api_headers('john')
+        self.check(14, 'post', url_for('api.new_post'), 201,
+                   headers=headers, data=json.dumps({'body': 'new *post*'}))
+        self.check(17, 'put', url_for('api.edit_post', id=self.busy_post),
+                   headers=headers, data=json.dumps({'body': 'edited'}))
+        self.check(12, 'post', url_for('api.new_post_comment',
+                                       id=self.busy_post), 201,
+                   headers=headers,
+                   data=json.dumps({'body': 'new comment'}))
@@ -2,8 +2,8 @@ import unittest
 import time
 from datetime import datetime
 
-from app import create_app, db
-from app.models import User, AnonymousUser, Role, Permission, Follow
+from app import create_app, db, follow_graph
+from app.models import User, AnonymousUser, Role, Permission, Follow, Post
 
 
 class UserModelTestCase(unittest.TestCase):
@@ -154,20 +154,66 @@ class UserModelTestCase(unittest.TestCase):
         self.assertTrue(u1.is_following(u2))
         self.assertFalse(u1.is_followed_by(u2))
         self.assertTrue(u2.is_followed_by(u1))
-        self.assertTrue(u1.followed.count() == 2)
-        self.assertTrue(u2.followers.count() == 2)
+        self.assertTrue(u1.followed.count() == 1)
+        self.assertTrue(u2.followers.count() == 1)
         f = u1.followed[-1]
         self.assertTrue(f.followed == u2)
         self.assertTrue(timestamp_before <= f.timestamp <= timestamp_after)
         f = u2.followers[-1]
         self.assertTrue(f.follower == u1)
         u1.unfollow(u2)
-        self.assertTrue(u1.followed.count() == 1)
-        self.assertTrue(u2.followers.count() == 1)
-        self.assertTrue(Follow.select().count() == 2)
+        self.assertTrue(u1.followed.count() == 0)
+        self.assertTrue(u2.followers.count() == 0)
+        self.assertTrue(Follow.select().count() == 0)
         u2.follow(u1)
         u2.delete_instance()
-        self.assertTrue(Follow.select().count() == 1)
+        self.assertTrue(Follow.select().count() == 0)
+
+    def test_followed_posts(self):
+        u1 = User(email='lisa@example.com', username='lisa', password='cat')
+        u2 = User(email='dav@example.com', username='dav', password='dog')
+        u3 = User(email='ann@example.com', username='ann', password='dog')
+        u1.save()
+        u2.save()
+        u3.save()
+        for u in (u1, u2, u3):
+            Post(body='by %s' % u.username, author=u).save()
+        u1.follow(u2)
+
+        # the user's own posts are included without a self follow
+        self.assertFalse(u1.follow(u1))
+        self.assertEqual(Follow.select().count(), 1)
+        self.assertEqual(sorted(p.body for p in u1.followed_posts),
+                         ['by dav', 'by lisa'])
+        self.assertEqual(u1.followed_posts.count(), 2)
+        self.assertEqual([p.body for p in u3.followed_posts], ['by ann'])
+
+    def test_follow_graph(self):
+        u1 = User(email='lisa@example.com', username='lisa', password='cat')
+        u2 = User(email='dav@example.com', username='dav', password='dog')
+        u3 = User(email='ann@example.com', username='ann', password='dog')
+        u1.save()
+        u2.save()
+        u3.save()
+        u1.follow(u2)
+        self.assertEqual(u1.followed_among([u1.id, u2.id, u3.id]),
+                         set([u2.id]))
+
+        # a follow written elsewhere is missed until the graph reloads
+        Follow.insert(follower=u1, followed=u3).execute()
+        self.assertFalse(u1.is_following(u3))
+        follow_graph.invalidate()
+        self.assertTrue(u1.is_following(u3))
+
+        # follow and unfollow check the table and repair the graph
+        Follow.delete().where(Follow.follower == u1,
+                              Follow.followed == u3).execute()
+        self.assertTrue(u1.is_following(u3))
+        self.assertFalse(u1.unfollow(u3))
+        self.assertFalse(u1.is_following(u3))
+        self.assertTrue(u1.follow(u3))
+        self.assertTrue(u3.is_followed_by(u1))
+        self.assertFalse(u1.follow(u3))
 
     def test_to_json(self):
         u = User(email='mark@example.com', username='mark', password='cat')
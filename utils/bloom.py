@@ -0,0 +1,67 @@
+import hashlib
+import math
+import threading
+
+
+class BloomFilter(object):
+    """Set membership in a fixed bit array, with false positives only.
+
+    Sized for `capacity` items at a false positive rate of `error_rate`:
+    about 1.2 bytes per item at 1%.  The `hashes` bit positions of an
+    item come from one 128-bit BLAKE2b digest split in two halves, by
+    double hashing (Kirsch and Mitzenmacher).  Items cannot be removed;
+    once more than `capacity` items are added the false positive rate
+    grows and :attr:`saturated` is set, so the owner can rebuild it.
+
+    Lookups take no lock; additions do, since setting a bit is a
+    read-modify-write of its byte.
+    """
+
+    def __init__(self, capacity, error_rate=0.01):
+        capacity = max(int(capacity), 1)
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.size = max(8, int(math.ceil(
+            -capacity * math.log(error_rate) / math.log(2) ** 2)))
+        self.hashes = max(1, int(round(self.size / capacity * math.log(2))))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_items(cls, items, error_rate=0.01, headroom=2.0, minimum=1024):
+        """A filter of `items`, with room for `headroom` times as many."""
+        items = list(items)
+        bloom = cls(max(len(items) * headroom, minimum), error_rate)
+        bloom.update(items)
+        return bloom
+
+    def __len__(self):
+        return self.count
+
+    @property
+    def saturated(self):
+        return self.count > self.capacity
+
+    def _positions(self, item):
+        digest = hashlib.blake2b(item.encode('utf-8'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        size = self.size
+        return [(h1 + i * h2) % size for i in range(self.hashes)]
+
+    def add(self, item):
+        positions = self._positions(item)
+        with self._lock:
+            for i in positions:
+                self.bits[i >> 3] |= 1 << (i & 7)
+            self.count += 1
+
+    def update(self, items):
+        for item in items:
+            self.add(item)
+
+    def __contains__(self, item):
+        bits = self.bits
+        return all(bits[i >> 3] & (1 << (i & 7))
+                   for i in self._positions(item))
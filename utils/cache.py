@@ -0,0 +1,138 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class TTLCache(object):
+    """Thread-safe in-memory LRU cache with expiry and tag invalidation.
+
+    Entries expire `ttl` seconds after they are stored (never if `ttl` is
+    None) and the least recently used entry is evicted once the cache
+    holds `maxsize` entries.  An entry can carry tags, and
+    :meth:`invalidate` drops every entry tagged with any of the given tags.
+
+    :meth:`get_or_set` lets a single caller compute a missing entry while
+    concurrent callers asking for the same key wait for its result,
+    instead of all computing it at once.
+    """
+
+    def __init__(self, maxsize=1000, ttl=None, timer=time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.timer = timer
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._tags = {}
+        self._pending = {}
+        self._epoch = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return self.get(key, _missing) is not _missing
+
+    def _lookup(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return _missing
+        expires, value, tags = entry
+        if expires is not None and expires <= self.timer():
+            self._remove(key)
+            return _missing
+        self._entries.move_to_end(key)
+        return value
+
+    def _remove(self, key):
+        expires, value, tags = self._entries.pop(key)
+        for tag in tags:
+            keys = self._tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tags[tag]
+
+    def get(self, key, default=None):
+        with self._lock:
+            value = self._lookup(key)
+        return default if value is _missing else value
+
+    def set(self, key, value, tags=()):
+        with self._lock:
+            self._store(key, value, tags)
+
+    def _store(self, key, value, tags):
+        if key in self._entries:
+            self._remove(key)
+        expires = None if self.ttl is None else self.timer() + self.ttl
+        tags = frozenset(tags)
+        self._entries[key] = (expires, value, tags)
+        for tag in tags:
+            self._tags.setdefault(tag, set()).add(key)
+        while len(self._entries) > self.maxsize:
+            self._remove(next(iter(self._entries)))
+
+    def delete(self, key):
+        with self._lock:
+            self._epoch += 1
+            if key in self._entries:
+                self._remove(key)
+
+    def invalidate(self, *tags):
+        """Drop every entry tagged with one of `tags`."""
+        with self._lock:
+            self._epoch += 1
+            for tag in tags:
+                for key in list(self._tags.get(tag, ())):
+                    self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._epoch += 1
+            self._entries.clear()
+            self._tags.clear()
+
+    def get_or_set(self, key, func):
+        """Return ``(value, hit)`` for `key`, computing it on a miss.
+
+        `func` returns ``(value, tags)``; a value of None is returned to
+        the caller but not cached.  Only one caller computes a given key
+        at a time, the others wait for it and reuse its value.  A value
+        computed while an invalidation happened is not stored, since it
+        may already be stale.
+        """
+        while True:
+            with self._lock:
+                value = self._lookup(key)
+                if value is not _missing:
+                    self.hits += 1
+                    return value, True
+                pending = self._pending.get(key)
+                if pending is None:
+                    pending = self._pending[key] = threading.Event()
+                    epoch = self._epoch
+                    self.misses += 1
+                    break
+            pending.wait()
+            with self._lock:
+                value = self._lookup(key)
+                if value is not _missing:
+                    self.hits += 1
+                    return value, True
+            # the computing caller failed or did not cache its value
+
+        try:
+            value, tags = func()
+            with self._lock:
+                if value is not None and epoch == self._epoch:
+                    self._store(key, value, tags)
+        finally:
+            with self._lock:
+                del self._pending[key]
+            pending.set()
+        return value, False
+
+
+_missing = object()
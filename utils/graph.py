@@ -0,0 +1,118 @@
+from array import array
+import bisect
+import threading
+
+# unsigned 32-bit ids
+_TYPECODE = 'I'
+
+
+def _contains(ids, id):
+    i = bisect.bisect_left(ids, id)
+    return i < len(ids) and ids[i] == id
+
+
+class Digraph(object):
+    """Thread-safe in-memory directed graph of integer ids.
+
+    Every node has a sorted ``array('I')`` of its successors and one of
+    its predecessors, so an edge costs 8 bytes (4 in each direction) and
+    membership is a binary search.  Nodes cost about 300 bytes each in
+    array headers and dict slots: a million edges between 100,000 nodes
+    take 37 MB, between 10,000 nodes 11 MB, against about 100 MB for the
+    same graph as Python sets of ints.  Adding and removing an edge cost
+    an insertion into, or deletion from, two arrays: a ``memmove``, not
+    a sort.
+    """
+
+    def __init__(self):
+        self._out = {}
+        self._in = {}
+        self._edges = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return self._edges
+
+    def build(self, edges):
+        """Replace the content by `edges`, ``(source, target)`` pairs
+        sorted by source then target (as ``ORDER BY`` gives them)."""
+        out, in_ = {}, {}
+        count = 0
+        for source, target in edges:
+            successors = out.get(source)
+            if successors is None:
+                successors = out[source] = array(_TYPECODE)
+            predecessors = in_.get(target)
+            if predecessors is None:
+                predecessors = in_[target] = array(_TYPECODE)
+            # the sort order keeps both arrays sorted by appending
+            successors.append(target)
+            predecessors.append(source)
+            count += 1
+        with self._lock:
+            self._out, self._in, self._edges = out, in_, count
+
+    @staticmethod
+    def _insert(index, key, id):
+        ids = index.get(key)
+        if ids is None:
+            ids = index[key] = array(_TYPECODE)
+        i = bisect.bisect_left(ids, id)
+        if i < len(ids) and ids[i] == id:
+            return False
+        ids.insert(i, id)
+        return True
+
+    @staticmethod
+    def _delete(index, key, id):
+        ids = index.get(key)
+        if ids is None:
+            return False
+        i = bisect.bisect_left(ids, id)
+        if i == len(ids) or ids[i] != id:
+            return False
+        del ids[i]
+        if not ids:
+            del index[key]
+        return True
+
+    def add(self, source, target):
+        with self._lock:
+            if self._insert(self._out, source, target):
+                self._insert(self._in, target, source)
+                self._edges += 1
+
+    def remove(self, source, target):
+        with self._lock:
+            if self._delete(self._out, source, target):
+                self._delete(self._in, target, source)
+                self._edges -= 1
+
+    def has_edge(self, source, target):
+        with self._lock:
+            successors = self._out.get(source)
+            return successors is not None and _contains(successors, target)
+
+    def successors_in(self, source, ids):
+        """The set of `ids` that `source` has an edge to."""
+        with self._lock:
+            successors = self._out.get(source)
+            if successors is None:
+                return set()
+            return set(id for id in ids if _contains(successors, id))
+
+    def predecessors_in(self, target, ids):
+        """The set of `ids` that have an edge to `target`."""
+        with self._lock:
+            predecessors = self._in.get(target)
+            if predecessors is None:
+                return set()
+            return set(id for id in ids if _contains(predecessors, id))
+
+    def out_degree(self, source):
+        with self._lock:
+            return len(self._out.get(source, ()))
+
+    def in_degree(self, target):
+        with self._lock:
+            return len(self._in.get(target, ()))
@@ -0,0 +1,106 @@
+import bisect
+import heapq
+import threading
+from collections import OrderedDict
+
+# sorts after any character, so (prefix + _LAST,) bounds the prefix
+_LAST = '\U0010ffff'
+
+
+class PrefixIndex(object):
+    """Thread-safe in-memory index of names for prefix lookups.
+
+    Names are kept in a sorted list of ``(name.lower(), id)``, so the
+    names starting with a prefix are a contiguous slice found with
+    :mod:`bisect`.  :meth:`top` returns the `depth` heaviest names of the
+    slice; results are cached per prefix (at most `cache_size` of them)
+    and a change to a name only drops the cached prefixes of that name.
+    Adding, renaming and removing a name cost a list insertion, which is
+    a ``memmove`` of the list, not a sort.
+    """
+
+    def __init__(self, depth=10, cache_size=4096):
+        self.depth = depth
+        self.cache_size = cache_size
+        self._keys = []
+        self._entries = {}
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._keys)
+
+    def __contains__(self, id):
+        return id in self._entries
+
+    def build(self, entries):
+        """Replace the content by ``(id, name, weight)`` `entries`."""
+        entries = dict((id, ((name.lower(), id), name, weight))
+                       for id, name, weight in entries)
+        keys = sorted(key for key, name, weight in entries.values())
+        with self._lock:
+            self._entries = entries
+            self._keys = keys
+            self._cache.clear()
+
+    def _forget(self, key):
+        name = key[0]
+        for end in range(1, len(name) + 1):
+            self._cache.pop(name[:end], None)
+
+    def _remove(self, id):
+        entry = self._entries.pop(id, None)
+        if entry is not None:
+            key = entry[0]
+            del self._keys[bisect.bisect_left(self._keys, key)]
+            self._forget(key)
+        return entry
+
+    def set(self, id, name, weight=None):
+        """Add or rename `id`; `weight` defaults to the current one or 0."""
+        key = (name.lower(), id)
+        with self._lock:
+            entry = self._remove(id)
+            if weight is None:
+                weight = entry[2] if entry is not None else 0
+            self._entries[id] = (key, name, weight)
+            bisect.insort(self._keys, key)
+            self._forget(key)
+
+    def remove(self, id):
+        with self._lock:
+            self._remove(id)
+
+    def adjust(self, id, delta):
+        """Add `delta` to the weight of `id`, if it is indexed."""
+        with self._lock:
+            entry = self._entries.get(id)
+            if entry is not None:
+                key, name, weight = entry
+                self._entries[id] = (key, name, weight + delta)
+                self._forget(key)
+
+    def top(self, prefix, k=None):
+        """``(id, name, weight)`` of the heaviest names starting with
+        `prefix` (case insensitive), heaviest first, then by name."""
+        prefix = prefix.lower()
+        k = max(1, min(k or self.depth, self.depth))
+        if not prefix:
+            return []
+        with self._lock:
+            found = self._cache.get(prefix)
+            if found is not None:
+                self._cache.move_to_end(prefix)
+                return found[:k]
+            low = bisect.bisect_left(self._keys, (prefix,))
+            high = bisect.bisect_left(self._keys, (prefix + _LAST,), low)
+            entries = self._entries
+            best = heapq.nsmallest(
+                self.depth, (entries[key[1]] for key in
+                             self._keys[low:high]),
+                key=lambda entry: (-entry[2], entry[0]))
+            found = [(key[1], name, weight) for key, name, weight in best]
+            self._cache[prefix] = found
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+            return found[:k]
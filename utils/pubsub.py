@@ -0,0 +1,67 @@
+import queue
+import threading
+
+
+class Subscription(object):
+    """Messages published since :meth:`PubSub.subscribe`, in order.
+
+    At most `maxsize` messages are kept (unbounded when 0); when a slow
+    subscriber falls further behind, later messages are dropped and
+    `overflowed` is set, so it can resynchronize some other way.
+    """
+
+    def __init__(self, hub, maxsize=0):
+        self.hub = hub
+        self.queue = queue.Queue(maxsize)
+        self.overflowed = False
+
+    def put(self, message):
+        try:
+            self.queue.put_nowait(message)
+        except queue.Full:
+            self.overflowed = True
+
+    def get(self, timeout=None):
+        """Wait for the next message; raises :class:`queue.Empty`."""
+        return self.queue.get(timeout=timeout)
+
+    def close(self):
+        self.hub.unsubscribe(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class PubSub(object):
+    """In-process publish/subscribe hub.
+
+    Publishing never blocks: every subscriber has its own queue.  With
+    gevent or eventlet monkey patching, waiting on a subscription only
+    suspends the current greenlet.
+    """
+
+    def __init__(self):
+        self._subscribers = set()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._subscribers)
+
+    def subscribe(self, maxsize=0):
+        subscription = Subscription(self, maxsize)
+        with self._lock:
+            self._subscribers.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscribers.discard(subscription)
+
+    def publish(self, message):
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for subscription in subscribers:
+            subscription.put(message)